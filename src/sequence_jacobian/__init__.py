@@ -7,9 +7,11 @@ from .blocks.het_block import het
 from .blocks.solved_block import solved
 from .blocks.combined_block import combine, create_model
 from .blocks.support.simple_displacement import apply_function
+from .blocks.support.het_compiled import set_threading
 from .classes.steady_state_dict import SteadyStateDict
 from .classes.impulse_dict import ImpulseDict
 from .classes.jacobian_dict import JacobianDict
+from .classes.jacobian_cache import JacobianCache
 from .utilities.drawdag import drawdag
 
 # Ensure warning uniformity across package
@@ -1,5 +1,6 @@
 """Primitives to provide clarity and structure on blocks/models work"""
 
+import warnings
 import numpy as np
 from numbers import Real
 from typing import Any, Dict, Union, Tuple, Optional, List
@@ -7,11 +8,11 @@ from copy import deepcopy
 
 from .support.steady_state import provide_solver_default, solve_for_unknowns, compute_target_values
 from .support.parent import Parent
-from ..utilities import misc
+from ..utilities import misc, parallel
 from ..utilities.function import input_defaults
 from ..utilities.bijection import Bijection
 from ..utilities.ordered_set import OrderedSet
-from ..classes import SteadyStateDict, UserProvidedSS, ImpulseDict, JacobianDict, FactoredJacobianDict
+from ..classes import SteadyStateDict, UserProvidedSS, ImpulseDict, JacobianDict, FactoredJacobianDict, BroydenJacobianDict
 
 Array = Any
 
@@ -25,6 +26,9 @@ class Block:
         self.impulse_nonlinear_options = self.input_defaults_smart('_impulse_nonlinear')
         self.impulse_linear_options = self.input_defaults_smart('_impulse_linear')
         self.jacobian_options = self.input_defaults_smart('_jacobian')
+        if not isinstance(self, Parent):
+            # leaf Jacobians can be served from a persistent JacobianCache, see Block.jacobian
+            self.jacobian_options['cache'] = None
         self.partial_jacobians_options = self.input_defaults_smart('_partial_jacobians')
     
     def inputs(self):
@@ -127,7 +131,11 @@ class Block:
         
         # if it's a leaf, call Jacobian method, don't supply Js
         if not isinstance(self, Parent):
-            return self.M @ self._jacobian(self.M.inv @ ss, self.M.inv @ inputs, self.M.inv @ outputs, T, **own_options)
+            cache = own_options.pop('cache', None)
+            compute = lambda: self.M @ self._jacobian(self.M.inv @ ss, self.M.inv @ inputs, self.M.inv @ outputs, T, **own_options)
+            if cache is not None:
+                return cache.jacobian(self, ss, inputs, outputs, T, own_options, compute)
+            return compute()
         
         # otherwise remap own J (currently needed for SolvedBlock only)
         Js = Js.copy()
@@ -145,34 +153,44 @@ class Block:
         """Evaluate a general equilibrium steady state of Block given a `calibration`
         and a set of `unknowns` and `targets` corresponding to the endogenous variables to be solved for and
         the target conditions that must hold in general equilibrium"""
-        options = self.get_options(options, kwargs, 'solve_steady_state')
+        own_options = self.get_options(options, kwargs, 'solve_steady_state')
 
         ss =  SteadyStateDict(calibration)
 
-        solver = options['solver'] if options['solver'] else provide_solver_default(unknowns)
+        solver = own_options['solver'] if own_options['solver'] else provide_solver_default(unknowns)
 
         def residual(unknown_values, unknowns_keys=unknowns.keys(), targets=targets):
             ss.update(misc.smart_zip(unknowns_keys, unknown_values))
+            # pass on per-block options, e.g. {'hh': {'warm_start': True}}, to the blocks being evaluated
             ss.update(self.steady_state(ss, dissolve=dissolve, options=options, **kwargs))
             return compute_target_values(targets, ss)
 
-        _ = solve_for_unknowns(residual, unknowns, solver, options['solver_kwargs'],
-                               tol=options['ttol'], verbose=options['verbose'],
-                               constrained_method=options['constrained_method'],
-                               constrained_kwargs=options['constrained_kwargs'])
+        _ = solve_for_unknowns(residual, unknowns, solver, own_options['solver_kwargs'],
+                               tol=own_options['ttol'], verbose=own_options['verbose'],
+                               constrained_method=own_options['constrained_method'],
+                               constrained_kwargs=own_options['constrained_kwargs'])
 
         return ss
 
-    solve_impulse_nonlinear_options = dict(tol=1E-8, maxit=30, verbose=True)
+    solve_impulse_nonlinear_options = dict(tol=1E-8, maxit=30, verbose=True, broyden=False, line_search=False, log=None)
 
     def solve_impulse_nonlinear(self, ss: SteadyStateDict, unknowns: List[str], targets: List[str],
                                 inputs: Union[Dict[str, Array], ImpulseDict], outputs: Optional[List[str]] = None,
                                 internals: Union[Dict[str, List[str]], List[str]] = {}, Js: Dict[str, JacobianDict] = {}, 
                                 options: Dict[str, dict] = {}, H_U_factored: Optional[FactoredJacobianDict] = None,
-                                ss_initial: Optional[SteadyStateDict] = None, **kwargs) -> ImpulseDict:
+                                ss_initial: Optional[SteadyStateDict] = None,
+                                U_init: Optional[Union[Dict[str, Array], ImpulseDict]] = None, **kwargs) -> ImpulseDict:
         """Calculate a general equilibrium, non-linear impulse response to a set of shocks in `inputs` 
            around a steady state `ss`, given a set of `unknowns` and `targets` corresponding to the endogenous
-           variables to be solved for and the `targets` that must hold in general equilibrium"""
+           variables to be solved for and the `targets` that must hold in general equilibrium. Newton's method
+           starts from paths `U_init` for the unknowns if given (e.g. the solution for a similar shock), and from
+           zeros otherwise.
+
+           Options: with `broyden=True`, Newton's method uses the steady-state Jacobian H_U only as the initial
+           guess for a quasi-Newton (Broyden) approximation updated after each step. With `line_search=True`,
+           steps are halved whenever they make the nonlinear evaluation fail or give non-finite values. If
+           `log` is a list, a dict with the iteration, the max error for each target, the step length taken and
+           the cumulative number of nonlinear evaluations is appended to it for each iteration."""
         inputs = ImpulseDict(inputs)
         unknowns, targets = OrderedSet(unknowns), OrderedSet(targets)
 
@@ -187,28 +205,181 @@ class Block:
             H_U = self.jacobian(ss, unknowns, targets, T, Js, options, **kwargs)
             H_U_factored = FactoredJacobianDict(H_U, T)
 
-        options = self.get_options(options, kwargs, 'solve_impulse_nonlinear')
+        own_options = self.get_options(options, kwargs, 'solve_impulse_nonlinear')
+        H_U_approx = BroydenJacobianDict(H_U_factored) if own_options['broyden'] else H_U_factored
+
+        def evaluate(U):
+            return self.impulse_nonlinear(ss, inputs | U, actual_outputs | targets, internals, Js, options, ss_initial, **kwargs)
 
         # Newton's method
-        U = ImpulseDict({k: np.zeros(T) for k in unknowns})
-        if options['verbose']:
+        U = ImpulseDict({k: np.zeros(T) for k in unknowns}) if U_init is None else ImpulseDict(U_init).get(unknowns)
+        if own_options['verbose']:
             print(f'Solving {self.name} for {unknowns} to hit {targets}')
-        for it in range(options['maxit']):
-            results = self.impulse_nonlinear(ss, inputs | U, actual_outputs | targets, internals, Js, options, ss_initial, **kwargs)
+        results, step, evaluations = evaluate(U), None, 1
+        for it in range(own_options['maxit']):
+            if it > 0:
+                dU = H_U_approx.apply(results)
+                U_new, results_new, step, n = self.newton_line_search(evaluate, U, dU, own_options['line_search'])
+                evaluations += n
+                if own_options['broyden']:
+                    H_U_approx.update(U_new - U, results_new.get(targets) - results.get(targets))
+                U, results = U_new, results_new
+
             errors = {k: np.max(np.abs(results[k])) for k in targets}
-            if options['verbose']:
+            if own_options['verbose']:
                 print(f'On iteration {it}')
                 for k in errors:
                     print(f'   max error for {k} is {errors[k]:.2E}')
-            if all(v < options['tol'] for v in errors.values()):
+            if own_options['log'] is not None:
+                own_options['log'].append(dict(iteration=it, errors=errors, step=step, evaluations=evaluations))
+            if all(v < own_options['tol'] for v in errors.values()):
                 break
-            else:
-                U += H_U_factored.apply(results)
         else:
-            raise ValueError(f'No convergence after {options["maxit"]} backward iterations!')
+            raise ValueError(f'No convergence after {own_options["maxit"]} backward iterations!')
 
         return (inputs | U)[inputs_as_outputs] | results
 
+    @staticmethod
+    def newton_line_search(evaluate, U, dU, line_search, max_halvings=10):
+        """Evaluate at U + step*dU, starting with step=1 and, if 'line_search', halving it whenever evaluation
+        raises an error or gives non-finite results. Returns new U and results, the step and the number of
+        evaluations."""
+        step = 1.
+        for n in range(1, max_halvings + 2):
+            U_new = U + step * dU
+            try:
+                results_new = evaluate(U_new)
+            except Exception:
+                if not line_search or n == max_halvings + 1:
+                    raise
+            else:
+                if not line_search or n == max_halvings + 1 or all(np.all(np.isfinite(v)) for v in results_new.toplevel.values()):
+                    return U_new, results_new, step, n
+            step /= 2
+
+    solve_impulse_nonlinear_continuation_options = dict(first_step=1., min_step=1/64, fast_iterations=4,
+                                                        slow_iterations=10, path=None, verbose=True)
+
+    def solve_impulse_nonlinear_continuation(self, ss: SteadyStateDict, unknowns: List[str], targets: List[str],
+                                             inputs: Union[Dict[str, Array], ImpulseDict], outputs: Optional[List[str]] = None,
+                                             internals: Union[Dict[str, List[str]], List[str]] = {},
+                                             Js: Dict[str, JacobianDict] = {}, options: Dict[str, dict] = {},
+                                             H_U_factored: Optional[FactoredJacobianDict] = None,
+                                             ss_initial: Optional[SteadyStateDict] = None,
+                                             U_init: Optional[Union[Dict[str, Array], ImpulseDict]] = None,
+                                             **kwargs) -> ImpulseDict:
+        """Like solve_impulse_nonlinear, but reaching the shocks in `inputs` by continuation, solving for shocks
+           scaled by an increasing sequence of factors up to 1, each time starting from the unknowns at the last
+           solution. Useful for large shocks for which Newton's method diverges when starting from zeros.
+
+           Options: the first attempted scale is `first_step`. Whenever a solution fails, the step since the last
+           solution is halved, down to `min_step`. After a solution, the step is doubled if it took at most
+           `fast_iterations` Newton iterations, and halved if it took more than `slow_iterations`. If `path` is a
+           list, a tuple of scale and ImpulseDict of unknowns is appended to it for each solution, so that these
+           can be reused later as `U_init`. Other options are passed on to solve_impulse_nonlinear."""
+        inputs = ImpulseDict(inputs)
+        unknowns, targets = OrderedSet(unknowns), OrderedSet(targets)
+        own_options = self.get_options(options, kwargs, 'solve_impulse_nonlinear_continuation')
+        kwargs = {k: v for k, v in kwargs.items() if k not in own_options and k != 'log'}
+
+        # Jacobians do not depend on the scale, so only get them once
+        input_names = self.make_ordered_set(inputs)
+        actual_outputs, _ = self.process_outputs(ss, input_names | unknowns, self.make_ordered_set(outputs))
+        Js = self.partial_jacobians(ss, input_names | unknowns, (actual_outputs | targets) - unknowns, inputs.T, Js, options, **kwargs)
+        if H_U_factored is None:
+            H_U_factored = FactoredJacobianDict(self.jacobian(ss, unknowns, targets, inputs.T, Js, options, **kwargs), inputs.T)
+
+        # unknowns are always needed in results, to start from at the next scale
+        solve_outputs = None if outputs is None else unknowns | self.make_ordered_set(outputs)
+        scale, step = 0., own_options['first_step']
+        U = U_init
+        while scale < 1:
+            new_scale = min(scale + step, 1.)
+            log = []
+            try:
+                results = self.solve_impulse_nonlinear(ss, unknowns, targets, new_scale * inputs, solve_outputs, internals,
+                                                       Js, options, H_U_factored, ss_initial, U, log=log, verbose=False,
+                                                       **kwargs)
+            except Exception as e:
+                if own_options['verbose']:
+                    print(f'Failed at scale {new_scale:.4g} ({type(e).__name__}: {e})')
+                step /= 2
+                if step < own_options['min_step']:
+                    raise ValueError(f'No convergence beyond scale {scale:.4g} with steps down to {own_options["min_step"]:.4g}') from e
+                continue
+
+            scale, U = new_scale, results[unknowns]
+            if own_options['verbose']:
+                print(f'Solved at scale {scale:.4g} after {len(log)} iterations')
+            if own_options['path'] is not None:
+                own_options['path'].append((scale, U))
+            if len(log) <= own_options['fast_iterations']:
+                step *= 2
+            elif len(log) > own_options['slow_iterations']:
+                step /= 2
+
+        return results
+
+    def solve_impulse_nonlinear_many(self, ss: SteadyStateDict, unknowns: List[str], targets: List[str],
+                                     inputs: List[Union[Dict[str, Array], ImpulseDict]], outputs: Optional[List[str]] = None,
+                                     Js: Dict[str, JacobianDict] = {}, options: Dict[str, dict] = {},
+                                     H_U_factored: Optional[FactoredJacobianDict] = None,
+                                     ss_initial: Optional[SteadyStateDict] = None, n_workers: int = 1,
+                                     stack: bool = False, **kwargs) -> Union[List[Optional[ImpulseDict]], ImpulseDict]:
+        """Calculate general equilibrium, non-linear impulse responses for each of a list of scenarios `inputs`,
+           all of the same length T, computing partial Jacobians and the factored H_U only once.
+
+           With `n_workers > 1`, scenarios are solved in a pool of processes, with the steady state, Jacobians and
+           LU factors passed to workers once through shared memory. A scenario that fails (e.g. because Newton's
+           method does not converge) does not stop the others: it is reported in a warning and its result is None,
+           or nan if `stack=True`, in which case a single ImpulseDict of (S, T) arrays is returned instead of a list.
+           Other options are passed to solve_impulse_nonlinear for each scenario, with verbose=False by default."""
+        inputs = [ImpulseDict(i) for i in inputs]
+        T = inputs[0].T
+        if any(i.T != T for i in inputs):
+            raise ValueError(f'All scenarios must have the same length T={T}')
+        unknowns, targets = OrderedSet(unknowns), OrderedSet(targets)
+        kwargs.setdefault('verbose', False)
+
+        # every scenario shocks the same inputs, with zeros where not specified
+        input_names = OrderedSet([k for i in inputs for k in i.toplevel])
+        inputs = [i.get(input_names) for i in inputs]
+        actual_outputs, inputs_as_outputs = self.process_outputs(ss, input_names | unknowns, self.make_ordered_set(outputs))
+        names = list(inputs_as_outputs | actual_outputs | targets)
+
+        Js = self.partial_jacobians(ss, input_names | unknowns, (actual_outputs | targets) - unknowns, T, Js, options, **kwargs)
+        if H_U_factored is None:
+            H_U_factored = FactoredJacobianDict(self.jacobian(ss, unknowns, targets, T, Js, options, **kwargs), T)
+
+        args = (ss, unknowns, targets, names, Js, options, H_U_factored, ss_initial, kwargs)
+        if n_workers > 1:
+            errors, paths = parallel.pool_map(self.solve_impulse_nonlinear_scenario, inputs, args,
+                                              (len(names), T), n_workers)
+        else:
+            errors, paths = zip(*(self.solve_impulse_nonlinear_scenario(i, *args) for i in inputs))
+            paths = np.stack(paths)
+
+        failed = {s: e for s, e in enumerate(errors) if e is not None}
+        if failed:
+            warnings.warn(f'{len(failed)} of {len(inputs)} scenarios failed:\n'
+                          + '\n'.join(f'   scenario {s}: {e}' for s, e in failed.items()))
+
+        if stack:
+            return ImpulseDict({k: paths[:, j] for j, k in enumerate(names)}, T=T)
+        return [None if s in failed else ImpulseDict({k: paths[s, j] for j, k in enumerate(names)}, T=T)
+                for s in range(len(inputs))]
+
+    def solve_impulse_nonlinear_scenario(self, inputs, ss, unknowns, targets, names, Js, options, H_U_factored,
+                                         ss_initial, kwargs):
+        """Solve one scenario for solve_impulse_nonlinear_many, returning error message (None if successful) and
+        (len(names), T) array of paths, which are nan if unsuccessful"""
+        try:
+            td = self.solve_impulse_nonlinear(ss, unknowns, targets, inputs, names, Js=Js, options=options,
+                                              H_U_factored=H_U_factored, ss_initial=ss_initial, **kwargs)
+            return None, np.stack([td.get(k) for k in names])
+        except Exception as e:
+            return f'{type(e).__name__}: {e}', np.full((len(names), inputs.T), np.nan)
+
     solve_impulse_linear_options = {}
 
     def solve_impulse_linear(self, ss: SteadyStateDict, unknowns: List[str], targets: List[str],
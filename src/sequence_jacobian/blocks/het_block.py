@@ -1,14 +1,22 @@
+import os
 import copy
+import tempfile
+import warnings
+import tracemalloc
 import numpy as np
+from numba.core.errors import TypingError, UnsupportedError
 from typing import Optional, Dict
 
 from .block import Block
 from .. import utilities as utils
-from ..classes import SteadyStateDict, ImpulseDict, JacobianDict
+from ..classes import SteadyStateDict, ImpulseDict, JacobianDict, QuasiToeplitz
 from ..utilities.function import ExtendedFunction, CombinedExtendedFunction
 from ..utilities.ordered_set import OrderedSet
 from ..utilities.bijection import Bijection
-from .support.het_support import ForwardShockableTransition, ExpectationShockableTransition, lottery_1d, lottery_2d, Markov, CombinedTransition, Transition
+from .support.fake_news import FakeNewsJacobian
+from .support.compiled_transition import CompiledTransition
+from .support.steady_state import WarmStart, warm_start_signature
+from .support.het_support import ForwardShockableTransition, ExpectationShockableTransition, lottery_1d, lottery_2d, lottery_nd, Markov, CombinedTransition, Transition
 
 
 def het(exogenous, policy, backward, backward_init=None, hetinputs=None, hetoutputs=None):
@@ -52,10 +60,13 @@ class HetBlock(Block):
             backward_init = ExtendedFunction(backward_init)
         self.backward_init = backward_init
 
-    def static_checks(self):
-        if len(self.policy) > 2:
-            raise ValueError(f"More than two endogenous policies in {self.name}, not yet supported")
+        # results of last steady state with warm_start=True, see _steady_state
+        self._warm_start = None
+
+        # CompiledTransitions (or reasons for not having them) used with compiled=True, see _impulse_nonlinear
+        self._compiled_transitions = {}
 
+    def static_checks(self):
         for pol in self.policy:
             if pol not in self.backward_fun.outputs:
                 raise ValueError(f"Policy '{pol}' not included as output in {self.name}")
@@ -86,14 +97,27 @@ class HetBlock(Block):
             return f"<HetBlock '{self.name}'>"
 
     def _steady_state(self, calibration, backward_tol=1E-8, backward_maxit=5000,
-                      forward_tol=1E-10, forward_maxit=100_000):
+                      forward_tol=1E-10, forward_maxit=100_000, forward_method='iteration',
+                      backward_accelerator=None, backward_accelerator_kwargs=None, warm_start=False, verbose=False):
         ss = self.extract_ss_dict(calibration)
         self.update_with_hetinputs(ss)
+        if warm_start:
+            # seed backward and forward iterations with results of last steady state, if compatible, and
+            # tighten tolerances so that results hardly depend on the seed (see WarmStart)
+            backward_tol, forward_tol = backward_tol * WarmStart.tol_factor, forward_tol * WarmStart.tol_factor
+            signature = warm_start_signature(ss)
+            if self._warm_start is not None and self._warm_start.matches(signature):
+                ss.update({k: v for k, v in self._warm_start.backward.items() if k not in ss})
+                if 'Dbeg' not in ss:
+                    ss['Dbeg'] = self._warm_start.D
         self.initialize_backward(ss)
 
-        ss = self.backward_steady_state(ss, tol=backward_tol, maxit=backward_maxit)
-        Dbeg, D = self.forward_steady_state(ss, forward_tol, forward_maxit)
+        ss = self.backward_steady_state(ss, tol=backward_tol, maxit=backward_maxit, accelerator=backward_accelerator,
+                                        accelerator_kwargs=backward_accelerator_kwargs, verbose=verbose)
+        Dbeg, D = self.forward_steady_state(ss, forward_tol, forward_maxit, forward_method)
         ss.update({'Dbeg': Dbeg, "D": D})
+        if warm_start:
+            self._warm_start = WarmStart(signature, {k: ss[k] for k in self.backward}, Dbeg)
 
         self.update_with_hetoutputs(ss)
 
@@ -107,12 +131,28 @@ class HetBlock(Block):
         return SteadyStateDict({k: ss[k] for k in ss if k not in self.internals},
                                {self.name: {k: ss[k] for k in ss if k in self.internals}})
 
-    def _impulse_nonlinear(self, ssin, inputs, outputs, internals, ss_initial, monotonic=False):
+    def _impulse_nonlinear(self, ssin, inputs, outputs, internals, ss_initial, monotonic=None, low_memory=False,
+                           compiled=False):
         ss = self.extract_ss_dict(ssin)
         if ss_initial is not None:
             # only effect of distinct initial ss on hetblock is different initial distribution
             ss['Dbeg'] = ss_initial.internals[self.name]['Dbeg']
 
+        if compiled:
+            # whole transition in one njitted function, falling back to the below if this is not possible
+            aggregates = self.impulse_nonlinear_compiled(ss, inputs, outputs, internals, monotonic)
+            if aggregates is not None:
+                return ImpulseDict(aggregates, {self.name: {}}, inputs.T) - ssin
+
+        if low_memory:
+            # only store expectations of backward variables, recomputing all else while aggregating
+            expectations_path, individual_paths, exog_path = self.backward_nonlinear_low_memory(ss, inputs, internals)
+            aggregates, distribution_paths = self.forward_nonlinear_low_memory(ss, inputs, expectations_path,
+                                                                               exog_path, outputs, internals, monotonic)
+            individual_paths.update(distribution_paths)
+            internals_dict = {self.name: {k: individual_paths[k] for k in internals}}
+            return ImpulseDict(aggregates, internals_dict, inputs.T) - ssin
+
         # identify individual variable paths we want from backward iteration, then run it
         toreturn = self.non_backward_outputs
         if self.hetoutputs is not None:
@@ -132,78 +172,186 @@ class HetBlock(Block):
         internals_dict = {self.name: {k: individual_paths[k] for k in internals}}
         return ImpulseDict(aggregates, internals_dict, inputs.T) - ssin
 
+    def impulse_nonlinear_batch(self, ss, inputs, outputs=None, monotonic=None, max_batch=None):
+        """Nonlinear impulse responses for S scenarios at once, where each inputs[k] is an (S, T) array
+        with the path of input k in each scenario. Returns list of S ImpulseDicts, as from impulse_nonlinear.
+
+        Each period's backward and forward step is taken for all scenarios together, with a leading
+        scenario axis: shocked inputs are passed to backward_fun as arrays of shape (S, 1, ..., 1), and
+        hetinputs depending on them are stacked along this axis. This requires backward_fun and hetoutputs
+        to broadcast over the scenario axis (e.g. y[..., np.newaxis] rather than y[:, np.newaxis]) and no
+        exogenous Markov matrix to be shocked. This is checked in the first period, and if it fails, the
+        scenarios are run one at a time by impulse_nonlinear. Scenarios are processed in chunks of at
+        most 'max_batch', since memory use is proportional to the number of scenarios in a chunk."""
+        inputs = {k: np.asarray(v) for k, v in inputs.items()}
+        S, T = next(iter(inputs.values())).shape[:2]
+        if max_batch is not None and S > max_batch:
+            return [impulse for start in range(0, S, max_batch) for impulse in self.impulse_nonlinear_batch(
+                        ss, {k: v[start:start+max_batch] for k, v in inputs.items()}, outputs, monotonic)]
+
+        actual_outputs, inputs_as_outputs = self.process_outputs(ss, self.make_ordered_set(inputs),
+                                                                 self.make_ordered_set(outputs))
+        try:
+            aggregates = self.nonlinear_batch(self.extract_ss_dict(self.M.inv @ ss),
+                                              {self.M.inv @ k: v for k, v in inputs.items()},
+                                              self.M.inv @ actual_outputs, monotonic)
+        except (ValueError, TypeError, NotImplementedError) as e:
+            # failed check_batch, shocked Markov matrices, or functions not broadcasting over scenarios
+            warnings.warn(f'{self.name}: cannot batch scenarios ({type(e).__name__}: {e}), '
+                          'running them one at a time instead')
+            return [self.impulse_nonlinear(ss, {k: v[s] for k, v in inputs.items()}, outputs, monotonic=monotonic)
+                    for s in range(S)]
+
+        impulses = []
+        for s in range(S):
+            out = self.M @ ImpulseDict({o: aggregates[o][s] - ss[self.M @ o] for o in aggregates}, T=T)
+            impulses.append(ImpulseDict({k: inputs[k][s] for k in inputs_as_outputs}, T=T) | out)
+        return impulses
+
     def _impulse_linear(self, ss, inputs, outputs, Js, h=1E-4, twosided=False):
         return ImpulseDict(self._jacobian(ss, list(inputs.keys()), outputs, inputs.T, h=h, twosided=twosided).apply(inputs))
 
-    def _jacobian(self, ss, inputs, outputs, T, h=1E-4, twosided=False):
+    def _jacobian(self, ss, inputs, outputs, T, h=1E-4, twosided=False, batch=False, n_workers=1,
+                  expectation_tol=None, fused=False, memory_budget=None, scratch_dir=None,
+                  dtype=np.float64, dtype_check=0, toeplitz_tol=None, log=None, verbose=False):
         ss = self.extract_ss_dict(ss)
         outputs = self.M_outputs.inv @ outputs
 
         # step 0: preliminary processing of steady state
-        exog = self.make_exog_law_of_motion(ss)
-        endog = self.make_endog_law_of_motion(ss)
-        differentiable_backward_fun, differentiable_hetinputs, differentiable_hetoutputs = self.jac_backward_prelim(ss, h, exog, twosided)
-        law_of_motion = CombinedTransition([exog, endog]).forward_shockable(ss['Dbeg'])
-        exog_by_output = {k: exog.expectation_shockable(ss[k]) for k in outputs | self.backward}
+        (differentiable_backward_fun, differentiable_hetinputs, differentiable_hetoutputs,
+            law_of_motion, exog_by_output) = self.jac_prelim(ss, outputs, h, twosided)
+
+        if memory_budget is not None:
+            # steps 1-3 with curlyDs and curlyEs streamed through scratch files rather than held in memory
+            ignored = [k for k, v, default in [('batch', batch, False), ('n_workers', n_workers, 1),
+                                               ('expectation_tol', expectation_tol, None),
+                                               ('fused', fused, False)] if v != default]
+            if ignored:
+                warnings.warn(f"{self.name}: options {', '.join(ignored)} have no effect with memory_budget")
+            F = self.build_F_streaming(ss, inputs, outputs, T, memory_budget, scratch_dir, verbose,
+                                       differentiable_backward_fun, differentiable_hetinputs, differentiable_hetoutputs,
+                                       law_of_motion, exog_by_output, dtype, log)
+            if dtype_check:
+                self.check_F_precision(F, ss, inputs, outputs, T, dtype_check, verbose, differentiable_backward_fun,
+                                       differentiable_hetinputs, differentiable_hetoutputs, law_of_motion, exog_by_output)
+            J = {o.upper(): {i: HetBlock.J_from_F(F[o][i], inplace=True) for i in inputs} for o in outputs}
+            return self.make_jacobian_dict(J, T, toeplitz_tol)
 
         # step 1 of fake news algorithm
-        # compute curlyY and curlyD (backward iteration) for each input i
-        curlyYs, curlyDs = {}, {}
-        for i in inputs:
-            curlyYs[i], curlyDs[i] = self.backward_fakenews(i, outputs, T, differentiable_backward_fun,
-                                                                      differentiable_hetinputs, differentiable_hetoutputs,
-                                                                      law_of_motion, exog_by_output)
+        # compute curlyY and curlyD (backward iteration) for each input i, with the curlyDs of all inputs in one array D
+        if n_workers > 1:
+            # inputs are independent, so spread them over a process pool (steady-state arrays in shared memory)
+            curlyYs, D = utils.parallel.pool_map(self.backward_fakenews, inputs,
+                                    (outputs, T, differentiable_backward_fun, differentiable_hetinputs,
+                                     differentiable_hetoutputs, law_of_motion, exog_by_output, False, dtype),
+                                    (T,) + ss['Dbeg'].shape, n_workers, dtype)
+            curlyYs = dict(zip(inputs, curlyYs))
+        else:
+            D = np.empty((len(inputs), T) + ss['Dbeg'].shape, dtype=dtype)
+            if batch:
+                # all inputs iterated backward together, stacked along a leading axis
+                curlyYs, _ = self.backward_fakenews_batch(inputs, outputs, T, differentiable_backward_fun,
+                                                          differentiable_hetinputs, differentiable_hetoutputs,
+                                                          law_of_motion, exog_by_output, dtype, out=D)
+            else:
+                curlyYs = {}
+                for j, i in enumerate(inputs):
+                    curlyYs[i], _ = self.backward_fakenews(i, outputs, T, differentiable_backward_fun,
+                                                           differentiable_hetinputs, differentiable_hetoutputs,
+                                                           law_of_motion, exog_by_output, dtype=dtype, out=D[j])
+        curlyDs = dict(zip(inputs, D))
 
         # step 2 of fake news algorithm
-        # compute expectation vectors curlyE for each outcome o
-        curlyPs = {}
+        # compute expectation vectors curlyE for all outcomes o together
+        curlyPs = dict(zip(outputs, self.expectation_vectors_batch(np.stack([ss[o] for o in outputs]), T-1, law_of_motion,
+                                                                   tol=expectation_tol, dtype=dtype)))
+        if log is not None:
+            # number of expectation vectors kept for each output, T-1 unless truncated by expectation_tol
+            log['horizons'] = {o.upper(): len(curlyPs[o]) for o in outputs}
         for o in outputs:
-            curlyPs[o] = self.expectation_vectors(ss[o], T-1, law_of_motion)
+            if verbose and expectation_tol is not None:
+                print(f'{self.name}: expectation vectors for {o} truncated at horizon {len(curlyPs[o])} of {T-1}')
 
         # steps 3-4 of fake news algorithm
         # make fake news matrix and Jacobian for each outcome-input pair
-        F, J = {}, {}
-        for o in outputs:
-            for i in inputs:
-                if o.upper() not in F:
-                    F[o.upper()] = {}
-                if o.upper() not in J:
-                    J[o.upper()] = {}
-                F[o.upper()][i] = HetBlock.build_F(curlyYs[i][o], curlyDs[i], curlyPs[o])
-                J[o.upper()][i] = HetBlock.J_from_F(F[o.upper()][i])
+        J = {}
+        if fused:
+            # fake news matrices of each output for all inputs from one matrix product with D, written
+            # straight into F_fused, then turned into Jacobians in place with one compiled call per output
+            F_fused = HetBlock.build_F_fused(curlyYs, D, curlyPs, list(outputs), list(inputs))
+            F = {o: {i: F_fused[k, :, j] for j, i in enumerate(inputs)} for k, o in enumerate(outputs)}
+        else:
+            F = {o: {i: HetBlock.build_F(curlyYs[i][o], curlyDs[i], curlyPs[o], Tpost=1) for i in inputs} for o in outputs}
+
+        if dtype_check:
+            # compare sample of columns to double precision before F is overwritten by J
+            self.check_F_precision(F, ss, inputs, outputs, T, dtype_check, verbose, differentiable_backward_fun,
+                                   differentiable_hetinputs, differentiable_hetoutputs, law_of_motion, exog_by_output)
+
+        if fused:
+            for k, o in enumerate(outputs):
+                HetBlock.J_from_F_batch(F_fused[k].swapaxes(0, 1), inplace=True)
+                J[o.upper()] = F[o]
+        else:
+            for o in outputs:
+                J[o.upper()] = {i: HetBlock.J_from_F(F[o][i], inplace=True) for i in inputs}
+
+        return self.make_jacobian_dict(J, T, toeplitz_tol)
 
+    def make_jacobian_dict(self, J, T, toeplitz_tol=None):
+        if toeplitz_tol is not None:
+            # store as Toeplitz generator plus corner corrections wherever that is more compact
+            J = {o: {i: QuasiToeplitz.from_dense(J[o][i], toeplitz_tol) for i in J[o]} for o in J}
         return JacobianDict(J, name=self.name, T=T)
 
+    def fake_news(self, ss, inputs, outputs=None, T=300, h=1E-4, twosided=False):
+        """Jacobian of 'outputs' to 'inputs' with horizon T, as a FakeNewsJacobian that retains the
+        intermediate results of the fake news algorithm, so that it can be extended to a longer
+        horizon with .extend(T_new) without starting again from scratch"""
+        inputs = self.make_ordered_set(inputs)
+        outputs, _ = self.process_outputs(ss, {}, self.make_ordered_set(outputs))
+        return FakeNewsJacobian(self, self.M.inv @ ss, self.M.inv @ inputs, self.M.inv @ outputs, T, h, twosided)
+
     '''Steady-state backward and forward methods'''
 
-    def backward_steady_state(self, ss, tol=1E-8, maxit=5000):
-        """Backward iteration to get steady-state policies and other outcomes"""
+    def backward_steady_state(self, ss, tol=1E-8, maxit=5000, accelerator=None, accelerator_kwargs=None, verbose=False):
+        """Backward iteration to get steady-state policies and other outcomes, optionally accelerated by
+        mixing iterates of the backward variables (accelerator='anderson', see utils.solvers.AndersonAccelerator)"""
         ss = ss.copy()
         exog = self.make_exog_law_of_motion(ss)
+        accelerate = utils.solvers.make_accelerator(accelerator, accelerator_kwargs)
 
         old = {}
         for it in range(maxit):
+            backward = {k: ss[k] for k in self.backward}
             for k in self.backward:
                 ss[k + '_p'] = exog.expectation(ss[k])
                 del ss[k]
 
             ss.update(self.backward_fun(ss))
 
-            if it % 10 == 1 and all(utils.optimized_routines.within_tolerance(ss[k], old[k], tol)
-                                    for k in self.policy):
+            # with acceleration, successive iterates differ less regularly, so check every time
+            check = (it % 10 == 1) if accelerate is None else (it > 0)
+            if check and all(utils.optimized_routines.within_tolerance(ss[k], old[k], tol) for k in self.policy):
                 break
 
             old.update({k: ss[k] for k in self.policy})
+            if accelerate is not None:
+                ss.update(accelerate(backward, {k: ss[k] for k in self.backward}))
         else:
             raise ValueError(f'No convergence of policy functions after {maxit} backward iterations!')
 
+        if verbose:
+            utils.solvers.print_accelerator_summary(self.name, it + 1, accelerate)
+
         for k in self.backward:
             del ss[k + '_p']
 
         return ss
 
-    def forward_steady_state(self, ss, tol=1E-10, maxit=100_000):
-        """Forward iteration to get steady-state distribution"""
+    def forward_steady_state(self, ss, tol=1E-10, maxit=100_000, method='iteration'):
+        """Forward iteration to get steady-state distribution, or with method='lu' or 'arnoldi' a direct
+        solution using the sparse matrix of the transition, falling back to iteration if that fails"""
         exog = self.make_exog_law_of_motion(ss)
         endog = self.make_endog_law_of_motion(ss)
         
@@ -223,17 +371,25 @@ class HetBlock(Block):
         else:
             Dbeg = Dbeg_seed
 
-        # iterate until convergence by tol, or maxit
-        D = exog.forward(Dbeg)
+        if method != 'iteration':
+            try:
+                A = endog.sparse(Dbeg.shape) @ exog.sparse(Dbeg.shape)
+                Dbeg = utils.discretize.stationary_sparse(A, method, tol).reshape(Dbeg.shape)
+                return Dbeg, exog.forward(Dbeg)
+            except (ValueError, RuntimeError, NotImplementedError) as e:
+                warnings.warn(f'{self.name}: direct solution for steady-state distribution failed, '
+                              f'falling back to iteration. {e}')
+
+        # iterate until convergence by tol, or maxit, alternating between two buffers
+        law_of_motion = CombinedTransition([exog, endog])
+        Dbeg, Dbeg_new, D = Dbeg.copy(), np.empty_like(Dbeg), np.empty_like(Dbeg)
         for it in range(maxit):
-            Dbeg_new = endog.forward(D)
-            D_new = exog.forward(Dbeg_new)
+            law_of_motion.forward(Dbeg, out=Dbeg_new, mid=D)
 
             # only check convergence every 10 iterations for efficiency
             if it % 10 == 0 and utils.optimized_routines.within_tolerance(Dbeg, Dbeg_new, tol):
                 break
-            Dbeg = Dbeg_new
-            D = D_new
+            Dbeg, Dbeg_new = Dbeg_new, Dbeg
         else:
             raise ValueError(f'No convergence after {maxit} forward iterations!')
 
@@ -246,6 +402,12 @@ class HetBlock(Block):
         T = inputs.T
         individual_paths = {k: np.empty((T,) + ss[k].shape) for k in toreturn}
 
+        # only inputs that actually move, and hetinputs and exogenous transitions depending on them,
+        # vary along the path: everything else stays at its steady-state value throughout
+        inputs = {k: v for k, v in inputs.items() if np.any(v)}
+        varying = self.varying_hetinput_outputs(inputs) | inputs.keys()
+        static_exog = not any(k in varying for k in self.exogenous)
+
         backdict = ss.copy()
         exog = self.make_exog_law_of_motion(backdict)
         exog_path = []
@@ -255,20 +417,35 @@ class HetBlock(Block):
                 backdict[k + '_p'] = exog.expectation(backdict[k])
                 del backdict[k]
 
-            backdict.update({k: ss[k] + v[t, ...] for k, v in inputs.items()})
-            self.update_with_hetinputs(backdict)
-            backdict.update(self.backward_fun(backdict))
-            self.update_with_hetoutputs(backdict)
+            self.backward_step_nonlinear(ss, backdict, inputs, t)
  
             for k in individual_paths:
                 individual_paths[k][t, ...] = backdict[k]
 
-            exog = self.make_exog_law_of_motion(backdict)
+            if not static_exog:
+                exog = self.make_exog_law_of_motion(backdict)
 
             exog_path.append(exog)
         
         return individual_paths, exog_path[::-1]
 
+    def backward_step_nonlinear(self, ss, backdict, inputs, t):
+        """Update 'backdict', which holds expectations of backward variables, with inputs at date t,
+        hetinputs depending on them, and the resulting outputs of backward_fun and hetoutputs"""
+        shocked = {k: ss[k] + v[t, ...] for k, v in inputs.items()}
+        backdict.update(shocked)
+        if self.hetinputs is not None and shocked:
+            backdict.update(self.hetinputs.call_on_deviations(backdict, shocked))
+        backdict.update(self.backward_fun(backdict))
+        self.update_with_hetoutputs(backdict)
+
+    def varying_hetinput_outputs(self, inputs):
+        """Outputs of hetinputs that depend on any of 'inputs', and so need to be recomputed when these change"""
+        if self.hetinputs is None or not inputs:
+            return set()
+        functions = self.hetinputs.filter(list(self.hetinputs.functions.values()), inputs)
+        return set().union(*(f.outputs for f in functions))
+
     def forward_nonlinear(self, ss, individual_paths, exog_path, monotonic):
         T = len(exog_path)
         Dbeg = ss['Dbeg']
@@ -277,25 +454,203 @@ class HetBlock(Block):
         Dbeg_path[0, ...] = Dbeg
         D_path = np.empty_like(Dbeg_path)
 
-        for t in range(T):
+        for t in range(T-1):
             endog = self.make_endog_law_of_motion({**ss, **{k: individual_paths[k][t, ...] for k in self.policy}}, monotonic)
 
-            # now step forward in two, first exogenous this period then endogenous
-            D_path[t, ...] = exog_path[t].forward(Dbeg)
-
-            if t < T-1:
-                Dbeg = endog.forward(D_path[t, ...])
-                Dbeg_path[t+1, ...] = Dbeg # make this optional
+            # step forward in two, first exogenous this period then endogenous, writing both into the paths
+            CombinedTransition([exog_path[t], endog]).forward(Dbeg_path[t], out=Dbeg_path[t+1], mid=D_path[t])
+        D_path[T-1, ...] = exog_path[T-1].forward(Dbeg_path[T-1])
 
         individual_paths['D'] = D_path
         individual_paths['Dbeg'] = Dbeg_path
 
+    def impulse_nonlinear_compiled(self, ss, inputs, outputs, internals, monotonic=None):
+        """Aggregate paths of outputs from a CompiledTransition for these inputs and outputs, compiled on first
+        use. Returns None with a warning if there cannot be one for this block (or internals are requested)."""
+        key = (tuple(inputs), tuple(outputs), monotonic)
+        if key not in self._compiled_transitions:
+            try:
+                if internals:
+                    raise ValueError('internals cannot be reported')
+                transition = CompiledTransition(self, inputs, [self.M_outputs.inv @ o for o in outputs], monotonic)
+                transition(ss, {k: ss[k] + v for k, v in inputs.items()})
+            except (ValueError, TypingError, UnsupportedError) as e:
+                # unsupported block structure, or functions that numba cannot compile
+                transition = f'{type(e).__name__}: {e}'
+            self._compiled_transitions[key] = transition
+
+        transition = self._compiled_transitions[key]
+        if isinstance(transition, str):
+            warnings.warn(f'Cannot compile transition of {self.name}, iterating in Python instead. {transition}')
+            return None
+        aggregates = transition(ss, {k: ss[k] + v for k, v in inputs.items()})
+        return {o: aggregates[self.M_outputs.inv @ o] for o in outputs}
+
+    def backward_nonlinear_low_memory(self, ss, inputs, internals):
+        """Like backward_nonlinear, but only storing paths of expectations of backward variables
+        (from which forward_nonlinear_low_memory recomputes everything else) and of 'internals'"""
+        T = inputs.T
+        inputs = {k: v for k, v in inputs.items() if np.any(v)}
+        varying = self.varying_hetinput_outputs(inputs) | inputs.keys()
+        static_exog = not any(k in varying for k in self.exogenous)
+
+        expectations_path = {k: np.empty((T,) + ss[k].shape) for k in self.backward}
+        internal_paths = {k: np.empty((T,) + ss[k].shape) for k in internals if k not in ('D', 'Dbeg')}
+
+        backdict = ss.copy()
+        exog = self.make_exog_law_of_motion(backdict)
+        exog_path = []
+        for t in reversed(range(T)):
+            for k in self.backward:
+                backdict[k + '_p'] = expectations_path[k][t] = exog.expectation(backdict[k])
+                del backdict[k]
+
+            self.backward_step_nonlinear(ss, backdict, inputs, t)
+            for k in internal_paths:
+                internal_paths[k][t] = backdict[k]
+
+            if not static_exog:
+                exog = self.make_exog_law_of_motion(backdict)
+            exog_path.append(exog)
+
+        return expectations_path, internal_paths, exog_path[::-1]
+
+    def forward_nonlinear_low_memory(self, ss, inputs, expectations_path, exog_path, outputs, internals,
+                                     monotonic=None):
+        """Iterate distribution forward, recomputing each period's outputs from expectations_path and
+        aggregating them right away. Also returns paths of 'D' and 'Dbeg' if they are in 'internals'."""
+        T = len(exog_path)
+        inputs = {k: v for k, v in inputs.items() if np.any(v)}
+        aggregates = {o: np.empty(T) for o in outputs}
+        distribution_paths = {k: np.empty((T,) + ss['Dbeg'].shape) for k in internals if k in ('D', 'Dbeg')}
+
+        Dbeg = ss['Dbeg']
+        D = np.empty_like(Dbeg)
+        backdict = ss.copy()
+        for k in self.backward:
+            del backdict[k]
+        for t in range(T):
+            backdict.update({k + '_p': expectations_path[k][t] for k in self.backward})
+            self.backward_step_nonlinear(ss, backdict, inputs, t)
+
+            # same steps as forward_nonlinear, so that distributions agree exactly
+            if t < T-1:
+                endog = self.make_endog_law_of_motion(backdict, monotonic)
+                Dbeg_next = CombinedTransition([exog_path[t], endog]).forward(Dbeg, mid=D)
+            else:
+                D = exog_path[t].forward(Dbeg)
+
+            for o in outputs:
+                aggregates[o][t] = np.vdot(D, backdict[self.M_outputs.inv @ o])
+            if 'D' in distribution_paths:
+                distribution_paths['D'][t] = D
+            if 'Dbeg' in distribution_paths:
+                distribution_paths['Dbeg'][t] = Dbeg
+
+            if t < T-1:
+                Dbeg = Dbeg_next
+
+        return aggregates, distribution_paths
+
+    def nonlinear_batch(self, ss, inputs, outputs, monotonic=None):
+        """Aggregate paths of 'outputs' for scenarios stacked along the leading axis of 'inputs', as an
+        (S, T) array for each, see impulse_nonlinear_batch"""
+        toreturn = self.policy | [self.M_outputs.inv @ o for o in outputs]
+        paths, exog = self.backward_nonlinear_batch(ss, inputs, toreturn)
+        return self.forward_nonlinear_batch(ss, paths, exog, outputs, monotonic)
+
+    def backward_nonlinear_batch(self, ss, inputs, toreturn):
+        S, T = next(iter(inputs.values())).shape[:2]
+        inputs = {k: v for k, v in inputs.items() if np.any(v)}
+        if any(v.shape != (S, T) for v in inputs.values()):
+            raise ValueError('scenario paths must all be (S, T) arrays of scalar inputs')
+        varying_hetinputs = self.varying_hetinput_outputs(inputs)
+        if any(k in varying_hetinputs or k in inputs for k in self.exogenous):
+            raise NotImplementedError('exogenous Markov matrices are shocked')
+
+        exog = self.make_exog_law_of_motion(ss)
+        state_ndim = ss[self.backward[0]].ndim
+        paths = {k: np.empty((T, S) + ss[k].shape) for k in toreturn}
+
+        backdict = ss.copy()
+        for t in reversed(range(T)):
+            for k in self.backward:
+                if t == T - 1:
+                    backdict[k + '_p'] = np.repeat(exog.expectation(ss[k])[np.newaxis], S, axis=0)
+                else:
+                    backdict[k + '_p'] = exog.expectation_batch(backdict[k])
+                del backdict[k]
+
+            shocked = {k: ss[k] + v[:, t] for k, v in inputs.items()}
+            backdict.update({k: x.reshape((S,) + (1,) * state_ndim) for k, x in shocked.items()})
+            if varying_hetinputs:
+                # hetinputs are typically cheap, and need not broadcast, so evaluate them scenario by scenario
+                hetinputs = [self.hetinputs.call_on_deviations(ss, {k: x[s] for k, x in shocked.items()})
+                             for s in range(S)]
+                backdict.update({k: np.stack([h[k] for h in hetinputs]) for k in hetinputs[0]})
+            backdict.update(self.backward_fun(backdict))
+            self.update_with_hetoutputs(backdict)
+
+            if t == T - 1:
+                self.check_batch(ss, inputs, backdict, toreturn)
+
+            for k in toreturn:
+                paths[k][t] = backdict[k]
+
+        return paths, exog
+
+    def check_batch(self, ss, inputs, backdict, toreturn):
+        """Check that the first step of the batched backward iteration matches the one of the first
+        and last scenario alone, i.e. that all functions correctly broadcast over the scenario axis"""
+        S, T = next(iter(inputs.values())).shape[:2]
+        for k in self.backward:
+            if backdict[k].shape != (S,) + ss[k].shape:
+                raise ValueError(f"backward variable '{k}' does not have leading scenario axis")
+
+        exog = self.make_exog_law_of_motion(ss)
+        for s in {0, S - 1}:
+            d = ss.copy()
+            for k in self.backward:
+                d[k + '_p'] = exog.expectation(ss[k])
+                del d[k]
+            shocked = {k: ss[k] + v[s, T-1] for k, v in inputs.items()}
+            d.update(shocked)
+            if self.hetinputs is not None:
+                d.update(self.hetinputs.call_on_deviations(d, shocked))
+            d.update(self.backward_fun(d))
+            self.update_with_hetoutputs(d)
+
+            for k in toreturn | self.backward:
+                batched = np.broadcast_to(backdict[k], (S,) + np.shape(d[k]))[s]
+                if not np.allclose(batched, d[k], rtol=1E-10, atol=1E-12):
+                    raise ValueError(f"'{k}' with scenario axis differs from '{k}' in single scenario")
+
+    def forward_nonlinear_batch(self, ss, paths, exog, outputs, monotonic=None):
+        T, S = paths[self.policy[0]].shape[:2]
+        aggregates = {o: np.empty((S, T)) for o in outputs}
+
+        Dbeg = np.repeat(ss['Dbeg'][np.newaxis], S, axis=0)
+        for t in range(T):
+            D = exog.forward_batch(Dbeg)
+            for o in outputs:
+                aggregates[o][:, t] = np.einsum('si,si->s', D.reshape((S, -1)),
+                                                paths[self.M_outputs.inv @ o][t].reshape((S, -1)))
+
+            if t < T - 1:
+                endog = self.make_endog_law_of_motion({**ss, **{k: paths[k][t] for k in self.policy}}, monotonic)
+                Dbeg = endog.forward(D)
+
+        return aggregates
+
     '''Jacobian calculation: four parts of fake news algorithm, plus support methods'''
 
     def backward_fakenews(self, input_shocked, output_list, T, differentiable_backward_fun,
                             differentiable_hetinput, differentiable_hetoutput,
-                            law_of_motion: ForwardShockableTransition, exog: Dict[str, ExpectationShockableTransition]):
-        """Part 1 of fake news algorithm: calculate curlyY and curlyD in response to fake news shock"""
+                            law_of_motion: ForwardShockableTransition, exog: Dict[str, ExpectationShockableTransition],
+                            return_curlyV=False, dtype=np.float64, out=None):
+        """Part 1 of fake news algorithm: calculate curlyY and curlyD in response to fake news shock
+
+        If 'out' is given, curlyDs are written into it rather than into a new array"""
         # contemporaneous effect of unit scalar shock to input_shocked
         din_dict = {input_shocked: 1}
         if differentiable_hetinput is not None and input_shocked in differentiable_hetinput.inputs:
@@ -305,7 +660,7 @@ class HetBlock(Block):
                                                             differentiable_hetoutput, law_of_motion, exog, True)
 
         # infer dimensions from this, initialize empty arrays, and fill in contemporaneous effect
-        curlyDs = np.empty((T,) + curlyD.shape)
+        curlyDs = np.empty((T,) + curlyD.shape, dtype=dtype) if out is None else out
         curlyYs = {k: np.empty(T) for k in curlyY.keys()}
 
         curlyDs[0, ...] = curlyD
@@ -320,35 +675,362 @@ class HetBlock(Block):
             for k in curlyY.keys():
                 curlyYs[k][t] = curlyY[k]
 
+        if return_curlyV:
+            return curlyYs, curlyDs, curlyV
         return curlyYs, curlyDs
 
-    def expectation_vectors(self, o_ss, T, law_of_motion: Transition):
-        """Part 2 of fake news algorithm: calculate expectation vectors curlyE"""
-        curlyEs = np.empty((T,) + o_ss.shape)
+    def backward_fakenews_continue(self, curlyV, output_list, T, differentiable_backward_fun, differentiable_hetoutput,
+                                   law_of_motion: ForwardShockableTransition, exog: Dict[str, ExpectationShockableTransition],
+                                   dtype=np.float64):
+        """Continue part 1 of fake news algorithm for T more periods, starting from curlyV returned by
+        backward_fakenews with return_curlyV=True (or by an earlier call to this method)"""
+        curlyDs, curlyYs = None, {k: np.empty(T) for k in output_list}
+        for t in range(T):
+            curlyV, curlyD, curlyY = self.backward_step_fakenews({k+'_p': v for k, v in curlyV.items()},
+                                                    output_list, differentiable_backward_fun,
+                                                    differentiable_hetoutput, law_of_motion, exog)
+            if curlyDs is None:
+                curlyDs = np.empty((T,) + curlyD.shape, dtype=dtype)
+            curlyDs[t, ...] = curlyD
+            for k in curlyY.keys():
+                curlyYs[k][t] = curlyY[k]
+
+        return curlyYs, curlyDs, curlyV
+
+    def backward_fakenews_batch(self, inputs_shocked, output_list, T, differentiable_backward_fun,
+                                differentiable_hetinput, differentiable_hetoutput,
+                                law_of_motion: ForwardShockableTransition, exog: Dict[str, ExpectationShockableTransition],
+                                dtype=np.float64, out=None):
+        """Part 1 of fake news algorithm for all of 'inputs_shocked' at once, stacking them along a leading
+        axis so that the lottery and Markov kernels are applied to all inputs in one call per period. If 'out'
+        is given, the stacked curlyDs are written into it rather than into a new array"""
+        nK = len(inputs_shocked)
+
+        # contemporaneous effect: shocks to exogenous processes are input-specific, so do this input by input
+        curlyVs, curlyD0, curlyY0 = [], [], []
+        for i in inputs_shocked:
+            din_dict = {i: 1}
+            if differentiable_hetinput is not None and i in differentiable_hetinput.inputs:
+                din_dict.update(differentiable_hetinput.diff({i: 1}))
+            curlyV, curlyD, curlyY = self.backward_step_fakenews(din_dict, output_list, differentiable_backward_fun,
+                                                                differentiable_hetoutput, law_of_motion, exog, True)
+            curlyVs.append(curlyV)
+            curlyD0.append(curlyD)
+            curlyY0.append(curlyY)
+
+        curlyV = {k: np.stack([v[k] for v in curlyVs]) for k in self.backward}
+
+        # infer dimensions, initialize stacked arrays, and fill in contemporaneous effect
+        curlyDs = np.empty((nK, T) + curlyD0[0].shape, dtype=dtype) if out is None else out
+        curlyYs = {k: np.empty((nK, T)) for k in output_list}
+
+        curlyDs[:, 0, ...] = np.stack(curlyD0)
+        for k in output_list:
+            curlyYs[k][:, 0] = [y[k] for y in curlyY0]
+
+        # fill in anticipation effects of shock up to horizon T, all inputs together
+        for t in range(1, T):
+            curlyV, curlyDs[:, t, ...], curlyY = self.backward_step_fakenews_batch(curlyV, output_list,
+                                                    differentiable_backward_fun, differentiable_hetoutput, law_of_motion)
+            for k in output_list:
+                curlyYs[k][:, t] = curlyY[k]
+
+        # unstack into the same format as backward_fakenews, i.e. dicts indexed by input
+        return ({i: {k: curlyYs[k][j] for k in output_list} for j, i in enumerate(inputs_shocked)},
+                {i: curlyDs[j] for j, i in enumerate(inputs_shocked)})
+
+    def expectation_vectors(self, o_ss, T, law_of_motion: Transition, tol=None, dtype=np.float64):
+        """Part 2 of fake news algorithm: calculate expectation vectors curlyE
+
+        If 'tol' is given, stop as soon as the largest entry of curlyE falls below 'tol' times
+        the largest entry of the first curlyE, returning only the curlyEs up to that horizon
+        (later ones are then treated as zero). If 'dtype' is single precision, curlyEs are
+        stored in single precision but still iterated in double precision."""
+        # with 'tol', storage grows as needed, so that early termination also saves memory
+        curlyEs = np.empty((T if tol is None else min(T, 16),) + o_ss.shape, dtype=dtype)
 
         # initialize with beginning-of-period expectation of steady-state policy
-        curlyEs[0, ...] = utils.misc.demean(law_of_motion[0].expectation(o_ss))
+        curlyE = curlyEs[0, ...] = utils.misc.demean(law_of_motion[0].expectation(o_ss))
+        if tol is not None:
+            tol = tol * np.max(np.abs(curlyE))
         for t in range(1, T):
+            if tol is not None and np.max(np.abs(curlyE)) < tol:
+                return HetBlock.truncate(curlyEs, t)
+            if t == curlyEs.shape[0]:
+                curlyEs = HetBlock.grow(curlyEs, T)
             # demean so that curlyEs converge to zero, in theory no effect but better numerically
-            curlyEs[t, ...] = utils.misc.demean(law_of_motion.expectation(curlyEs[t-1, ...]))
+            curlyE = curlyEs[t, ...] = utils.misc.demean(law_of_motion.expectation(curlyE))
+        return HetBlock.truncate(curlyEs, T)
+
+    def expectation_vectors_continue(self, curlyE, T, law_of_motion: Transition, dtype=np.float64):
+        """Continue part 2 of fake news algorithm for T more periods after curlyE"""
+        curlyEs = np.empty((T,) + curlyE.shape, dtype=dtype)
+        for t in range(T):
+            curlyE = curlyEs[t, ...] = utils.misc.demean(law_of_motion.expectation(curlyE))
+        return curlyEs
+
+    def expectation_vectors_batch(self, o_ss, T, law_of_motion: Transition, tol=None, dtype=np.float64):
+        """Part 2 of fake news algorithm for a stack of K outputs o_ss[k, ...] at once, as in expectation_vectors,
+        returning a list of K arrays of curlyEs. Each step takes expectations of all K together, so that the
+        law of motion is only read once. If 'tol' is given, each output is truncated at its own horizon."""
+        nK = o_ss.shape[0]
+        curlyEs = np.empty((nK, T if tol is None else min(T, 16)) + o_ss.shape[1:], dtype=dtype)
+        horizons = [T] * nK
+        if T == 0:
+            return list(curlyEs)
+
+        curlyE = curlyEs[:, 0, ...] = HetBlock.demean_batch(law_of_motion[0].expectation_batch(o_ss))
+        if tol is not None:
+            tol = tol * np.max(np.abs(curlyE.reshape((nK, -1))), axis=1)
+        for t in range(1, T):
+            if tol is not None:
+                below = np.max(np.abs(curlyE.reshape((nK, -1))), axis=1) < tol
+                horizons = [min(H, t) if b else H for H, b in zip(horizons, below)]
+                if all(below):
+                    break
+            if t == curlyEs.shape[1]:
+                curlyEs = HetBlock.grow(curlyEs, T, axis=1)
+            curlyE = curlyEs[:, t, ...] = HetBlock.demean_batch(law_of_motion.expectation_batch(curlyE))
+        if tol is None:
+            return list(curlyEs)
+        return [curlyEs[k, :H].copy() for k, H in enumerate(horizons)]
+
+    def expectation_vectors_continue_batch(self, curlyE, T, law_of_motion: Transition, dtype=np.float64):
+        """Continue part 2 of fake news algorithm for T more periods after a stack of K curlyEs, returning (K, T, ...)"""
+        curlyEs = np.empty((curlyE.shape[0], T) + curlyE.shape[1:], dtype=dtype)
+        for t in range(T):
+            curlyE = curlyEs[:, t, ...] = HetBlock.demean_batch(law_of_motion.expectation_batch(curlyE))
         return curlyEs
 
     @staticmethod
-    def build_F(curlyYs, curlyDs, curlyEs):
-        """Part 3 of fake news algorithm: build fake news matrix from curlyY, curlyD, curlyE"""
+    def grow(X, T, axis=0):
+        """Copy of buffer X with its length along 'axis' doubled, up to at most T"""
+        shape = list(X.shape)
+        shape[axis] = min(2 * shape[axis], T)
+        Y = np.empty(shape, dtype=X.dtype)
+        Y[(slice(None),) * axis + (slice(0, X.shape[axis]),)] = X
+        return Y
+
+    @staticmethod
+    def truncate(X, H):
+        """First H entries of buffer X, copied if X is longer so that the rest of X can be freed"""
+        return X if X.shape[0] == H else X[:H].copy()
+
+    @staticmethod
+    def demean_batch(X):
+        """utils.misc.demean applied to each X[k, ...] in a stack along leading axis"""
+        means = X.reshape((X.shape[0], -1)).sum(axis=1) / X[0].size
+        return X - means.reshape((-1,) + (1,) * (X.ndim - 1))
+
+    @staticmethod
+    def build_F(curlyYs, curlyDs, curlyEs, Tpost=None):
+        """Part 3 of fake news algorithm: build fake news matrix from curlyY, curlyD, curlyE
+
+        By default 'Tpost' is inferred from the number of curlyEs. If it is given instead, there
+        may be fewer curlyEs than the Tpost + T - 2 needed, and the remaining rows of F are zero."""
         T = curlyDs.shape[0]
-        Tpost = curlyEs.shape[0] - T + 2
+        if Tpost is None:
+            Tpost = curlyEs.shape[0] - T + 2
+        H = curlyEs.shape[0]
         F = np.empty((Tpost + T - 1, T))
         F[0, :] = curlyYs
-        F[1:, :] = curlyEs.reshape((Tpost + T - 2, -1)) @ curlyDs.reshape((T, -1)).T
+        D = curlyDs.reshape((T, -1))
+        utils.misc.matmul_accumulate(curlyEs.reshape((H, D.shape[1])), D.T, out=F[1:H+1, :])
+        F[H+1:, :] = 0
+        return F
+
+    @staticmethod
+    def build_F_fused(curlyYs, curlyDs, curlyEs, outputs, inputs):
+        """Build fake news matrices for all outputs and inputs at once, stacked with dims (O, T, I, T) so
+        that F[k, :, j] is the fake news matrix of outputs[k] with respect to inputs[j]
+
+        'curlyDs' holds the curlyDs of all inputs in one array with dims (I, T, ...). For each output,
+        rows 1 to H of F for all inputs come from a single matrix product of its H curlyEs with all
+        curlyDs, written directly into F, so that nothing of the size of curlyDs or F is copied.
+        Each F is as from build_F with Tpost=1, with curlyEs truncated early treated as zero."""
+        nI, T = curlyDs.shape[:2]
+        D = curlyDs.reshape((nI * T, -1))
+
+        F = np.empty((len(outputs), T, nI, T))
+        for k, o in enumerate(outputs):
+            H = curlyEs[o].shape[0]
+            for j, i in enumerate(inputs):
+                F[k, 0, j, :] = curlyYs[i][o]
+            utils.misc.matmul_accumulate(curlyEs[o].reshape((H, D.shape[1])), D.T,
+                                         out=F[k, 1:H+1].reshape((H, nI * T)))
+            F[k, H+1:] = 0
+        return F
+
+    def build_F_streaming(self, ss, inputs, outputs, T, memory_budget, scratch_dir, verbose,
+                          differentiable_backward_fun, differentiable_hetinput, differentiable_hetoutput,
+                          law_of_motion: ForwardShockableTransition, exog: Dict[str, ExpectationShockableTransition],
+                          dtype=np.float64, log=None):
+        """Parts 1-3 of fake news algorithm with bounded memory, returning F[o][i]
+
+        curlyDs and curlyEs are computed a tile of periods at a time and written to memory-mapped
+        scratch files in 'scratch_dir' (default: system temporary directory). F is then built tile by
+        tile, so that only one tile of curlyEs and one of curlyDs are in memory at any point. Tiles are
+        as long as possible while these, the backward state curlyV and the products of tiles together fit
+        in 'memory_budget' bytes. Iteration is serial, over one input and output at a time, and never
+        truncated, whatever the options batch, n_workers, fused and expectation_tol passed
+        to the Jacobian. If 'log' is a dict, the tile length and the peak memory in bytes of all arrays
+        allocated here, including F, are stored in it as 'tile' and 'peak_memory', along with the
+        (untruncated) horizons of the expectation vectors of each output as 'horizons'."""
+        shape, N = ss['Dbeg'].shape, ss['Dbeg'].size
+        itemsize = np.dtype(dtype).itemsize
+        step = self.backward_step_memory(ss, inputs[0], outputs, differentiable_backward_fun, differentiable_hetinput,
+                                         differentiable_hetoutput, law_of_motion, exog)
+        tile, peak = self.streaming_tile(N, len(inputs), len(outputs), T, memory_budget, itemsize, step)
+        if log is not None:
+            log.update(tile=tile, peak_memory=peak, horizons={o.upper(): T - 1 for o in outputs})
+        if verbose:
+            print(f'{self.name}: streaming fake news in tiles of {tile} periods, '
+                  f'peak memory including F is {peak / 1E6:.1f} MB')
+
+        with tempfile.TemporaryDirectory(dir=scratch_dir) as scratch:
+            # part 1: backward iteration for each input, a tile at a time
+            curlyYs, curlyDs = {}, {}
+            for k, i in enumerate(inputs):
+                curlyDs[i] = np.lib.format.open_memmap(os.path.join(scratch, f'curlyD_{k}.npy'), 'w+', dtype=dtype, shape=(T,) + shape)
+                curlyY, curlyDs[i][:tile], curlyV = self.backward_fakenews(i, outputs, tile, differentiable_backward_fun,
+                                                                 differentiable_hetinput, differentiable_hetoutput,
+                                                                 law_of_motion, exog, return_curlyV=True, dtype=dtype)
+                curlyYs[i] = {o: [curlyY[o]] for o in outputs}
+                for start in range(tile, T, tile):
+                    curlyY, curlyDs[i][start:start+tile], curlyV = self.backward_fakenews_continue(
+                        curlyV, outputs, min(tile, T - start), differentiable_backward_fun, differentiable_hetoutput,
+                        law_of_motion, exog, dtype)
+                    for o in outputs:
+                        curlyYs[i][o].append(curlyY[o])
+                curlyYs[i] = {o: np.concatenate(curlyYs[i][o]) for o in outputs}
+
+            # part 2: expectation vectors for each output, a tile at a time
+            curlyEs = {}
+            for k, o in enumerate(outputs):
+                curlyEs[o] = np.lib.format.open_memmap(os.path.join(scratch, f'curlyE_{k}.npy'), 'w+', dtype=dtype, shape=(T-1,) + shape)
+                for start in range(0, T - 1, tile):
+                    if start == 0:
+                        E = self.expectation_vectors(ss[o], min(tile, T - 1), law_of_motion)
+                    else:
+                        E = self.expectation_vectors_continue(curlyE, min(tile, T - 1 - start), law_of_motion)
+                    curlyEs[o][start:start+tile] = E
+                    # keep only the last curlyE of the tile for the next one
+                    curlyE = E[-1].copy()
+                    del E
+
+            # part 3: fake news matrices, one (tile, tile) block of each at a time
+            F = {o: {i: np.empty((T, T)) for i in inputs} for o in outputs}
+            for o in outputs:
+                for i in inputs:
+                    F[o][i][0, :] = curlyYs[i][o]
+                for r in range(0, T - 1, tile):
+                    E = np.array(curlyEs[o][r:r+tile]).reshape((-1, N))
+                    for i in inputs:
+                        for c in range(0, T, tile):
+                            F[o][i][1+r:1+r+tile, c:c+tile] = utils.misc.matmul_accumulate(
+                                E, np.array(curlyDs[i][c:c+tile]).reshape((-1, N)).T)
+                    del E
+
+            # release memory maps before scratch files are removed
+            del curlyDs, curlyEs
+
         return F
 
     @staticmethod
-    def J_from_F(F):
+    def streaming_tile(N, nI, nO, T, memory_budget, itemsize, step):
+        """Longest tile of periods for build_F_streaming fitting in 'memory_budget' bytes, and peak memory use.
+
+        Per period of a tile, part 1 holds curlyDs, part 2 curlyEs, and part 3 copies of both and, in
+        single precision, double-precision chunks of both (see utils.misc.matmul_accumulate). Part 1
+        holds double-precision curlyEs, and part 3 (tile, tile) products. The 'step' bytes of one backward
+        step (see backward_step_memory), part of which like curlyV outlives part 1, are counted throughout.
+        So are F and curlyYs, but they are independent of the tile and not counted against the budget."""
+        per_period = 2 * N * itemsize + (2 * min(N, 4096) * 8 if itemsize < 8 else 0)
+        tile = int(max(1, min(T, (memory_budget - step) // per_period)))
+        products = tile * tile * 8 * (2 if itemsize < 8 else 1)
+        tiles = max((tile + 2) * N * 8, tile * per_period + products) + step
+        return tile, tiles + nO * nI * (T * T + T) * 8
+
+    def backward_step_memory(self, ss, i, outputs, differentiable_backward_fun, differentiable_hetinput,
+                             differentiable_hetoutput, law_of_motion: ForwardShockableTransition,
+                             exog: Dict[str, ExpectationShockableTransition]):
+        """Bytes held during one step of backward_fakenews for input 'i', including temporaries of the
+        backward step. Measured with tracemalloc, unless it is already tracing (e.g. when profiling), in
+        which case it is estimated as four arrays for each array in ss with the shape of the distribution."""
+        if tracemalloc.is_tracing():
+            return 4 * sum(1 for v in ss.values() if np.shape(v) == ss['Dbeg'].shape) * ss['Dbeg'].size * 8
+
+        def step():
+            self.backward_fakenews(i, outputs, 1, differentiable_backward_fun, differentiable_hetinput,
+                                   differentiable_hetoutput, law_of_motion, exog, return_curlyV=True)
+
+        # step once before measuring, so that one-off allocations like compilation are not counted
+        step()
+        tracemalloc.start()
+        try:
+            step()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def check_F_precision(self, F, ss, inputs, outputs, T, ncols, verbose, differentiable_backward_fun,
+                          differentiable_hetinput, differentiable_hetoutput,
+                          law_of_motion: ForwardShockableTransition, exog: Dict[str, ExpectationShockableTransition]):
+        """Compare 'ncols' evenly spaced columns of fake news matrices F[o][i], computed at reduced
+        precision, to double precision (see compare_F_columns)"""
+        columns = np.unique(np.linspace(0, T - 1, min(ncols, T)).astype(int))
+        curlyDs = {i: self.backward_fakenews(i, outputs, columns[-1] + 1, differentiable_backward_fun,
+                                             differentiable_hetinput, differentiable_hetoutput,
+                                             law_of_motion, exog)[1][columns] for i in inputs}
+
+        def curlyEs(o):
+            curlyE = utils.misc.demean(law_of_motion[0].expectation(ss[o]))
+            for t in range(T - 1):
+                yield curlyE
+                curlyE = utils.misc.demean(law_of_motion.expectation(curlyE))
+
+        return HetBlock.compare_F_columns(self.name, F, columns, curlyDs, curlyEs, verbose)
+
+    @staticmethod
+    def compare_F_columns(name, F, columns, curlyDs, curlyEs, verbose, rtol=1E-5):
+        """Compare 'columns' of fake news matrices F[o][i] to double precision counterparts built from
+        curlyDs[i] (at these columns only) and the stream of double precision expectation vectors
+        curlyEs(o), which are never stored. Warns if the error relative to the largest entry of any F
+        exceeds 'rtol', and returns the largest such relative error."""
+        curlyDs = {i: D.reshape((len(columns), -1)) for i, D in curlyDs.items()}
+
+        worst = 0
+        for o in F:
+            F_check = {i: [] for i in F[o]}
+            for curlyE in curlyEs(o):
+                for i in F[o]:
+                    F_check[i].append(curlyDs[i] @ curlyE.ravel())
+
+            for i in F[o]:
+                scale = max(np.max(np.abs(F[o][i])), 1E-300)
+                err = np.max(np.abs(F[o][i][1:, columns] - np.array(F_check[i]).reshape((-1, len(columns))))) / scale
+                worst = max(worst, err)
+                if err > rtol:
+                    warnings.warn(f'{name}: fake news matrix for {o.upper()} to {i} has relative error '
+                                  f'{err:.1E} versus double precision, above {rtol:.0E}')
+
+        if verbose:
+            print(f'{name}: largest relative error of fake news matrices versus double precision '
+                  f'on {len(columns)} columns is {worst:.1E}')
+        return worst
+
+    @staticmethod
+    def J_from_F(F, inplace=False):
         """Part 4 of fake news algorithm: recursively build Jacobian from fake news matrix"""
-        J = F.copy()
-        for t in range(1, J.shape[1]):
-            J[1:, t] += J[:-1, t - 1]
+        J = F if inplace else F.copy()
+        utils.optimized_routines.fake_news_to_jacobian(J[np.newaxis])
+        return J
+
+    @staticmethod
+    def J_from_F_batch(F, inplace=False):
+        """Part 4 of fake news algorithm for stack of fake news matrices with dims (K, T', T)"""
+        J = F if inplace else F.copy()
+        utils.optimized_routines.fake_news_to_jacobian(J)
         return J
 
     def backward_step_fakenews(self, din_dict, output_list, differentiable_backward_fun,
@@ -393,6 +1075,45 @@ class HetBlock(Block):
 
         return curlyV, curlyD, curlyY
 
+    def backward_step_fakenews_batch(self, curlyV, output_list, differentiable_backward_fun,
+                                     differentiable_hetoutput, law_of_motion: ForwardShockableTransition):
+        """Support for part 1 of fake news algorithm: single backward step in response to a stack of shocks
+        to the backward variables, curlyV[k][j, ...] for each of K stacked inputs j (no exogenous shocks)"""
+        D = law_of_motion[1].Dss
+        nK = next(iter(curlyV.values())).shape[0]
+
+        # backward_fun only accepts one point in state space per call, so differentiate input by input
+        shocked_outputs = []
+        for j in range(nK):
+            din_dict = {k + '_p': v[j] for k, v in curlyV.items()}
+            shocked = differentiable_backward_fun.diff(din_dict)
+            if differentiable_hetoutput is not None and (output_list & differentiable_hetoutput.outputs):
+                shocked.update(differentiable_hetoutput.diff({**shocked, **din_dict}, outputs=differentiable_hetoutput.outputs & output_list))
+            shocked_outputs.append(shocked)
+
+        # ...but then stack to iterate all inputs through expectations and the distribution together
+        stacked = {k: np.stack([v[k] for v in shocked_outputs]) for k in self.backward | self.policy | output_list}
+        curlyV = {k: law_of_motion[0].expectation_batch(stacked[k]) for k in self.backward}
+
+        policy_shock = [stacked[k] for k in self.policy]
+        if len(policy_shock) == 1:
+            policy_shock = policy_shock[0]
+        curlyD = law_of_motion.forward_shock_batch([None, policy_shock])
+
+        curlyY = {k: stacked[k].reshape((nK, -1)) @ D.ravel() for k in output_list}
+
+        return curlyV, curlyD, curlyY
+
+    def jac_prelim(self, ss, outputs, h, twosided):
+        """Part 0 of fake news algorithm: differentiable functions and laws of motion around steady state"""
+        exog = self.make_exog_law_of_motion(ss)
+        endog = self.make_endog_law_of_motion(ss)
+        differentiable_backward_fun, differentiable_hetinputs, differentiable_hetoutputs = self.jac_backward_prelim(ss, h, exog, twosided)
+        law_of_motion = CombinedTransition([exog, endog]).forward_shockable(ss['Dbeg'])
+        exog_by_output = {k: exog.expectation_shockable(ss[k]) for k in outputs | self.backward}
+        return (differentiable_backward_fun, differentiable_hetinputs, differentiable_hetoutputs,
+                law_of_motion, exog_by_output)
+
     def jac_backward_prelim(self, ss, h, exog, twosided):
         """Support for part 1 of fake news algorithm: preload differentiable functions"""
         differentiable_hetinputs = None
@@ -416,6 +1137,7 @@ class HetBlock(Block):
     def process_hetinputs_hetoutputs(self, hetinputs: Optional[CombinedExtendedFunction], hetoutputs: Optional[CombinedExtendedFunction], tocopy=True):
         if tocopy:
             self = copy.copy(self)
+            self._compiled_transitions = {}
         inputs = self.original_inputs.copy()
         outputs = self.original_outputs.copy()
         internals = self.original_internals.copy()
@@ -486,9 +1208,11 @@ class HetBlock(Block):
     def make_exog_law_of_motion(self, d:dict):
         return CombinedTransition([Markov(d[k], i) for i, k in enumerate(self.exogenous)])
 
-    def make_endog_law_of_motion(self, d: dict, monotonic=False):
+    def make_endog_law_of_motion(self, d: dict, monotonic=None):
         if len(self.policy) == 1:
             return lottery_1d(d[self.policy[0]], d[self.policy[0] + '_grid'], monotonic)
-        else:
+        elif len(self.policy) == 2:
             return lottery_2d(d[self.policy[0]], d[self.policy[1]],
-                        d[self.policy[0] + '_grid'], d[self.policy[1] + '_grid'], monotonic)
\ No newline at end of file
+                        d[self.policy[0] + '_grid'], d[self.policy[1] + '_grid'], monotonic)
+        else:
+            return lottery_nd([d[k] for k in self.policy], [d[k + '_grid'] for k in self.policy], monotonic)
\ No newline at end of file
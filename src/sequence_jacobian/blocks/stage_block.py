@@ -1,6 +1,7 @@
 from typing import List, Optional
 import numpy as np
 import copy
+import warnings
 
 from .block import Block
 from .het_block import HetBlock
@@ -12,6 +13,7 @@ from ..utilities.optimized_routines import within_tolerance
 from .. import utilities as utils
 from .support.law_of_motion import LawOfMotion
 from .support.stages import Stage
+from .support.steady_state import WarmStart, warm_start_signature
 
 
 class StageBlock(Block):
@@ -47,6 +49,9 @@ class StageBlock(Block):
             backward_init = ExtendedFunction(backward_init)
         self.backward_init = backward_init
 
+        # results of last steady state with warm_start=True, see _steady_state
+        self._warm_start = None
+
 
     @staticmethod
     def constructor_checks(stages, inputs, outputs):
@@ -73,25 +78,41 @@ class StageBlock(Block):
         return f"<StageBlock '{self.name}' with stages {[k.name for k in self.stages]}>"
 
     def _steady_state(self, calibration, backward_tol=1E-9, backward_maxit=5000,
-                      forward_tol=1E-10, forward_maxit=100_000):
+                      forward_tol=1E-10, forward_maxit=100_000, forward_method='iteration',
+                      backward_accelerator=None, backward_accelerator_kwargs=None, warm_start=False, verbose=False):
         ss = self.extract_ss_dict(calibration)
         hetinputs = self.return_hetinputs(ss)
         ss.update(hetinputs)
+        warm = None
+        if warm_start:
+            # seed backward and forward iterations with results of last steady state, if compatible, and
+            # tighten tolerances so that results hardly depend on the seed (see WarmStart)
+            backward_tol, forward_tol = backward_tol * WarmStart.tol_factor, forward_tol * WarmStart.tol_factor
+            signature = warm_start_signature(ss)
+            if self._warm_start is not None and self._warm_start.matches(signature):
+                warm = self._warm_start
+                ss.update({k: v for k, v in warm.backward.items() if k not in ss})
         self.initialize_backward(ss)
 
-        backward, report, lom = self.backward_steady_state(ss, backward_tol, backward_maxit)
+        backward, report, lom = self.backward_steady_state(ss, backward_tol, backward_maxit, backward_accelerator,
+                                                           backward_accelerator_kwargs, verbose)
 
         # get initialized distribution
         try:
             Dinit = ss[self.stages[0].name]['D']
         except KeyError:
-            # assume that beginning-of-first-stage distribution is uniform, with
-            # same dimensions as ANY backward input to final stage / backward output from first stage
-            backward_last = backward[-1]
-            backward_example = backward_last[list(backward_last)[0]]
-            Dinit = np.full(backward_example.shape, 1/backward_example.size)
+            if warm is not None:
+                Dinit = warm.D
+            else:
+                # assume that beginning-of-first-stage distribution is uniform, with
+                # same dimensions as ANY backward input to final stage / backward output from first stage
+                backward_last = backward[-1]
+                backward_example = backward_last[list(backward_last)[0]]
+                Dinit = np.full(backward_example.shape, 1/backward_example.size)
         
-        D = self.forward_steady_state(Dinit, lom, forward_tol, forward_maxit)
+        D = self.forward_steady_state(Dinit, lom, forward_tol, forward_maxit, forward_method)
+        if warm_start:
+            self._warm_start = WarmStart(signature, {k: backward[-1][k] for k in self.stages[0].backward_outputs}, D[0])
         
         aggregates = {}
         # initialize internals with hetinputs, then add stage-level internals
@@ -134,53 +155,61 @@ class StageBlock(Block):
     def _impulse_linear(self, ss, inputs, outputs, Js):
         return ImpulseDict(self._jacobian(ss, list(inputs.keys()), outputs, inputs.T).apply(inputs))
 
-    def _jacobian(self, ss, inputs, outputs, T):
+    def _jacobian(self, ss, inputs, outputs, T, n_workers=1, dtype=np.float64, dtype_check=0, verbose=False):
         ss = self.extract_ss_dict(ss)
         outputs = self.M_outputs.inv @ outputs
         differentiable_hetinput = self.preliminary_hetinput(ss, h=1E-4)
         backward_data, forward_data, expectations_data = self.preliminary_all_stages(ss)
 
         # step 1
-        curlyYs, curlyDs = {}, {}
-        for i in inputs:
-            curlyYs[i], curlyDs[i] = self.backward_fakenews(i, outputs, T, backward_data, forward_data, differentiable_hetinput)
+        if n_workers > 1:
+            curlyYs, curlyDs = utils.parallel.pool_map(self.backward_fakenews, inputs,
+                                    (outputs, T, backward_data, forward_data, differentiable_hetinput, dtype),
+                                    (T,) + ss[self.stages[0].name]['D'].shape, n_workers, dtype)
+            curlyYs, curlyDs = dict(zip(inputs, curlyYs)), dict(zip(inputs, curlyDs))
+        else:
+            curlyYs, curlyDs = {}, {}
+            for i in inputs:
+                curlyYs[i], curlyDs[i] = self.backward_fakenews(i, outputs, T, backward_data, forward_data, differentiable_hetinput, dtype)
         
         # step 2
         curlyEs = {}
         for o in outputs:
-            curlyEs[o] = self.expectation_vectors(o, T-1, expectations_data)
+            curlyEs[o] = self.expectation_vectors(o, T-1, expectations_data, dtype)
 
         # steps 3-4
-        F, J = {}, {}
-        for o in outputs:
-            for i in inputs:
-                if o.upper() not in F:
-                    F[o.upper()] = {}
-                if o.upper() not in J:
-                    J[o.upper()] = {}
-                F[o.upper()][i] = HetBlock.build_F(curlyYs[i][o], curlyDs[i], curlyEs[o])
-                J[o.upper()][i] = HetBlock.J_from_F(F[o.upper()][i])
+        F = {o: {i: HetBlock.build_F(curlyYs[i][o], curlyDs[i], curlyEs[o]) for i in inputs} for o in outputs}
+        if dtype_check:
+            self.check_F_precision(F, inputs, outputs, T, dtype_check, verbose, backward_data, forward_data,
+                                   expectations_data, differentiable_hetinput)
+
+        J = {o.upper(): {i: HetBlock.J_from_F(F[o][i], inplace=True) for i in inputs} for o in outputs}
         
         return JacobianDict(J, name=self.name, T=T)
 
     '''Steady-state backward and forward methods'''
     
-    def backward_steady_state(self, ss, tol=1E-9, maxit=5000):
+    def backward_steady_state(self, ss, tol=1E-9, maxit=5000, accelerator=None, accelerator_kwargs=None, verbose=False):
         # 'backward' will be dict with backward output of first stage
         # (i.e. input to last stage) from the most recent time iteration
         # initializer for first iteration should be in 'ss'
         
         backward = {k: ss[k] for k in self.stages[0].backward_outputs}
+        accelerate = utils.solvers.make_accelerator(accelerator, accelerator_kwargs)
 
-        # iterate until end-of-final-stage backward inputs converge
+        # iterate until end-of-final-stage backward inputs converge, every iteration if accelerated
         for it in range(maxit):
             backward_new = self.backward_step_steady_state(backward, ss)
-            if it % 10 == 0 and all(within_tolerance(backward_new[k], backward[k], tol) for k in backward):
+            if ((it % 10 == 0 or accelerate is not None)
+                    and all(within_tolerance(backward_new[k], backward[k], tol) for k in backward)):
                 break
-            backward = backward_new
+            backward = backward_new if accelerate is None else accelerate(backward, backward_new)
         else:
             raise ValueError(f'No convergence after {maxit} backward iterations!')
 
+        if verbose:
+            utils.solvers.print_accelerator_summary(self.name, it + 1, accelerate)
+
         # one more iteration to get backward INPUTS, reported outputs, and law of motion for all stages
         return self.backward_step_nonlinear(backward, ss)[:3]
 
@@ -207,8 +236,17 @@ class StageBlock(Block):
         # return that entry separately as the fourth output of this function)
         return backward_all[::-1][1:], report_all[::-1], lom_all[::-1], backward_all[-1]
             
-    def forward_steady_state(self, D, lom: List[LawOfMotion], tol=1E-10, maxit=100_000):
-        """Find steady-state beginning-of-stage distributions for all stages"""
+    def forward_steady_state(self, D, lom: List[LawOfMotion], tol=1E-10, maxit=100_000, method='iteration'):
+        """Find steady-state beginning-of-stage distributions for all stages, by iteration or
+        with method='lu' or 'arnoldi' directly (see HetBlock.forward_steady_state)"""
+        if method != 'iteration':
+            try:
+                D = utils.discretize.stationary_sparse(self.forward_sparse(D.shape, lom), method, tol).reshape(D.shape)
+                return self.forward_step_nonlinear(D, lom)[0]
+            except (ValueError, RuntimeError, NotImplementedError) as e:
+                warnings.warn(f'{self.name}: direct solution for steady-state distribution failed, '
+                              f'falling back to iteration. {e}')
+
         # iterate until beginning-of-stage distribution for first stage converges
         for it in range(maxit):
             D_new = self.forward_step_steady_state(D, lom)
@@ -228,6 +266,14 @@ class StageBlock(Block):
             D = lom @ D
         return D
 
+    def forward_sparse(self, shape, loms: List[LawOfMotion]):
+        """Sparse matrix of forward_step_steady_state on flattened beginning-of-first-stage distributions"""
+        M, D = None, np.empty(shape)
+        for lom in loms:
+            M = lom.sparse(D.shape) if M is None else lom.sparse(D.shape) @ M
+            D = lom @ D
+        return M
+
     def forward_step_nonlinear(self, D, loms: List[LawOfMotion]):
         Ds = [D]
         for i, lom in enumerate(loms):
@@ -281,14 +327,15 @@ class StageBlock(Block):
 
     '''Jacobian calculation: four parts of fake news algorithm, plus support methods'''
 
-    def backward_fakenews(self, input_shocked, output_list, T, backward_data, forward_data, differentiable_hetinput):
+    def backward_fakenews(self, input_shocked, output_list, T, backward_data, forward_data, differentiable_hetinput,
+                          dtype=np.float64):
         din_dict = {input_shocked: 1}
         if differentiable_hetinput is not None and input_shocked in differentiable_hetinput.inputs:
             din_dict.update(differentiable_hetinput.diff(din_dict))
         curlyV, curlyD, curlyY = self.backward_step_fakenews(din_dict, output_list, backward_data, forward_data)
 
         # infer dimensions from this, initialize empty arrays, and fill in contemporaneous effect
-        curlyDs = np.empty((T,) + curlyD.shape)
+        curlyDs = np.empty((T,) + curlyD.shape, dtype=dtype)
         curlyYs = {k: np.empty(T) for k in curlyY.keys()}
 
         curlyDs[0, ...] = curlyD
@@ -360,19 +407,35 @@ class StageBlock(Block):
 
         return curlyV, curlyD, curlyY
 
-    def expectation_vectors(self, o, T, expectations_data):
+    def expectation_vectors(self, o, T, expectations_data, dtype=np.float64):
         """Expectation vector giving expected value of output o, from any stage,
         T periods from now, at the beginning of the first stage
         (demeaned for numerical reasons, which doesn't affect product with curlyD)."""
         curlyE0 = self.expectations_beginning_of_period(o, expectations_data)
-        curlyEs = np.empty((T,) + curlyE0.shape)
-        curlyEs[0] = utils.misc.demean(curlyE0)
+        curlyEs = np.empty((T,) + curlyE0.shape, dtype=dtype)
+        curlyE = curlyEs[0] = utils.misc.demean(curlyE0)
 
         for t in range(1, T):
-            curlyEs[t] = utils.misc.demean(
-                self.expectation_step_fakenews(curlyEs[t-1], expectations_data))
+            curlyE = curlyEs[t] = utils.misc.demean(
+                self.expectation_step_fakenews(curlyE, expectations_data))
         return curlyEs
 
+    def check_F_precision(self, F, inputs, outputs, T, ncols, verbose, backward_data, forward_data,
+                          expectations_data, differentiable_hetinput):
+        """Compare 'ncols' evenly spaced columns of fake news matrices F[o][i], computed at reduced
+        precision, to double precision (see HetBlock.compare_F_columns)"""
+        columns = np.unique(np.linspace(0, T - 1, min(ncols, T)).astype(int))
+        curlyDs = {i: self.backward_fakenews(i, outputs, columns[-1] + 1, backward_data, forward_data,
+                                             differentiable_hetinput)[1][columns] for i in inputs}
+
+        def curlyEs(o):
+            curlyE = utils.misc.demean(self.expectations_beginning_of_period(o, expectations_data))
+            for t in range(T - 1):
+                yield curlyE
+                curlyE = utils.misc.demean(self.expectation_step_fakenews(curlyE, expectations_data))
+
+        return HetBlock.compare_F_columns(self.name, F, columns, curlyDs, curlyEs, verbose)
+
     def expectations_beginning_of_period(self, o, expectations_data):
         """Find expected value of all outputs o, this period, at beginning of first stage"""
         cur_exp = None
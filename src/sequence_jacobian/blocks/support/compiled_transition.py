@@ -0,0 +1,111 @@
+"""Nonlinear transitions of simple HetBlocks compiled into a single njitted function"""
+
+import numpy as np
+from numba import njit
+from numba.core.registry import CPUDispatcher
+
+from .het_compiled import forward_policy_1d
+from ...utilities.interpolate import interpolate_coord_robust_vector, interpolate_coord_njit, interpolate_coord_rows
+
+
+class CompiledTransition:
+    """Backward and forward iteration of a HetBlock with one exogenous Markov matrix and one policy,
+    given paths of a fixed set of `inputs`, as a single njitted function returning aggregate `outputs`.
+
+    The function is generated as Python source calling njitted versions of the hetinputs that depend on
+    `inputs`, the backward step and the hetoutputs needed for `outputs`, all of which must therefore be
+    compatible with numba (e.g. calling gufuncs like interpolate_y with an explicit output array). It is
+    compiled on first call, so only pays off for repeated transitions, e.g. in estimation."""
+
+    def __init__(self, block, inputs, outputs, monotonic=None):
+        if len(block.exogenous) != 1 or len(block.policy) != 1:
+            raise ValueError('compiled transitions need a single exogenous Markov matrix and a single policy')
+        self.inputs, self.outputs, self.monotonic = list(inputs), list(outputs), monotonic
+        self.Pi, self.policy = block.exogenous[0], block.policy[0]
+        self.grid = self.policy + '_grid'
+
+        hetinputs = []
+        if block.hetinputs is not None and self.inputs:
+            hetinputs = block.hetinputs.filter(list(block.hetinputs.functions.values()), self.inputs)
+        hetoutputs = []
+        if block.hetoutputs is not None and set(self.outputs) & set(block.hetoutputs.outputs):
+            hetoutputs = block.hetoutputs.filter(list(block.hetoutputs.functions.values()),
+                                                 block.hetoutputs.inputs, set(self.outputs) & set(block.hetoutputs.outputs))
+        functions = hetinputs + [block.backward_fun] + hetoutputs
+
+        computed = set(self.inputs) | {k + '_p' for k in block.backward}
+        for f in functions:
+            computed |= set(f.outputs)
+        if self.Pi in computed or self.grid in computed:
+            raise ValueError(f'compiled transitions need {self.Pi} and {self.grid} to be constant')
+        used = set().union(*(f.inputs for f in functions)) | set(self.outputs)
+        self.constants = list(dict.fromkeys(list(block.backward) + [self.grid] + sorted(used - computed)))
+
+        stored = [self.policy] + [o for o in self.outputs if o != self.policy]
+        path = {k: f'_path{j}' for j, k in enumerate(stored)}
+
+        lines = [f"def transition(_T, _Dbeg, _Pi, _Pi_T, {', '.join(self.constants + [k + '_path' for k in self.inputs])}):"]
+        lines += [f'    {path[k]} = np.empty((_T,) + _Dbeg.shape)' for k in stored]
+        lines += ['    for _t in range(_T - 1, -1, -1):']
+        lines += [f'        {k}_p = _expectation(_Pi, {k})' for k in block.backward]
+        lines += [f'        {k} = {k}_path[_t]' for k in self.inputs]
+        lines += [f"        {', '.join(f.outputs)} = _f{j}({', '.join(f.inputs)})" for j, f in enumerate(functions)]
+        lines += [f'        {path[k]}[_t] = {k}' for k in stored]
+        lines += [f'    _Y = np.empty(({len(self.outputs)}, _T))',
+                  '    for _t in range(_T):',
+                  '        _D = _forward(_Pi_T, _Dbeg)']
+        lines += [f'        _Y[{j}, _t] = _aggregate(_D, {path[o]}[_t])' for j, o in enumerate(self.outputs)]
+        lines += [f'        _Dbeg = _lottery_forward({path[self.policy]}[_t], {self.grid}, _D, {monotonic})',
+                  '    return _Y']
+        self.source = '\n'.join(lines)
+
+        namespace = {'np': np, '_expectation': expectation, '_forward': expectation,
+                     '_aggregate': aggregate, '_lottery_forward': lottery_forward}
+        namespace.update({f'_f{j}': f.f if isinstance(f.f, CPUDispatcher) else njit(f.f)
+                          for j, f in enumerate(functions)})
+        exec(self.source, namespace)
+        self.transition = njit(namespace['transition'])
+
+    def __deepcopy__(self, memo):
+        # nothing to copy after compilation, and generated functions cannot be pickled
+        return self
+
+    def __call__(self, ss, paths):
+        """Aggregate paths of outputs given steady state `ss` (including internals) and paths in levels
+        for each of the inputs, as a dict"""
+        T = len(next(iter(paths.values())))
+        Pi = np.ascontiguousarray(ss[self.Pi])
+        Y = self.transition(T, ss['Dbeg'], Pi, np.ascontiguousarray(Pi.T),
+                            *[ss[k] for k in self.constants], *[paths[k] for k in self.inputs])
+        return dict(zip(self.outputs, Y))
+
+
+@njit
+def expectation(Pi, X):
+    """Multiply Pi times first dimension of X, as in Markov.expectation (or forward with Pi.T)"""
+    return (Pi @ np.ascontiguousarray(X).reshape((X.shape[0], -1))).reshape(X.shape)
+
+
+@njit
+def aggregate(D, X):
+    D, X = D.ravel(), X.ravel()
+    total = 0.
+    for i in range(D.shape[0]):
+        total += D[i] * X[i]
+    return total
+
+
+@njit
+def lottery_forward(a, grid, D, monotonic):
+    """Distribution after lottery between gridpoints bracketing policy a, as in PolicyLottery1D.forward"""
+    a = np.ascontiguousarray(a).reshape((-1, a.shape[-1]))
+    if monotonic is None:
+        a_i, a_pi, _ = interpolate_coord_rows(grid, a)
+    elif monotonic:
+        a_i, a_pi = np.empty(a.shape, np.uint32), np.empty(a.shape)
+        for r in range(a.shape[0]):
+            a_i[r], a_pi[r] = interpolate_coord_njit(grid, a[r])
+    else:
+        a_i, a_pi = interpolate_coord_robust_vector(grid, a.ravel())
+        a_i, a_pi = a_i.reshape(a.shape), a_pi.reshape(a.shape)
+    return forward_policy_1d(np.ascontiguousarray(D).reshape(a.shape), a_i, a_pi).reshape(D.shape)
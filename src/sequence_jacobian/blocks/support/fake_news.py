@@ -0,0 +1,91 @@
+"""Fake news Jacobians of HetBlocks whose horizon can be extended incrementally"""
+
+import numpy as np
+
+from ...classes import JacobianDict
+from ...utilities.optimized_routines import fake_news_to_jacobian
+
+
+class FakeNewsJacobian:
+    """Jacobian of a HetBlock obtained by the fake news algorithm, retaining curlyYs, curlyDs, curlyEs
+    and the state of the backward iteration, so that extend(T_new) only needs to iterate backward and
+    take expectations for the additional periods, and only fills in the new rows and columns of F and J.
+
+    Created by HetBlock.fake_news(ss, inputs, outputs, T). The Jacobian itself is in .jacobian."""
+
+    def __init__(self, block, ss, inputs, outputs, T, h=1E-4, twosided=False):
+        self.block = block
+        self.inputs = inputs
+        ss = block.extract_ss_dict(ss)
+        self.outputs = block.M_outputs.inv @ outputs
+
+        (self.differentiable_backward_fun, differentiable_hetinputs, self.differentiable_hetoutputs,
+            self.law_of_motion, self.exog_by_output) = block.jac_prelim(ss, self.outputs, h, twosided)
+
+        # part 1: backward iteration for each input, keeping curlyV to continue from
+        self.curlyYs, self.curlyDs, self.curlyVs = {}, {}, {}
+        for i in inputs:
+            self.curlyYs[i], self.curlyDs[i], self.curlyVs[i] = block.backward_fakenews(
+                i, self.outputs, T, self.differentiable_backward_fun, differentiable_hetinputs,
+                self.differentiable_hetoutputs, self.law_of_motion, self.exog_by_output, return_curlyV=True)
+
+        # part 2: expectation vectors for all outputs together, always starting with the one of horizon 0
+        curlyEs = block.expectation_vectors_batch(np.stack([ss[o] for o in self.outputs]), max(T - 1, 1), self.law_of_motion)
+        self.curlyEs = dict(zip(self.outputs, curlyEs))
+
+        # parts 3-4: fake news matrices and Jacobians, starting from an empty (0, 0) one
+        self.T = 0
+        self.J = {o: {i: np.empty((0, 0)) for i in inputs} for o in self.outputs}
+        self.fill(T)
+
+    def __repr__(self):
+        return f'<{type(self).__name__} T={self.T}, outputs={self.outputs}, inputs={self.inputs}>'
+
+    @property
+    def jacobian(self):
+        return self.block.M @ JacobianDict({o.upper(): self.J[o] for o in self.outputs},
+                                           name=self.block.name, T=self.T)
+
+    def extend(self, T_new):
+        """Extend horizon of Jacobian to T_new > T, returning the new JacobianDict"""
+        if T_new < self.T:
+            raise ValueError(f'Cannot extend Jacobian with T={self.T} to shorter T={T_new}')
+        n = T_new - self.T
+        if n > 0:
+            for i in self.inputs:
+                curlyYs, curlyDs, self.curlyVs[i] = self.block.backward_fakenews_continue(
+                    self.curlyVs[i], self.outputs, n, self.differentiable_backward_fun, self.differentiable_hetoutputs,
+                    self.law_of_motion, self.exog_by_output)
+                self.curlyYs[i] = {o: np.concatenate([self.curlyYs[i][o], curlyYs[o]]) for o in self.outputs}
+                self.curlyDs[i] = np.concatenate([self.curlyDs[i], curlyDs])
+
+            curlyEs = self.block.expectation_vectors_continue_batch(np.stack([self.curlyEs[o][-1] for o in self.outputs]),
+                                                                    n, self.law_of_motion)
+            for o, E in zip(self.outputs, curlyEs):
+                self.curlyEs[o] = np.concatenate([self.curlyEs[o], E])
+
+            self.fill(T_new)
+        return self.jacobian
+
+    def fill(self, T_new):
+        """Fill in rows and columns of F and J beyond current horizon, up to T_new"""
+        T = self.T
+        nI = len(self.inputs)
+        D = np.stack([self.curlyDs[i][:T_new].reshape((T_new, -1)) for i in self.inputs])
+
+        for o in self.outputs:
+            E = self.curlyEs[o][:T_new-1].reshape((T_new - 1, -1))
+            F = np.empty((nI, T_new, T_new))
+            for j, i in enumerate(self.inputs):
+                F[j, :T, :T] = self.J[o][i]
+                F[j, 0, T:] = self.curlyYs[i][o][T:T_new]
+            if T > 0:
+                # new columns for existing rows of F...
+                F[:, 1:T, T:] = (E[:T-1] @ D[:, T:, :].reshape((-1, D.shape[2])).T).reshape((T-1, nI, -1)).transpose((1, 0, 2))
+            # ...and all columns for new rows
+            F[:, max(T, 1):, :] = (E[max(T, 1)-1:] @ D.reshape((-1, D.shape[2])).T).reshape((-1, nI, T_new)).transpose((1, 0, 2))
+
+            fake_news_to_jacobian(F, T)
+            self.J[o] = {i: F[j] for j, i in enumerate(self.inputs)}
+
+        self.T = T_new
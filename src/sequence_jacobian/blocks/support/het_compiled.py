@@ -1,11 +1,60 @@
+"""Forward and expectation iterations over policy lotteries.
+
+Each kernel loops over the exogenous dimension iz with prange and writes only to entries in row iz. It is
+compiled twice: serially as the module-level function, which is also what njitted code should call, and with
+parallel=True, run in threads when set_threading(True) has been called. Since every thread does exactly the
+operations of the serial loop for its own rows, both versions give the same results bit for bit."""
+
+import warnings
 import numpy as np
-from numba import njit
+from numba import config, njit, prange, set_num_threads, threading_layer
+
+settings = {'parallel': False}
+_kernels, _parallel_kernels = {}, {}
+
+
+def set_threading(parallel=True, n_threads=None):
+    """Run forward and expectation iterations of HetBlocks over policy lotteries in parallel threads, splitting
+    the exogenous states among 'n_threads' threads (default: all of numba's threads), or serially again
+    if 'parallel' is False.
+
+    Unless numba's threading layer has been configured otherwise (e.g. by the NUMBA_THREADING_LAYER
+    environment variable), threads are run by numba's workqueue layer, since the tbb layer can hang on exit
+    after forking worker processes (as in n_workers > 1). This is only possible before numba launches any
+    threading layer, so a warning is issued if another one is already running."""
+    if parallel and config.THREADING_LAYER == 'default':
+        try:
+            layer = threading_layer()
+        except ValueError:
+            # no threading layer launched yet
+            config.THREADING_LAYER = 'workqueue'
+        else:
+            if layer != 'workqueue':
+                warnings.warn(f"numba's {layer} threading layer is already running, so it cannot be switched "
+                              'to workqueue, and may hang on exit after forking worker processes')
+    settings['parallel'] = parallel
+    if n_threads is not None:
+        set_num_threads(n_threads)
+
+
+def kernel(name):
+    """Version of kernel 'name' to be called from Python, given the current threading setting"""
+    if settings['parallel']:
+        return _parallel_kernels[name]
+    return _kernels[name]
 
-@njit
+
+def twin(f):
+    _kernels[f.__name__] = njit(f)
+    _parallel_kernels[f.__name__] = njit(parallel=True)(f)
+    return _kernels[f.__name__]
+
+
+@twin
 def forward_policy_1d(D, x_i, x_pi):
     nZ, nX = D.shape
     Dnew = np.zeros_like(D)
-    for iz in range(nZ):
+    for iz in prange(nZ):
         for ix in range(nX):
             i = x_i[iz, ix]
             pi = x_pi[iz, ix]
@@ -17,11 +66,11 @@ def forward_policy_1d(D, x_i, x_pi):
     return Dnew
 
 
-@njit
+@twin
 def expectation_policy_1d(X, x_i, x_pi):
     nZ, nX = X.shape
     Xnew = np.zeros_like(X)
-    for iz in range(nZ):
+    for iz in prange(nZ):
         for ix in range(nX):
             i = x_i[iz, ix]
             pi = x_pi[iz, ix]
@@ -29,12 +78,12 @@ def expectation_policy_1d(X, x_i, x_pi):
     return Xnew
 
 
-@njit
+@twin
 def forward_policy_shock_1d(Dss, x_i_ss, x_pi_shock):
     """forward_step_1d linearized wrt x_pi"""
     nZ, nX = Dss.shape
     Dshock = np.zeros_like(Dss)
-    for iz in range(nZ):
+    for iz in prange(nZ):
         for ix in range(nX):
             i = x_i_ss[iz, ix]
             dshock = x_pi_shock[iz, ix] * Dss[iz, ix]
@@ -44,11 +93,11 @@ def forward_policy_shock_1d(Dss, x_i_ss, x_pi_shock):
     return Dshock
 
 
-@njit
+@twin
 def forward_policy_2d(D, x_i, y_i, x_pi, y_pi):
     nZ, nX, nY = D.shape
     Dnew = np.zeros_like(D)
-    for iz in range(nZ):
+    for iz in prange(nZ):
         for ix in range(nX):
             for iy in range(nY):
                 ixp = x_i[iz, ix, iy]
@@ -63,11 +112,11 @@ def forward_policy_2d(D, x_i, y_i, x_pi, y_pi):
     return Dnew
 
 
-@njit
+@twin
 def expectation_policy_2d(X, x_i, y_i, x_pi, y_pi):
     nZ, nX, nY = X.shape
     Xnew = np.empty_like(X)
-    for iz in range(nZ):
+    for iz in prange(nZ):
         for ix in range(nX):
             for iy in range(nY):
                 ixp = x_i[iz, ix, iy]
@@ -81,12 +130,12 @@ def expectation_policy_2d(X, x_i, y_i, x_pi, y_pi):
     return Xnew
 
 
-@njit
+@twin
 def forward_policy_shock_2d(Dss, x_i_ss, y_i_ss, x_pi_ss, y_pi_ss, x_pi_shock, y_pi_shock):
     """Endogenous update part of forward_step_shock_2d"""
     nZ, nX, nY = Dss.shape
     Dshock = np.zeros_like(Dss)
-    for iz in range(nZ):
+    for iz in prange(nZ):
         for ix in range(nX):
             for iy in range(nY):
                 ixp = x_i_ss[iz, ix, iy]
@@ -102,3 +151,309 @@ def forward_policy_shock_2d(Dss, x_i_ss, y_i_ss, x_pi_ss, y_pi_ss, x_pi_shock, y
                 Dshock[iz, ixp, iyp+1] += dalpha * (1-beta) - alpha * dbeta
                 Dshock[iz, ixp+1, iyp+1] -= dalpha * (1-beta) + dbeta * (1-alpha)
     return Dshock
+
+
+@twin
+def forward_policy_shock_1d_batch(Dss, x_i_ss, x_pi_shock):
+    """forward_policy_shock_1d for a stack of K shocks x_pi_shock[k, ...], reusing index loads"""
+    nK = x_pi_shock.shape[0]
+    nZ, nX = Dss.shape
+    Dshock = np.zeros(x_pi_shock.shape)
+    for iz in prange(nZ):
+        for ix in range(nX):
+            i = x_i_ss[iz, ix]
+            d = Dss[iz, ix]
+            for k in range(nK):
+                dshock = x_pi_shock[k, iz, ix] * d
+                Dshock[k, iz, i] += dshock
+                Dshock[k, iz, i + 1] -= dshock
+
+    return Dshock
+
+
+@twin
+def forward_policy_shock_2d_batch(Dss, x_i_ss, y_i_ss, x_pi_ss, y_pi_ss, x_pi_shock, y_pi_shock):
+    """forward_policy_shock_2d for a stack of K shocks (x_pi_shock[k, ...], y_pi_shock[k, ...])"""
+    nK = x_pi_shock.shape[0]
+    nZ, nX, nY = Dss.shape
+    Dshock = np.zeros(x_pi_shock.shape)
+    for iz in prange(nZ):
+        for ix in range(nX):
+            for iy in range(nY):
+                ixp = x_i_ss[iz, ix, iy]
+                iyp = y_i_ss[iz, ix, iy]
+                alpha = x_pi_ss[iz, ix, iy]
+                beta = y_pi_ss[iz, ix, iy]
+                d = Dss[iz, ix, iy]
+
+                for k in range(nK):
+                    dalpha = x_pi_shock[k, iz, ix, iy] * d
+                    dbeta = y_pi_shock[k, iz, ix, iy] * d
+
+                    Dshock[k, iz, ixp, iyp] += dalpha * beta + alpha * dbeta
+                    Dshock[k, iz, ixp+1, iyp] += dbeta * (1-alpha) - beta * dalpha
+                    Dshock[k, iz, ixp, iyp+1] += dalpha * (1-beta) - alpha * dbeta
+                    Dshock[k, iz, ixp+1, iyp+1] -= dalpha * (1-beta) + dbeta * (1-alpha)
+    return Dshock
+
+
+@twin
+def forward_markov_policy_1d(Pi_T, D, x_i, x_pi, mid, out):
+    """Markov step mid = Pi_T @ D along the first dimension followed by forward_policy_1d on mid, into out"""
+    nZ, nX = D.shape
+    for iz in prange(nZ):
+        for ix in range(nX):
+            mid[iz, ix] = 0.
+            out[iz, ix] = 0.
+        for jz in range(nZ):
+            p = Pi_T[iz, jz]
+            if p != 0.:
+                for ix in range(nX):
+                    mid[iz, ix] += p * D[jz, ix]
+
+        for ix in range(nX):
+            i = x_i[iz, ix]
+            pi = x_pi[iz, ix]
+            d = mid[iz, ix]
+
+            out[iz, i] += d * pi
+            out[iz, i+1] += d * (1 - pi)
+    return out
+
+
+@twin
+def expectation_policy_markov_1d(Pi, X, x_i, x_pi, mid, out):
+    """expectation_policy_1d on X into mid, followed by Markov step out = Pi @ mid along the first dimension"""
+    nZ, nX = X.shape
+    for iz in prange(nZ):
+        for ix in range(nX):
+            i = x_i[iz, ix]
+            pi = x_pi[iz, ix]
+            mid[iz, ix] = pi * X[iz, i] + (1-pi) * X[iz, i+1]
+
+    for iz in prange(nZ):
+        for ix in range(nX):
+            out[iz, ix] = 0.
+        for jz in range(nZ):
+            p = Pi[iz, jz]
+            if p != 0.:
+                for ix in range(nX):
+                    out[iz, ix] += p * mid[jz, ix]
+    return out
+
+
+@twin
+def forward_markov_policy_2d(Pi_T, D, x_i, y_i, x_pi, y_pi, mid, out):
+    """Markov step mid = Pi_T @ D along the first dimension followed by forward_policy_2d on mid, into out"""
+    nZ, nX, nY = D.shape
+    for iz in prange(nZ):
+        for ix in range(nX):
+            for iy in range(nY):
+                mid[iz, ix, iy] = 0.
+                out[iz, ix, iy] = 0.
+        for jz in range(nZ):
+            p = Pi_T[iz, jz]
+            if p != 0.:
+                for ix in range(nX):
+                    for iy in range(nY):
+                        mid[iz, ix, iy] += p * D[jz, ix, iy]
+
+        for ix in range(nX):
+            for iy in range(nY):
+                ixp = x_i[iz, ix, iy]
+                iyp = y_i[iz, ix, iy]
+                beta = x_pi[iz, ix, iy]
+                alpha = y_pi[iz, ix, iy]
+                d = mid[iz, ix, iy]
+
+                out[iz, ixp, iyp] += alpha * beta * d
+                out[iz, ixp+1, iyp] += alpha * (1 - beta) * d
+                out[iz, ixp, iyp+1] += (1 - alpha) * beta * d
+                out[iz, ixp+1, iyp+1] += (1 - alpha) * (1 - beta) * d
+    return out
+
+
+@twin
+def expectation_policy_markov_2d(Pi, X, x_i, y_i, x_pi, y_pi, mid, out):
+    """expectation_policy_2d on X into mid, followed by Markov step out = Pi @ mid along the first dimension"""
+    nZ, nX, nY = X.shape
+    for iz in prange(nZ):
+        for ix in range(nX):
+            for iy in range(nY):
+                ixp = x_i[iz, ix, iy]
+                iyp = y_i[iz, ix, iy]
+                alpha = x_pi[iz, ix, iy]
+                beta = y_pi[iz, ix, iy]
+
+                mid[iz, ix, iy] = (alpha * beta * X[iz, ixp, iyp] + alpha * (1-beta) * X[iz, ixp, iyp+1] +
+                                   (1-alpha) * beta * X[iz, ixp+1, iyp] +
+                                   (1-alpha) * (1-beta) * X[iz, ixp+1, iyp+1])
+
+    for iz in prange(nZ):
+        for ix in range(nX):
+            for iy in range(nY):
+                out[iz, ix, iy] = 0.
+        for jz in range(nZ):
+            p = Pi[iz, jz]
+            if p != 0.:
+                for ix in range(nX):
+                    for iy in range(nY):
+                        out[iz, ix, iy] += p * mid[jz, ix, iy]
+    return out
+
+
+@twin
+def forward_policy_1d_batch(D, x_i, x_pi):
+    """forward_policy_1d for a stack of K distributions D[k, ...], reusing index loads"""
+    nK, nZ, nX = D.shape
+    Dnew = np.zeros_like(D)
+    for iz in prange(nZ):
+        for ix in range(nX):
+            i = x_i[iz, ix]
+            pi = x_pi[iz, ix]
+            for k in range(nK):
+                d = D[k, iz, ix]
+                Dnew[k, iz, i] += d * pi
+                Dnew[k, iz, i+1] += d * (1 - pi)
+    return Dnew
+
+
+@twin
+def expectation_policy_1d_batch(X, x_i, x_pi):
+    """expectation_policy_1d for a stack of K arrays X[k, ...], reusing index loads"""
+    nK, nZ, nX = X.shape
+    Xnew = np.empty_like(X)
+    for iz in prange(nZ):
+        for ix in range(nX):
+            i = x_i[iz, ix]
+            pi = x_pi[iz, ix]
+            for k in range(nK):
+                Xnew[k, iz, ix] = pi * X[k, iz, i] + (1-pi) * X[k, iz, i+1]
+    return Xnew
+
+
+@twin
+def forward_policy_2d_batch(D, x_i, y_i, x_pi, y_pi):
+    """forward_policy_2d for a stack of K distributions D[k, ...], reusing index loads"""
+    nK, nZ, nX, nY = D.shape
+    Dnew = np.zeros_like(D)
+    for iz in prange(nZ):
+        for ix in range(nX):
+            for iy in range(nY):
+                ixp = x_i[iz, ix, iy]
+                iyp = y_i[iz, ix, iy]
+                beta = x_pi[iz, ix, iy]
+                alpha = y_pi[iz, ix, iy]
+
+                for k in range(nK):
+                    d = D[k, iz, ix, iy]
+                    Dnew[k, iz, ixp, iyp] += alpha * beta * d
+                    Dnew[k, iz, ixp+1, iyp] += alpha * (1 - beta) * d
+                    Dnew[k, iz, ixp, iyp+1] += (1 - alpha) * beta * d
+                    Dnew[k, iz, ixp+1, iyp+1] += (1 - alpha) * (1 - beta) * d
+    return Dnew
+
+
+@twin
+def expectation_policy_2d_batch(X, x_i, y_i, x_pi, y_pi):
+    """expectation_policy_2d for a stack of K arrays X[k, ...], reusing index loads"""
+    nK, nZ, nX, nY = X.shape
+    Xnew = np.empty_like(X)
+    for iz in prange(nZ):
+        for ix in range(nX):
+            for iy in range(nY):
+                ixp = x_i[iz, ix, iy]
+                iyp = y_i[iz, ix, iy]
+                alpha = x_pi[iz, ix, iy]
+                beta = y_pi[iz, ix, iy]
+
+                for k in range(nK):
+                    Xnew[k, iz, ix, iy] = (alpha * beta * X[k, iz, ixp, iyp] + alpha * (1-beta) * X[k, iz, ixp, iyp+1] +
+                                           (1-alpha) * beta * X[k, iz, ixp+1, iyp] +
+                                           (1-alpha) * (1-beta) * X[k, iz, ixp+1, iyp+1])
+    return Xnew
+
+
+@twin
+def markov_expectation_batch(Pi, X, out):
+    """out[k] = Pi @ X[k] along the first dimension after the stacking one, for all k"""
+    nK, nZ, nX = X.shape
+    for iz in prange(nZ):
+        for k in range(nK):
+            for ix in range(nX):
+                out[k, iz, ix] = 0.
+            for jz in range(nZ):
+                p = Pi[iz, jz]
+                if p != 0.:
+                    for ix in range(nX):
+                        out[k, iz, ix] += p * X[k, jz, ix]
+    return out
+
+
+def policy_nd_kernels(k):
+    """Names of forward, expectation and forward shock kernels for lotteries over k endogenous dimensions, which
+    take lower gridpoints x_i and weights x_pi of dims (nZ, M, k) and the strides of the k dimensions within
+    the flattened M (the shock kernel also takes a tuple of k policy shocks and derivatives of x_pi with
+    respect to policies). Their source is generated for each k, with the loop over the 2^k corners each
+    point moves to unrolled as in the 2D kernels, and compiled on first call like all other kernels."""
+    names = [f'forward_policy_nd{k}', f'expectation_policy_nd{k}', f'forward_policy_shock_nd{k}']
+    if names[0] not in _kernels:
+        namespace = {'np': np, 'prange': prange}
+        exec(policy_nd_source(k), namespace)
+        for name in names:
+            twin(namespace[name])
+    return names
+
+
+def policy_nd_source(k):
+    """Source of the kernels in policy_nd_kernels(k). Bit d of each corner indicates the upper gridpoint in dimension d."""
+    corners = [tuple((c >> d) & 1 for d in range(k)) for c in range(2 ** k)]
+
+    def offset(corner):
+        return ' + '.join(['_base'] + [f'_s{d}' for d in range(k) if corner[d]])
+
+    def products(first, factor, update=None):
+        """Lines building weight of each corner as product 'first' * factors over dimensions, one dimension at a
+        time, named _w followed by the corner's bits. With 'update', also derivative _dw with respect to shocks."""
+        lines = [f'_w = {first}'] + (['_dw = 0.'] if update else [])
+        prefixes = ['']
+        for d in range(k):
+            new = []
+            for pre in prefixes:
+                for bit in (0, 1):
+                    if not (update and d == k - 1):
+                        # with derivatives, only those of the final corner weights are needed
+                        lines.append(f'_w{pre}{bit} = _w{pre} * {factor(d, bit)}')
+                    if update:
+                        lines.append(f'_dw{pre}{bit} = _dw{pre} * {factor(d, bit)} {update(d, bit)} _w{pre} * _dp{d}')
+                    new.append(f'{pre}{bit}')
+            prefixes = new
+        return lines
+
+    def pq(d, bit):
+        return f'_q{d}' if bit else f'_p{d}'
+
+    def loop(name, args, init, body):
+        lines = [f'def {name}({args}, x_i, x_pi, strides):',
+                 '    nZ, M = x_i.shape[0], x_i.shape[1]',
+                 f'    {init}']
+        lines += [f'    _s{d} = strides[{d}]' for d in range(k)]
+        lines += ['    for iz in prange(nZ):',
+                  '        for m in range(M):']
+        lines += ['            _base = ' + ' + '.join(f'x_i[iz, m, {d}] * _s{d}' for d in range(k))]
+        lines += [f'            _p{d} = x_pi[iz, m, {d}]\n            _q{d} = 1 - _p{d}' for d in range(k)]
+        lines += ['            ' + line for line in body]
+        lines += ['    return ' + init.split(' = ')[0], '']
+        return lines
+
+    bits = [''.join(map(str, corner)) for corner in corners]
+    source = loop(f'forward_policy_nd{k}', 'D', 'Dnew = np.zeros_like(D)',
+                  products('D[iz, m]', pq) + [f'Dnew[iz, {offset(c)}] += _w{b}' for c, b in zip(corners, bits)])
+    source += loop(f'expectation_policy_nd{k}', 'X', 'Xnew = np.empty_like(X)',
+                   products('1.', pq) + ['Xnew[iz, m] = ' + ' + '.join(f'_w{b} * X[iz, {offset(c)}]'
+                                                                      for c, b in zip(corners, bits))])
+    source += loop(f'forward_policy_shock_nd{k}', 'Dss, x_shock, x_pi_dx', 'Dshock = np.zeros_like(Dss)',
+                   [f'_dp{d} = x_shock[{d}][iz, m] * x_pi_dx[iz, m, {d}]' for d in range(k)]
+                   + products('Dss[iz, m]', pq, lambda d, bit: '-' if bit else '+')
+                   + [f'Dshock[iz, {offset(c)}] += _dw{b}' for c, b in zip(corners, bits)])
+    return '\n'.join(source)
@@ -1,8 +1,9 @@
 import numpy as np
 from . import het_compiled
 from ...utilities.discretize import stationary as general_stationary
-from ...utilities.interpolate import interpolate_coord_robust, interpolate_coord
-from ...utilities.multidim import batch_multiply_ith_dimension, multiply_ith_dimension
+from ...utilities.interpolate import interpolate_coord_policy
+from ...utilities.multidim import (batch_multiply_ith_dimension, multiply_ith_dimension,
+                                  sparse_ith_dimension, sparse_lottery)
 from ...utilities.misc import logsum
 from typing import Optional, Sequence, Any, List, Tuple, Union
 
@@ -20,6 +21,18 @@ class Transition:
     def expectation_shockable(self, Xss):
         raise NotImplementedError(f'Shockable expectation not implemented for {type(self)}')
 
+    def forward_batch(self, D):
+        """Apply forward to each D[k, ...] in a stack along leading axis"""
+        return np.stack([self.forward(d) for d in D])
+
+    def expectation_batch(self, X):
+        """Apply expectation to each X[k, ...] in a stack along leading axis"""
+        return np.stack([self.expectation(x) for x in X])
+
+    def sparse(self, shape):
+        """Sparse matrix M such that M @ D.ravel() == forward(D).ravel() for D of 'shape'"""
+        raise NotImplementedError(f'Sparse matrix not implemented for {type(self)}')
+
 
 class ForwardShockableTransition(Transition):
     """Abstract class extending Transition, allowing us to find effect of shock to transition rule
@@ -33,6 +46,10 @@ class ForwardShockableTransition(Transition):
     def forward_shock(self, shocks):
         pass
 
+    def forward_shock_batch(self, shocks):
+        """Like forward_shock, but each shock has an extra leading axis stacking K shocks"""
+        pass
+
 
 class ExpectationShockableTransition(Transition):
     def expectation_shock(self, shocks):
@@ -40,12 +57,10 @@ class ExpectationShockableTransition(Transition):
 
 
 
-def lottery_1d(a, a_grid, monotonic=False):
-    if not monotonic:
-        return PolicyLottery1D(*interpolate_coord_robust(a_grid, a), a_grid)
-    else:
-        return PolicyLottery1D(*interpolate_coord(a_grid, a), a_grid)
-    
+def lottery_1d(a, a_grid, monotonic=None):
+    """Lottery for policy a on a_grid, interpolated by merge if 'monotonic', by binary search if not,
+    and choosing between them row by row if None (see interpolate_coord_auto)"""
+    return PolicyLottery1D(*interpolate_coord_policy(a_grid, a, -1, monotonic), a_grid)
 
 class PolicyLottery1D(Transition):
     # TODO: always operates on final dimension, highly non-generic in that sense
@@ -64,10 +79,23 @@ class PolicyLottery1D(Transition):
         self.endog_shape = self.shape[-1:]
         
     def forward(self, D):
-        return het_compiled.forward_policy_1d(D.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
+        return het_compiled.kernel('forward_policy_1d')(D.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
     
     def expectation(self, X):
-        return het_compiled.expectation_policy_1d(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
+        return het_compiled.kernel('expectation_policy_1d')(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
+
+    def forward_batch(self, D):
+        nK = D.shape[0]
+        return het_compiled.kernel('forward_policy_1d_batch')(D.reshape((nK,) + self.flatshape), self.i,
+                                                              self.pi).reshape((nK,) + self.shape)
+
+    def expectation_batch(self, X):
+        nK = X.shape[0]
+        return het_compiled.kernel('expectation_policy_1d_batch')(X.reshape((nK,) + self.flatshape), self.i,
+                                                                  self.pi).reshape((nK,) + self.shape)
+
+    def sparse(self, shape=None):
+        return sparse_lottery(self.shape, [(self.i, self.pi)])
 
     def forward_shockable(self, Dss):
         return ForwardShockablePolicyLottery1D(self.i.reshape(self.shape), self.pi.reshape(self.shape),
@@ -82,17 +110,18 @@ class ForwardShockablePolicyLottery1D(PolicyLottery1D, ForwardShockableTransitio
 
     def forward_shock(self, da):
         pi_shock = - da.reshape(self.flatshape) / self.space
-        return het_compiled.forward_policy_shock_1d(self.Dss, self.i, pi_shock).reshape(self.shape)
+        return het_compiled.kernel('forward_policy_shock_1d')(self.Dss, self.i, pi_shock).reshape(self.shape)
 
+    def forward_shock_batch(self, da):
+        nK = da.shape[0]
+        pi_shock = - da.reshape((nK,) + self.flatshape) / self.space
+        return het_compiled.kernel('forward_policy_shock_1d_batch')(self.Dss, self.i, pi_shock).reshape((nK,) + self.shape)
 
-def lottery_2d(a, b, a_grid, b_grid, monotonic=False):
-    if not monotonic:
-        return PolicyLottery2D(*interpolate_coord_robust(a_grid, a),
-                           *interpolate_coord_robust(b_grid, b), a_grid, b_grid)
-    if monotonic:
-        # right now we have no monotonic 2D examples, so this shouldn't be called
-        return PolicyLottery2D(*interpolate_coord(a_grid, a),
-                           *interpolate_coord(b_grid, b), a_grid, b_grid)
+
+def lottery_2d(a, b, a_grid, b_grid, monotonic=None):
+    """Lottery for policies a and b, each interpolated along its own dimension (-2 and -1) as in lottery_1d"""
+    return PolicyLottery2D(*interpolate_coord_policy(a_grid, a, -2, monotonic),
+                           *interpolate_coord_policy(b_grid, b, -1, monotonic), a_grid, b_grid)
 
 
 class PolicyLottery2D(Transition):
@@ -114,13 +143,26 @@ class PolicyLottery2D(Transition):
         self.endog_shape = self.shape[-2:]
 
     def forward(self, D):
-        return het_compiled.forward_policy_2d(D.reshape(self.flatshape), self.i1, self.i2,
+        return het_compiled.kernel('forward_policy_2d')(D.reshape(self.flatshape), self.i1, self.i2,
                                                 self.pi1, self.pi2).reshape(self.shape)
     
     def expectation(self, X):
-        return het_compiled.expectation_policy_2d(X.reshape(self.flatshape), self.i1, self.i2,
+        return het_compiled.kernel('expectation_policy_2d')(X.reshape(self.flatshape), self.i1, self.i2,
                                                     self.pi1, self.pi2).reshape(self.shape)
 
+    def forward_batch(self, D):
+        nK = D.shape[0]
+        return het_compiled.kernel('forward_policy_2d_batch')(D.reshape((nK,) + self.flatshape), self.i1, self.i2,
+                                                              self.pi1, self.pi2).reshape((nK,) + self.shape)
+
+    def expectation_batch(self, X):
+        nK = X.shape[0]
+        return het_compiled.kernel('expectation_policy_2d_batch')(X.reshape((nK,) + self.flatshape), self.i1, self.i2,
+                                                                  self.pi1, self.pi2).reshape((nK,) + self.shape)
+
+    def sparse(self, shape=None):
+        return sparse_lottery(self.shape, [(self.i1, self.pi1), (self.i2, self.pi2)])
+
     def forward_shockable(self, Dss):
         return ForwardShockablePolicyLottery2D(self.i1.reshape(self.shape), self.pi1.reshape(self.shape),
                                             self.i2.reshape(self.shape), self.pi2.reshape(self.shape),
@@ -139,9 +181,74 @@ class ForwardShockablePolicyLottery2D(PolicyLottery2D, ForwardShockableTransitio
         pi_shock1 = -da1.reshape(self.flatshape) / self.space1
         pi_shock2 = -da2.reshape(self.flatshape) / self.space2
 
-        return het_compiled.forward_policy_shock_2d(self.Dss, self.i1, self.i2, self.pi1, self.pi2,
+        return het_compiled.kernel('forward_policy_shock_2d')(self.Dss, self.i1, self.i2, self.pi1, self.pi2,
                                                     pi_shock1, pi_shock2).reshape(self.shape)
 
+    def forward_shock_batch(self, da):
+        da1, da2 = da
+        nK = da1.shape[0]
+        pi_shock1 = -da1.reshape((nK,) + self.flatshape) / self.space1
+        pi_shock2 = -da2.reshape((nK,) + self.flatshape) / self.space2
+
+        return het_compiled.kernel('forward_policy_shock_2d_batch')(self.Dss, self.i1, self.i2, self.pi1, self.pi2,
+                                                          pi_shock1, pi_shock2).reshape((nK,) + self.shape)
+
+
+def lottery_nd(policies, grids, monotonic=None):
+    """Policy lottery over len(grids) endogenous dimensions, the last ones of each of 'policies', with
+    each policy interpolated along its own dimension as in lottery_1d"""
+    k = len(grids)
+    coords = [interpolate_coord_policy(grid, a, d - k, monotonic) for d, (a, grid) in enumerate(zip(policies, grids))]
+    return PolicyLotteryND([i for i, _ in coords], [pi for _, pi in coords], grids)
+
+
+class PolicyLotteryND(Transition):
+    """Tensor-product lottery over any number k of endogenous dimensions, where each point's mass moves to the
+    2^k corners of the box bracketing its policies. Indices and weights for all k dimensions are stored
+    contiguously for each point, and kernels are generated for each k with the loop over corners unrolled."""
+    def __init__(self, i, pi, grids):
+        # flatten non-policy dimensions into one, and all endogenous dimensions into another
+        self.shape = i[0].shape
+        self.grids = grids
+        self.endog_shape = self.shape[-len(grids):]
+        self.flatshape = (-1, int(np.prod(self.endog_shape)))
+
+        # indices and weights for all k dimensions, with dims (nZ, M, k)
+        self.i = np.stack([x.reshape(self.flatshape) for x in i], axis=-1)
+        self.pi = np.stack([x.reshape(self.flatshape) for x in pi], axis=-1)
+        self.strides = np.array([int(np.prod(self.endog_shape[d+1:])) for d in range(len(grids))], dtype=np.uint64)
+        self.kernels = het_compiled.policy_nd_kernels(len(grids))
+
+    def forward(self, D):
+        return het_compiled.kernel(self.kernels[0])(D.reshape(self.flatshape), self.i, self.pi,
+                                                    self.strides).reshape(self.shape)
+
+    def expectation(self, X):
+        return het_compiled.kernel(self.kernels[1])(X.reshape(self.flatshape), self.i, self.pi,
+                                                    self.strides).reshape(self.shape)
+
+    def sparse(self, shape=None):
+        return sparse_lottery(self.shape, [(self.i[..., d], self.pi[..., d]) for d in range(len(self.grids))])
+
+    def forward_shockable(self, Dss):
+        return ForwardShockablePolicyLotteryND([self.i[..., d].reshape(self.shape) for d in range(len(self.grids))],
+                                               [self.pi[..., d].reshape(self.shape) for d in range(len(self.grids))],
+                                               self.grids, Dss)
+
+
+class ForwardShockablePolicyLotteryND(PolicyLotteryND, ForwardShockableTransition):
+    def __init__(self, i, pi, grids, Dss):
+        super().__init__(i, pi, grids)
+        self.Dss = Dss.reshape(self.flatshape)
+        self.dpi_da = np.stack([-1 / (grid[self.i[..., d]+1] - grid[self.i[..., d]]) for d, grid in enumerate(grids)], axis=-1)
+
+    def forward_shock(self, da):
+        return het_compiled.kernel(self.kernels[2])(self.Dss, tuple(x.reshape(self.flatshape) for x in da), self.dpi_da,
+                                                    self.i, self.pi, self.strides).reshape(self.shape)
+
+    def forward_shock_batch(self, da):
+        return np.stack([self.forward_shock([x[j] for x in da]) for j in range(da[0].shape[0])])
+
 
 class Markov(Transition):
     def __init__(self, Pi, i):
@@ -158,6 +265,15 @@ class Markov(Transition):
     def expectation(self, X):
         return multiply_ith_dimension(self.Pi, self.i, X)
 
+    def forward_batch(self, D):
+        return multiply_ith_dimension(self.Pi_T, self.i + 1, D)
+
+    def expectation_batch(self, X):
+        return multiply_ith_dimension(self.Pi, self.i + 1, X)
+
+    def sparse(self, shape):
+        return sparse_ith_dimension(self.Pi_T, self.i, shape)
+
     def forward_shockable(self, Dss):
         return ForwardShockableMarkov(self.Pi, self.i, Dss)
 
@@ -190,16 +306,103 @@ class CombinedTransition(Transition):
     def __init__(self, stages: Sequence[Transition]):
         self.stages = stages
     
-    def forward(self, D):
-        for stage in self.stages:
+    def forward(self, D, out=None, mid=None):
+        """Apply stages in order. Optionally write the result into 'out' and, for a fused Markov matrix and
+        policy lottery, the distribution between them (after the exogenous step) into 'mid'"""
+        fused = self.fused()
+        if fused is not None:
+            markov, lottery = fused
+            if mid is None:
+                mid = np.empty_like(D)
+            if out is None:
+                out = np.empty_like(D)
+            if isinstance(lottery, PolicyLottery1D):
+                het_compiled.kernel('forward_markov_policy_1d')(markov.Pi_T, D.reshape(lottery.flatshape),
+                                                                lottery.i, lottery.pi, mid.reshape(lottery.flatshape),
+                                                                out.reshape(lottery.flatshape))
+            else:
+                het_compiled.kernel('forward_markov_policy_2d')(markov.Pi_T, D.reshape(lottery.flatshape),
+                                                                lottery.i1, lottery.i2, lottery.pi1, lottery.pi2,
+                                                                mid.reshape(lottery.flatshape),
+                                                                out.reshape(lottery.flatshape))
+            return out
+
+        for j, stage in enumerate(self.stages):
             D = stage.forward(D)
+            if j == 0 and mid is not None:
+                mid[...] = D
+        if out is not None:
+            out[...] = D
+            return out
         return D
 
-    def expectation(self, X):
+    def expectation(self, X, out=None):
+        fused = self.fused()
+        if fused is not None:
+            markov, lottery = fused
+            mid = np.empty_like(X)
+            if out is None:
+                out = np.empty_like(X)
+            if isinstance(lottery, PolicyLottery1D):
+                het_compiled.kernel('expectation_policy_markov_1d')(markov.Pi, X.reshape(lottery.flatshape),
+                                                                    lottery.i, lottery.pi,
+                                                                    mid.reshape(lottery.flatshape),
+                                                                    out.reshape(lottery.flatshape))
+            else:
+                het_compiled.kernel('expectation_policy_markov_2d')(markov.Pi, X.reshape(lottery.flatshape),
+                                                                    lottery.i1, lottery.i2, lottery.pi1, lottery.pi2,
+                                                                    mid.reshape(lottery.flatshape),
+                                                                    out.reshape(lottery.flatshape))
+            return out
+
         for stage in reversed(self.stages):
             X = stage.expectation(X)
+        if out is not None:
+            out[...] = X
+            return out
         return X
 
+    def fused(self):
+        """(Markov, policy lottery) if this is a single Markov matrix on the first dimension followed by a
+        lottery on all other dimensions, which forward and expectation then apply in one compiled kernel"""
+        if not hasattr(self, '_fused'):
+            self._fused = None
+            stages = list(self.stages)
+            if len(stages) == 2 and isinstance(stages[0], CombinedTransition) and len(stages[0].stages) == 1:
+                stages[0] = stages[0].stages[0]
+            if (len(stages) == 2 and isinstance(stages[0], Markov) and isinstance(stages[1], (PolicyLottery1D, PolicyLottery2D))
+                    and isinstance(stages[0].Pi, np.ndarray) and stages[0].i == 0
+                    and stages[1].flatshape[0] == stages[0].Pi.shape[0]):
+                self._fused = stages[0], stages[1]
+        return self._fused
+
+    def forward_batch(self, D):
+        for stage in self.stages:
+            D = stage.forward_batch(D)
+        return D
+
+    def expectation_batch(self, X):
+        fused = self.fused()
+        if fused is not None:
+            # lottery for all K at once, then Markov step for all K without reordering axes
+            markov, lottery = fused
+            nK = X.shape[0]
+            mid = lottery.expectation_batch(X)
+            out = np.empty_like(mid)
+            het_compiled.kernel('markov_expectation_batch')(markov.Pi, mid.reshape((nK, markov.Pi.shape[0], -1)),
+                                                            out.reshape((nK, markov.Pi.shape[0], -1)))
+            return out
+
+        for stage in reversed(self.stages):
+            X = stage.expectation_batch(X)
+        return X
+
+    def sparse(self, shape):
+        M = None
+        for stage in self.stages:
+            M = stage.sparse(shape) if M is None else stage.sparse(shape) @ M
+        return M
+
     def forward_shockable(self, Dss):
         shockable_stages = []
         for stage in self.stages:
@@ -251,6 +454,29 @@ class ForwardShockableCombinedTransition(CombinedTransition, ForwardShockableTra
 
         return dD
 
+    def forward_shock_batch(self, shocks: Optional[Sequence[Optional[Union[Shock, ListTupleShocks]]]]):
+        if shocks is None:
+            return None
+
+        # same as forward_shock, but all shocks and dD carry a leading axis stacking K shocks
+        dD = None
+
+        for stage, shock in zip(self.stages, shocks):
+            if shock is not None:
+                dD_shock = stage.forward_shock_batch(shock)
+            else:
+                dD_shock = None
+
+            if dD is not None:
+                dD = stage.forward_batch(dD)
+
+                if shock is not None:
+                    dD += dD_shock
+            else:
+                dD = dD_shock
+
+        return dD
+
 
 class ExpectationShockableCombinedTransition(CombinedTransition, ExpectationShockableTransition):
     def __init__(self, stages: Sequence[ExpectationShockableTransition]):
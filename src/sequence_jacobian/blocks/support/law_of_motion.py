@@ -1,7 +1,8 @@
 import numpy as np
 from . import het_compiled
-from ...utilities.interpolate import interpolate_coord_robust, interpolate_coord
-from ...utilities.multidim import batch_multiply_ith_dimension, multiply_ith_dimension
+from ...utilities.interpolate import interpolate_coord_policy
+from ...utilities.multidim import (batch_multiply_ith_dimension, multiply_ith_dimension, sparse_ith_dimension,
+                                  sparse_batch_ith_dimension, sparse_lottery)
 from typing import Optional, Sequence, Any, List, Tuple, Union
 import copy
 
@@ -17,12 +18,15 @@ class LawOfMotion:
     def T(self):
         pass
 
+    def sparse(self, shape):
+        """Sparse matrix M such that M @ X.ravel() == (self @ X).ravel() for X of 'shape'"""
+        raise NotImplementedError(f'Sparse matrix not implemented for {type(self)}')
 
-def lottery_1d(a, a_grid, monotonic=False):
-    if not monotonic:
-        return PolicyLottery1D(*interpolate_coord_robust(a_grid, a), a_grid)
-    else:
-        return PolicyLottery1D(*interpolate_coord(a_grid, a), a_grid)
+
+def lottery_1d(a, a_grid, monotonic=None):
+    """Lottery for policy a on a_grid, interpolated by merge if 'monotonic', by binary search if not,
+    and choosing between them row by row if None (see interpolate_coord_auto)"""
+    return PolicyLottery1D(*interpolate_coord_policy(a_grid, a, -1, monotonic), a_grid)
 
 
 class PolicyLottery1D(LawOfMotion):
@@ -49,29 +53,29 @@ class PolicyLottery1D(LawOfMotion):
         newself.forward = not self.forward
         return newself
 
+    def sparse(self, shape=None):
+        M = sparse_lottery(self.shape, [(self.i, self.pi)])
+        return M if self.forward else M.T.tocsr()
+
     def __matmul__(self, X):
         if self.forward:
-            return het_compiled.forward_policy_1d(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
+            return het_compiled.kernel('forward_policy_1d')(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
         else:
-            return het_compiled.expectation_policy_1d(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
+            return het_compiled.kernel('expectation_policy_1d')(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
 
 
 class ShockedPolicyLottery1D(PolicyLottery1D):
     def __matmul__(self, X):
         if self.forward:
-            return het_compiled.forward_policy_shock_1d(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
+            return het_compiled.kernel('forward_policy_shock_1d')(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
         else:
             raise NotImplementedError
 
 
-def lottery_2d(a, b, a_grid, b_grid, monotonic=False):
-    if not monotonic:
-        return PolicyLottery2D(*interpolate_coord_robust(a_grid, a),
-                           *interpolate_coord_robust(b_grid, b), a_grid, b_grid)
-    if monotonic:
-        # right now we have no monotonic 2D examples, so this shouldn't be called
-        return PolicyLottery2D(*interpolate_coord(a_grid, a),
-                           *interpolate_coord(b_grid, b), a_grid, b_grid)
+def lottery_2d(a, b, a_grid, b_grid, monotonic=None):
+    """Lottery for policies a and b, each interpolated along its own dimension (-2 and -1) as in lottery_1d"""
+    return PolicyLottery2D(*interpolate_coord_policy(a_grid, a, -2, monotonic),
+                           *interpolate_coord_policy(b_grid, b, -1, monotonic), a_grid, b_grid)
 
 
 class PolicyLottery2D(LawOfMotion):
@@ -100,19 +104,23 @@ class PolicyLottery2D(LawOfMotion):
         newself.forward = not self.forward
         return newself
 
+    def sparse(self, shape=None):
+        M = sparse_lottery(self.shape, [(self.i1, self.pi1), (self.i2, self.pi2)])
+        return M if self.forward else M.T.tocsr()
+
     def __matmul__(self, X):
         if self.forward:
-            return het_compiled.forward_policy_2d(X.reshape(self.flatshape), self.i1, self.i2,
+            return het_compiled.kernel('forward_policy_2d')(X.reshape(self.flatshape), self.i1, self.i2,
                                                 self.pi1, self.pi2).reshape(self.shape)
         else:
-            return het_compiled.expectation_policy_2d(X.reshape(self.flatshape), self.i1, self.i2,
+            return het_compiled.kernel('expectation_policy_2d')(X.reshape(self.flatshape), self.i1, self.i2,
                                                     self.pi1, self.pi2).reshape(self.shape)
 
 
 class ShockedPolicyLottery2D(PolicyLottery2D):
     def __matmul__(self, X):
         if self.forward:
-            return het_compiled.forward_policy_shock_2d(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
+            return het_compiled.kernel('forward_policy_shock_2d')(X.reshape(self.flatshape), self.i, self.pi).reshape(self.shape)
         else:
             raise NotImplementedError
 
@@ -131,6 +139,9 @@ class Markov(LawOfMotion):
             newself.Pi = newself.Pi.copy()
         return newself
 
+    def sparse(self, shape):
+        return sparse_ith_dimension(self.Pi, self.i, shape)
+
     def __matmul__(self, X):
         return multiply_ith_dimension(self.Pi, self.i, X)
 
@@ -150,6 +161,10 @@ class DiscreteChoice(LawOfMotion):
         newself.forward = not self.forward
         return newself
 
+    def sparse(self, shape=None):
+        M = sparse_batch_ith_dimension(self.P, self.i)
+        return M if self.forward else M.T.tocsr()
+
     def __matmul__(self, X):
         if self.forward:
             return batch_multiply_ith_dimension(self.P, self.i, X)
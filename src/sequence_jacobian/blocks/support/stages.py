@@ -111,8 +111,7 @@ class Continuous1D(Stage):
         if not lawofmotion:
             return outputs
         else:
-            # TODO: option for monotonic?!
-            return outputs, lottery_1d(outputs[self.policy], inputs[self.policy + '_grid'], monotonic=False)
+            return outputs, lottery_1d(outputs[self.policy], inputs[self.policy + '_grid'])
     
     def backward_step_shock(self, ss, shocks, precomputed):
         space, i, grid, f = precomputed
@@ -152,7 +151,6 @@ class Continuous2D(Stage):
         if not lawofmotion:
             return outputs
         else:
-            # TODO: option for monotonic?!
             return outputs, lottery_2d(outputs[self.policy[0]], outputs[self.policy[1]],
                                        inputs[self.policy[0] + '_grid'], inputs[self.policy[1] + '_grid'])
     
@@ -363,3 +363,38 @@ def constrained_multivariate_residual(residual, bounds, method="linear_continuat
     # TODO: Implement logistic transform as another option for constrained multivariate residual
     else:
         raise ValueError(f"Method {method} for constrained multivariate root-finding has not yet been implemented.")
+
+
+class WarmStart:
+    """Converged backward variables and beginning-of-period distribution from a heterogeneous-agent
+    block's last steady state, used to seed its next one when called with warm_start=True.
+
+    Seeds are only used if the next calibration has the same grids (all inputs ending in '_grid') and
+    all its other array inputs have the same shapes; otherwise the block starts afresh from backward_init.
+
+    Warm-started results depend on the previous call up to the tolerances of the backward and forward
+    iterations. At the default tolerances, this history dependence makes a solver's residual noisy close
+    to the root, so that e.g. brentq needs almost twice as many evaluations to calibrate Krusell-Smith,
+    and results are not reproducible across call sequences. With warm_start=True, blocks therefore
+    multiply both tolerances by 'tol_factor', which keeps the number of evaluations as without warm
+    starts. Each evaluation then takes more iterations than a cold start at the default tolerances, but
+    fewer than a cold start at the same tolerances (587 against 722 backward iterations per evaluation
+    in Krusell-Smith with nA=200). To trade smoothness for speed instead, pass looser tolerances, which
+    are scaled in the same way."""
+
+    tol_factor = 1E-4
+
+    def __init__(self, signature, backward, D):
+        self.signature = signature
+        self.backward = backward
+        self.D = D
+
+    def matches(self, signature):
+        return (signature.keys() == self.signature.keys()
+                and all(np.array_equal(v, self.signature[k]) for k, v in signature.items()))
+
+
+def warm_start_signature(ss):
+    """Grids and shapes of array inputs in ss, which must be unchanged for a WarmStart to be used"""
+    return {k: v.copy() if k.endswith('_grid') else np.array(v.shape)
+            for k, v in ss.items() if isinstance(v, np.ndarray)}
@@ -1,4 +1,5 @@
 from .steady_state_dict import SteadyStateDict, UserProvidedSS
 from .impulse_dict import ImpulseDict
-from .jacobian_dict import JacobianDict, FactoredJacobianDict
-from .sparse_jacobians import IdentityMatrix, SimpleSparse
+from .jacobian_dict import JacobianDict, FactoredJacobianDict, BroydenJacobianDict
+from .sparse_jacobians import IdentityMatrix, SimpleSparse, QuasiToeplitz
+from .jacobian_cache import JacobianCache
@@ -0,0 +1,236 @@
+"""Persistent on-disk store for block Jacobians, keyed by the content of everything they depend on"""
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import inspect
+import functools
+import numpy as np
+
+from .jacobian_dict import JacobianDict
+
+
+class JacobianCache:
+    """Directory of Jacobians, each stored as one .npy file of stacked (T, T) arrays plus .json metadata.
+
+    Keys hash the block's functions (including hetinputs, hetoutputs and the helpers they call by
+    global name, but not functions reached only as attributes of modules), its steady-state inputs
+    and internals, the requested inputs, outputs and T, and the Jacobian options (e.g. h, twosided),
+    as well as the version of sequence_jacobian and the source of its modules that compute the
+    Jacobian (those defining the block's class and its bases, blocks.support and utilities).
+    Hits are memory-mapped copy-on-write, so they are only read from disk as needed. If 'max_bytes'
+    is given, the least recently used entries are evicted whenever the store grows beyond it.
+
+    Use by passing as the 'cache' option of a block that supports it, e.g.
+        hh.jacobian(ss, inputs, T=300, cache=JacobianCache('jacobians'))
+    or, for a block nested in a model,
+        model.solve_jacobian(ss, unknowns, targets, inputs, options={'hh': {'cache': cache}})"""
+
+    # options that do not affect the resulting Jacobian, beyond rounding
+    ignored_options = ('verbose', 'log', 'n_workers', 'batch', 'fused', 'memory_budget', 'scratch_dir', 'dtype_check')
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} '{self.directory}'>"
+
+    def jacobian(self, block, ss, inputs, outputs, T, options, compute):
+        """Return Jacobian from cache if present, otherwise obtain it from compute() and store it"""
+        key = self.key(block, ss, inputs, outputs, T, options)
+        J = self.get(key)
+        if J is None:
+            J = compute()
+            self.put(key, J)
+        return J
+
+    def key(self, block, ss, inputs, outputs, T, options):
+        h = hashlib.sha256()
+        update_hash(h, (type(block).__name__, block.name, list(inputs), list(outputs), T))
+        update_hash(h, (package_version(), library_source_hash(block)))
+        update_hash(h, {k: v for k, v in options.items() if k not in self.ignored_options})
+        update_hash(h, [function_source(f) for f in block_functions(block)])
+        update_hash(h, {k: ss[k] for k in block.inputs if k in ss})
+        update_hash(h, getattr(ss, 'internals', {}).get(block.name, {}))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        try:
+            with open(self.path(key) + '.json') as f:
+                meta = json.load(f)
+            stacked = np.load(self.path(key) + '.npy', mmap_mode='c')
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # mark as recently used
+        os.utime(self.path(key) + '.npy')
+
+        J = {}
+        for k, (o, i) in enumerate(meta['pairs']):
+            J.setdefault(o, {})[i] = stacked[k]
+        return JacobianDict(J, meta['outputs'], meta['inputs'], name=meta['name'], T=meta['T'])
+
+    def put(self, key, J: JacobianDict):
+        pairs = [(o, i) for o in J.outputs for i in J.nesteddict[o]]
+        if not pairs or not all(isinstance(J[o, i], np.ndarray) for o, i in pairs):
+            # only store dense Jacobians, others are cheap to recompute
+            return
+
+        # write .npy first and metadata last, so that an interrupted write is never seen as a hit
+        np.save(self.path(key) + '.npy', np.stack([J[o, i] for o, i in pairs]))
+        with open(self.path(key) + '.json', 'w') as f:
+            json.dump({'pairs': pairs, 'outputs': list(J.outputs), 'inputs': list(J.inputs),
+                       'name': J.name, 'T': J.T}, f)
+
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def entries(self):
+        """List of (key, size in bytes, last used time) for all stored Jacobians"""
+        entries = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.npy'):
+                stat = os.stat(os.path.join(self.directory, fname))
+                entries.append((fname[:-4], stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self, max_bytes):
+        """Remove least recently used entries until total size is at most 'max_bytes'"""
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        for key, size, _ in entries:
+            if total <= max_bytes:
+                break
+            self.remove(key)
+            total -= size
+
+    def remove(self, key):
+        for ext in ('.json', '.npy'):
+            try:
+                os.remove(self.path(key) + ext)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for key, *_ in self.entries():
+            self.remove(key)
+
+
+def update_hash(h, x):
+    """Feed object built from arrays, numbers, strings, dicts, lists and tuples into hash h"""
+    if isinstance(x, np.ndarray) or isinstance(x, np.generic):
+        x = np.ascontiguousarray(x)
+        h.update(f'array{x.dtype.str}{x.shape}'.encode())
+        if x.dtype == object:
+            for v in x.ravel():
+                update_hash(h, v)
+        else:
+            h.update(x.tobytes())
+    elif isinstance(x, dict):
+        h.update(b'dict')
+        for k in sorted(x, key=str):
+            update_hash(h, str(k))
+            update_hash(h, x[k])
+    elif isinstance(x, (list, tuple)):
+        h.update(f'{type(x).__name__}{len(x)}'.encode())
+        for v in x:
+            update_hash(h, v)
+    else:
+        h.update(f'{type(x).__name__}:{x!r};'.encode())
+
+
+def block_functions(block):
+    """All plain Python functions used by block, found among its attributes (recursing into the
+    ExtendedFunctions, stages and containers that hold them), together with all functions they call
+    by global name, e.g. njitted helpers defined in the same module (see called_functions)"""
+    found, seen = [], set()
+
+    def visit(x, depth):
+        if id(x) in seen or depth > 6:
+            return
+        seen.add(id(x))
+        if inspect.isfunction(x):
+            found.append(x)
+            for g in called_functions(x):
+                visit(g, 0)
+        elif isinstance(x, dict):
+            for v in x.values():
+                visit(v, depth + 1)
+        elif isinstance(x, (list, tuple)):
+            for v in x:
+                visit(v, depth + 1)
+        elif type(x).__module__.startswith('sequence_jacobian') and hasattr(x, '__dict__'):
+            for v in vars(x).values():
+                visit(v, depth + 1)
+
+    visit(vars(block), 0)
+    return found
+
+
+# functions from these packages are not hashed, nor searched for further functions
+library_packages = {'numpy', 'scipy', 'numba', 'pandas', 'builtins'} | getattr(sys, 'stdlib_module_names', set())
+
+
+def called_functions(f):
+    """Functions among the globals named in f's code (and in that of functions nested in it),
+    unwrapping numba's njit, vectorize and guvectorize to the Python functions they compile"""
+    names, codes = set(), [f.__code__]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes += [c for c in code.co_consts if inspect.iscode(c)]
+
+    functions = []
+    for name in sorted(names):
+        g = f.__globals__.get(name)
+        g = getattr(g, 'py_func', None) or getattr(getattr(g, '_dispatcher', None), 'py_func', None) or g
+        if inspect.isfunction(g) and g.__module__.split('.')[0] not in library_packages:
+            functions.append(g)
+    return functions
+
+
+def package_version():
+    try:
+        from importlib import metadata
+    except ImportError:
+        # Python 3.7, where the source hash alone has to identify the library
+        return None
+    try:
+        return metadata.version('sequence-jacobian')
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def library_source_hash(block):
+    """Hash of the source files of the sequence_jacobian modules that compute the block's Jacobian:
+    those defining its class and base classes, and all modules in blocks.support and utilities"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    files = {inspect.getsourcefile(c) for c in type(block).__mro__ if c.__module__.startswith('sequence_jacobian')}
+    for package in ('blocks/support', 'utilities'):
+        files.update(glob.glob(os.path.join(root, package, '*.py')))
+    return files_hash(tuple(sorted(os.path.relpath(f, root) for f in files)), root)
+
+
+@functools.lru_cache(maxsize=None)
+def files_hash(files, root):
+    h = hashlib.sha256()
+    for fname in files:
+        h.update(fname.encode())
+        with open(os.path.join(root, fname), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def function_source(f):
+    try:
+        return inspect.getsource(f)
+    except (OSError, TypeError):
+        code = f.__code__
+        return repr((code.co_code, code.co_consts, code.co_names))
@@ -6,12 +6,12 @@ from ..utilities.misc import factor, factored_solve
 from ..utilities.ordered_set import OrderedSet
 from ..utilities.bijection import Bijection
 from .impulse_dict import ImpulseDict
-from .sparse_jacobians import IdentityMatrix, SimpleSparse, make_matrix
+from .sparse_jacobians import IdentityMatrix, SimpleSparse, QuasiToeplitz, make_matrix
 from typing import Any, Dict, Union
 
 Array = Any
 
-Jacobian = Union[np.ndarray, IdentityMatrix, SimpleSparse]
+Jacobian = Union[np.ndarray, IdentityMatrix, SimpleSparse, QuasiToeplitz]
 
 class NestedDict:
     def __init__(self, nesteddict, outputs: OrderedSet=None, inputs: OrderedSet=None, name: str=None):
@@ -175,10 +175,14 @@ class JacobianDict(NestedDict):
                 Jout = None
                 for m in m_list:
                     if m in J_om[o] and i in J_mi[m]:
+                        term = J_om[o][m] @ J_mi[m][i]
                         if Jout is None:
-                            Jout = J_om[o][m] @ J_mi[m][i]
+                            Jout = term
+                        elif isinstance(Jout, np.ndarray) and isinstance(term, np.ndarray):
+                            Jout += term
                         else:
-                            Jout += J_om[o][m] @ J_mi[m][i]
+                            # not in place, since sum of e.g. ndarray and QuasiToeplitz may change type
+                            Jout = Jout + term
                 if Jout is not None:
                     J_oi[o][i] = Jout
 
@@ -293,6 +297,43 @@ class FactoredJacobianDict:
         return ImpulseDict.unpack(out, self.unknowns, self.T)
 
 
+class BroydenJacobianDict:
+    """Quasi-Newton approximation to H_U, starting from a FactoredJacobianDict and updated after each step
+    by the rank-one ("good") Broyden update. Rather than refactoring, the inverse is kept as the existing LU
+    factor followed by a sequence of Sherman-Morrison corrections, so apply() costs one LU solve plus O(kTn)
+    for k updates so far."""
+
+    def __init__(self, H_U_factored: FactoredJacobianDict):
+        self.H_U_factored = H_U_factored
+        self.T = H_U_factored.T
+        self.unknowns = H_U_factored.unknowns
+        self.targets = H_U_factored.targets
+        self.corrections = []
+
+    def __repr__(self):
+        return (f'<{type(self).__name__} unknowns={self.unknowns}, targets={self.targets}, '
+                f'updates={len(self.corrections)}>')
+
+    def solve(self, y):
+        """Returns B^{-1} @ y for the current approximation B of H_U, with y and output packed"""
+        z = factored_solve(self.H_U_factored.H_U_factored, y)
+        for c, s in self.corrections:
+            z += c * (s @ z)
+        return z
+
+    def apply(self, x: Union[ImpulseDict, Dict[str, Array]]):
+        """Returns -B^{-1} @ x"""
+        return ImpulseDict.unpack(-self.solve(ImpulseDict(x).get(self.targets).pack()), self.unknowns, self.T)
+
+    def update(self, dU: Union[ImpulseDict, Dict[str, Array]], dH: Union[ImpulseDict, Dict[str, Array]]):
+        """Broyden update so that B @ dU = dH, for a step dU in unknowns that changed targets by dH"""
+        s = ImpulseDict(dU).get(self.unknowns).pack()
+        Binv_y = self.solve(ImpulseDict(dH).get(self.targets).pack())
+        denominator = s @ Binv_y
+        if abs(denominator) > 1E-12 * np.linalg.norm(s) * np.linalg.norm(Binv_y):
+            self.corrections.append(((s - Binv_y) / denominator, s))
+
+
 def ensure_valid_jacobiandict(d):
     """The valid structure of `d` is a Dict[str, Dict[str, Jacobian]], where calling `d[o][i]` yields a
     Jacobian of type Jacobian mapping sequences of `i` to sequences of `o`. The null type for `d` is assumed
@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.fft
 from numba import njit
 import copy
 
@@ -286,3 +287,222 @@ def make_matrix(A, T):
         return A.matrix(T)
     else:
         return A
+
+
+class QuasiToeplitz:
+    """Compressed representation of T*T matrix that is Toeplitz except for dense corrections in its
+    top-left and bottom-right corners, as is the case (up to a tolerance) for Jacobians of HetBlocks.
+
+    The Toeplitz part is stored as its 'generator', a length 2T-1 array with generator[T-1+d] giving
+    the entries on the diagonal t-s=d. The corrections are stored as a (k, k) array 'top_left' added to
+    the first k rows and columns, and a (l, l) array 'bottom_right' added to the last l rows and columns.
+
+    Multiplication by vectors and matrices uses the FFT, costing O(T log T) per column rather than
+    O(T^2). The product of two QuasiToeplitz matrices is again QuasiToeplitz: its generator is the
+    convolution of generators, and its corners are computed exactly. Entries smaller than 'tol' times
+    the largest entry are dropped from corners when compressing.
+
+    Like SimpleSparse, these can be used interchangeably with ordinary NumPy matrices.
+    """
+
+    # when performing binary operations on QuasiToeplitz and a NumPy array, use QuasiToeplitz's rules
+    __array_priority__ = 1000
+    __array_ufunc__ = None
+
+    def __init__(self, generator, top_left=None, bottom_right=None, tol=0.):
+        self.generator = generator
+        self.top_left = np.zeros((0, 0)) if top_left is None else top_left
+        self.bottom_right = np.zeros((0, 0)) if bottom_right is None else bottom_right
+        self.tol = tol
+        self.shape = ((len(generator) + 1) // 2,) * 2
+        self._fft = {}
+
+    @staticmethod
+    def from_dense(A, tol=1E-10):
+        """Compress T*T array A, taking generator from its last row and column. If the corner corrections
+        needed to represent A up to 'tol' times its largest entry would cover more than half of A,
+        compression is not worthwhile and A itself is returned."""
+        T = A.shape[0]
+        generator = np.concatenate((A[:, -1], A[-1, -2::-1]))
+        E = A - toeplitz_matrix(generator)
+        corners = significant_corners(E, tol * np.max(np.abs(A)))
+        if corners is None:
+            return A
+        k, l = corners
+        return QuasiToeplitz(generator, E[:k, :k], E[T-l:, T-l:], tol)
+
+    @staticmethod
+    def from_sparse(S, T):
+        """Exact QuasiToeplitz representation of first T rows and columns of SimpleSparse S"""
+        generator = np.zeros(2 * T - 1)
+        k = max([min(m + abs(i), T) for (i, m) in S.elements if m > 0 and abs(i) < T], default=0)
+        top_left = np.zeros((k, k))
+        for (i, m), x in S.elements.items():
+            if abs(i) >= T:
+                continue
+            generator[T - 1 - i] += x
+            # first m entries on the diagonal are missing
+            for j in range(min(m, T - abs(i))):
+                top_left[(j, j + i) if i >= 0 else (j - i, j)] -= x
+        return QuasiToeplitz(generator, top_left)
+
+    @property
+    def T(self):
+        """Transpose"""
+        return QuasiToeplitz(self.generator[::-1], self.top_left.T, self.bottom_right.T, self.tol)
+
+    def matrix(self, T=None):
+        """Return dense T*T array"""
+        if T is not None and T != self.shape[0]:
+            raise ValueError(f'Trying to convert {self} to a matrix with different dimension {T}')
+        T = self.shape[0]
+        A = toeplitz_matrix(self.generator)
+        k, l = len(self.top_left), len(self.bottom_right)
+        A[:k, :k] += self.top_left
+        A[T-l:, T-l:] += self.bottom_right
+        return A
+
+    def toeplitz_matmul(self, X):
+        """Product of Toeplitz part with (T, S) array X, using the FFT"""
+        T = self.shape[0]
+        n = scipy.fft.next_fast_len(3 * T - 2, real=True)
+        if n not in self._fft:
+            self._fft[n] = scipy.fft.rfft(self.generator, n)
+        Y = scipy.fft.irfft(self._fft[n][:, np.newaxis] * scipy.fft.rfft(X, n, axis=0), n, axis=0)
+        return Y[T-1:2*T-1]
+
+    def matmul_array(self, X):
+        """Product with (T, S) array X"""
+        T = self.shape[0]
+        Y = self.toeplitz_matmul(X)
+        k, l = len(self.top_left), len(self.bottom_right)
+        Y[:k] += self.top_left @ X[:k]
+        Y[T-l:] += self.bottom_right @ X[T-l:]
+        return Y
+
+    def matmul_quasitoeplitz(self, B):
+        """Product with QuasiToeplitz B, again QuasiToeplitz with generator given by convolution of
+        generators, and corners large enough to include the boundary effects of each factor"""
+        T = self.shape[0]
+        if B.shape[0] != T:
+            raise ValueError(f'Trying to multiply {self} and {B} with inconsistent dimensions')
+        tol = max(self.tol, B.tol)
+
+        # generator of product of infinite Toeplitz matrices, restricted to lags up to T-1
+        n = scipy.fft.next_fast_len(4 * T - 3, real=True)
+        generator = scipy.fft.irfft(scipy.fft.rfft(self.generator, n) * scipy.fft.rfft(B.generator, n), n)[T-1:3*T-2]
+
+        # boundary effects extend from each factor's corners by as far as the relevant side of other generator
+        pos_a, neg_a = self.lags(tol)
+        pos_b, neg_b = B.lags(tol)
+        k = max(len(self.top_left), len(B.top_left)) + max(pos_a, neg_b) + 1
+        l = max(len(self.bottom_right), len(B.bottom_right)) + max(neg_a, pos_b) + 1
+        if k + l > T // 2:
+            return QuasiToeplitz.from_dense(self.matmul_array(B.matrix()), tol)
+
+        # exact product in corners
+        I = np.eye(T)
+        toeplitz = toeplitz_matrix(generator)
+        top_left = self.matmul_array(B.matmul_array(I[:, :k]))[:k] - toeplitz[:k, :k]
+        bottom_right = self.matmul_array(B.matmul_array(I[:, T-l:]))[T-l:] - toeplitz[T-l:, T-l:]
+
+        # trim corners to tolerance, relative to largest entry
+        scale = max(np.max(np.abs(generator)), np.max(np.abs(top_left)), np.max(np.abs(bottom_right)))
+        E = np.zeros((T, T))
+        E[:k, :k], E[T-l:, T-l:] = top_left, bottom_right
+        k, l = significant_corners(E, tol * scale)
+        return QuasiToeplitz(generator, E[:k, :k], E[T-l:, T-l:], tol)
+
+    def lags(self, tol):
+        """Largest positive and negative lag d = t-s on which generator has significant entries"""
+        T = self.shape[0]
+        significant = np.nonzero(np.abs(self.generator) > tol * np.max(np.abs(self.generator)))[0] - (T - 1)
+        if len(significant) == 0:
+            return 0, 0
+        return max(significant[-1], 0), max(-significant[0], 0)
+
+    def __matmul__(self, A):
+        if isinstance(A, QuasiToeplitz):
+            return self.matmul_quasitoeplitz(A)
+        elif isinstance(A, SimpleSparse):
+            return self.matmul_quasitoeplitz(QuasiToeplitz.from_sparse(A, self.shape[0]))
+        elif isinstance(A, np.ndarray):
+            if A.ndim == 2:
+                return self.matmul_array(A)
+            elif A.ndim == 1:
+                return self.matmul_array(A[:, np.newaxis])[:, 0]
+            else:
+                return NotImplemented
+        else:
+            return NotImplemented
+
+    def __rmatmul__(self, A):
+        if isinstance(A, SimpleSparse):
+            return QuasiToeplitz.from_sparse(A, self.shape[0]) @ self
+        elif isinstance(A, np.ndarray):
+            # for simplicity, just use transpose to reduce this to previous cases
+            return (self.T @ A.T).T
+        else:
+            return NotImplemented
+
+    def __add__(self, A):
+        if isinstance(A, QuasiToeplitz):
+            k = max(len(self.top_left), len(A.top_left))
+            l = max(len(self.bottom_right), len(A.bottom_right))
+            top_left, bottom_right = np.zeros((k, k)), np.zeros((l, l))
+            for X in (self, A):
+                top_left[:len(X.top_left), :len(X.top_left)] += X.top_left
+                bottom_right[l-len(X.bottom_right):, l-len(X.bottom_right):] += X.bottom_right
+            return QuasiToeplitz(self.generator + A.generator, top_left, bottom_right, max(self.tol, A.tol))
+        elif isinstance(A, SimpleSparse):
+            return self + QuasiToeplitz.from_sparse(A, self.shape[0])
+        elif isinstance(A, np.ndarray):
+            return self.matrix() + A
+        else:
+            return NotImplemented
+
+    def __radd__(self, A):
+        return self + A
+
+    def __sub__(self, A):
+        return self + (-A)
+
+    def __rsub__(self, A):
+        return -self + A
+
+    def __mul__(self, a):
+        if not np.isscalar(a):
+            return NotImplemented
+        return QuasiToeplitz(a * self.generator, a * self.top_left, a * self.bottom_right, self.tol)
+
+    def __rmul__(self, a):
+        return self * a
+
+    def __neg__(self):
+        return -1 * self
+
+    def __pos__(self):
+        return self
+
+    def __repr__(self):
+        return (f'QuasiToeplitz(T={self.shape[0]}, top_left={len(self.top_left)}, '
+                f'bottom_right={len(self.bottom_right)})')
+
+
+def toeplitz_matrix(generator):
+    """Dense T*T Toeplitz matrix with generator[T-1+d] on diagonal t-s=d"""
+    T = (len(generator) + 1) // 2
+    return generator[np.subtract.outer(np.arange(T), np.arange(T)) + T - 1]
+
+
+def significant_corners(E, threshold):
+    """Smallest sizes k, l of top-left and bottom-right corners of T*T array E such that all entries
+    above 'threshold' in absolute value are in one of them, or None if these cover over half of E"""
+    T = E.shape[0]
+    t, s = np.nonzero(np.abs(E) > threshold)
+    top = t + s < T - 1
+    k = np.max(np.maximum(t[top], s[top]) + 1, initial=0)
+    l = np.max(T - np.minimum(t[~top], s[~top]), initial=0)
+    if k + l > T // 2:
+        return None
+    return int(k), int(l)
@@ -22,17 +22,12 @@ def hh(Va_p, a_grid, we, T, r, beta, eis, frisch, vphi):
 
     lhs = c_nextgrid - we[:, np.newaxis] * n_nextgrid + a_grid[np.newaxis, :] - T[:, np.newaxis]
     rhs = (1 + r) * a_grid
-    c = interpolate.interpolate_y(lhs, rhs, c_nextgrid)
-    n = interpolate.interpolate_y(lhs, rhs, n_nextgrid)
+    c, n = np.empty_like(lhs), np.empty_like(lhs)
+    interpolate.interpolate_y(lhs, rhs, c_nextgrid, c)
+    interpolate.interpolate_y(lhs, rhs, n_nextgrid, n)
 
     a = rhs + we[:, np.newaxis] * n + T[:, np.newaxis] - c
-    iconst = np.nonzero(a < a_grid[0])
-    a[iconst] = a_grid[0]
-
-    if iconst[0].size != 0 and iconst[1].size != 0:
-        c[iconst], n[iconst] = solve_cn(we[iconst[0]],
-                                        rhs[iconst[1]] + T[iconst[0]] - a_grid[0],
-                                        eis, frisch, vphi, Va_p[iconst])
+    constrain(a, c, n, a_grid[0], we, rhs, T, eis, frisch, vphi, Va_p)
 
     Va = (1 + r) * c ** (-1 / eis)
     
@@ -47,9 +42,15 @@ def cn(uc, w, eis, frisch, vphi):
     return uc ** (-eis), (w * uc / vphi) ** frisch
 
 
-def solve_cn(w, T, eis, frisch, vphi, uc_seed):
-    uc = solve_uc(w, T, eis, frisch, vphi, uc_seed)
-    return cn(uc, w, eis, frisch, vphi)
+@njit
+def constrain(a, c, n, amin, we, rhs, T, eis, frisch, vphi, uc_seed):
+    """Impose borrowing constraint a >= amin in place, solving for c and n wherever it binds"""
+    for i in range(a.shape[0]):
+        for j in range(a.shape[1]):
+            if a[i, j] < amin:
+                a[i, j] = amin
+                uc = solve_uc(we[i], rhs[j] + T[i] - amin, eis, frisch, vphi, uc_seed[i, j])
+                c[i, j], n[i, j] = cn(uc, we[i], eis, frisch, vphi)
 
 
 @vectorize
@@ -17,8 +17,9 @@ def hh_init(a_grid, y, r, eis):
 def hh(Va_p, a_grid, y, r, beta, eis):
     uc_nextgrid = beta * Va_p
     c_nextgrid = uc_nextgrid ** (-eis)
-    coh = (1 + r) * a_grid[np.newaxis, :] + y[:, np.newaxis]
-    a = interpolate.interpolate_y(c_nextgrid + a_grid, coh, a_grid)
+    coh = (1 + r) * a_grid + y[..., np.newaxis]
+    a = np.empty_like(coh)
+    interpolate.interpolate_y(c_nextgrid + a_grid, coh, a_grid, a)
     misc.setmin(a, a_grid[0])
     c = coh - a
     Va = (1 + r) * c ** (-1 / eis)
@@ -1,4 +1,4 @@
 """Utilities relating to: interpolation, forward step/transition, grids and Markov chains, solvers, sorting, etc."""
 
 from . import (bijection, differentiate, discretize, drawdag, function, graph, interpolate,
-                misc, multidim, optimized_routines, ordered_set, solvers)
+                misc, multidim, optimized_routines, ordered_set, parallel, solvers)
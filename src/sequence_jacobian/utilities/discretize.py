@@ -1,6 +1,8 @@
 """Grids and Markov chains"""
 
 import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
 from scipy.stats import norm
 
 
@@ -62,6 +64,44 @@ def stationary(Pi, pi_seed=None, tol=1E-11, maxit=10_000):
     return pi
 
 
+def stationary_sparse(A, method='lu', tol=1E-10):
+    """Find invariant distribution D = A @ D of a Markov chain with sparse, column-stochastic transition
+    matrix A directly, rather than by iteration: with method='lu', by sparse LU solution of (I - A) D = 0
+    with D[k] = 1 for some state k with positive mass, followed by normalization; with method='arnoldi',
+    as the eigenvector of A with the largest eigenvalue (which is 1), found by Arnoldi iteration.
+
+    Raises ValueError if the result is not a distribution invariant under A up to 'tol'."""
+    N = A.shape[0]
+    A = sparse.csr_matrix(A)
+    if method == 'lu':
+        # pin down a state that still has mass after some forward iterations from the uniform
+        # distribution (pinning a single entry, rather than normalizing the sum, avoids fill-in)
+        D = np.full(N, 1/N)
+        for _ in range(100):
+            D = A @ D
+        k = np.argmax(D)
+        keep = np.arange(N) != k
+        M = (sparse.identity(N, format='csr') - A)[keep][:, keep].tocsc()
+        D = np.ones(N)
+        D[keep] = sparse_linalg.spsolve(M, A[keep][:, k].toarray().ravel())
+        D /= D.sum()
+    elif method == 'arnoldi':
+        _, v = sparse_linalg.eigs(A, k=1, which='LM', v0=np.full(N, 1/N), tol=tol)
+        D = np.real(v[:, 0])
+        D = D / D.sum()
+    else:
+        raise ValueError(f"Unknown method '{method}' for stationary distribution, options are 'lu' and 'arnoldi'")
+
+    # remove roundoff error, then check
+    if not np.all(np.isfinite(D)) or D.min() < -tol:
+        raise ValueError(f"Stationary distribution from method '{method}' is not a distribution")
+    D = np.maximum(D, 0)
+    D /= D.sum()
+    if np.max(np.abs(A @ D - D)) > tol:
+        raise ValueError(f"Stationary distribution from method '{method}' is not invariant up to tol={tol}")
+    return D
+
+
 def mean(x, pi):
     """Mean of discretized random variable with support x and probability mass function pi."""
     return np.sum(pi * x)
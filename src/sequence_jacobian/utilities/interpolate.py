@@ -15,6 +15,13 @@
 
     Composing interpolate_coord and apply_coord gives interpolate_y.
 
+    - interpolate_coord_robust: (x, xq) -> (xqi, xqpi)
+        same as interpolate_coord, but by binary search, so that xq need not be increasing
+
+    - interpolate_coord_auto: (x, xq) -> (xqi, xqpi)
+        same as interpolate_coord_robust, but checking each row of xq and using the faster
+        interpolate_coord on the rows that are increasing
+
     All three functions are written for vectors but can be broadcast to other dimensions
     since we use Numba's guvectorize decorator. In these cases, interpolation is always
     done on the final dimension.
@@ -185,6 +192,120 @@ def interpolate_coord_robust_vector(x, xq):
     return xqi, xqpi
 
 
+'''Part 3: Interpolation that checks monotonicity of each row of query points, using the O(n+nq) merge of
+    interpolate_coord where it is valid and the binary search of interpolate_coord_robust elsewhere.
+
+    Both give identical results on increasing query points, so this is a drop-in replacement for
+    interpolate_coord_robust. The number of rows done each way is accumulated in coord_counts.
+'''
+
+coord_counts = {'monotonic': 0, 'robust': 0}
+
+
+def reset_coord_counts():
+    """Set counts of rows interpolated each way by interpolate_coord_auto back to zero"""
+    for k in coord_counts:
+        coord_counts[k] = 0
+
+
+def interpolate_coord_auto(x, xq, axis=-1):
+    """Linear interpolation of query points xq against ascending data points x along 'axis' of xq,
+    xq = xqpi * x[xqi] + (1-xqpi) * x[xqi+1]
+
+    Each row of xq along 'axis' is checked for monotonicity in the same compiled pass, and interpolated
+    by the merge of interpolate_coord if nondecreasing, or by the binary search of
+    interpolate_coord_robust otherwise.
+
+    Parameters
+    ----------
+    x    : array (n), ascending data points
+    xq   : array (..., nq, ...), query points (in any order), nq along 'axis'
+    axis : int, axis of xq along which to check monotonicity
+
+    Returns
+    ----------
+    xqi  : array (..., nq, ...), indices of lower bracketing gridpoints
+    xqpi : array (..., nq, ...), weights on lower bracketing gridpoints
+    """
+    if x.ndim != 1:
+        raise ValueError('Data input to interpolate_coord_auto must have exactly one dimension')
+
+    xq_rows = np.moveaxis(xq, axis, -1)
+    xqi, xqpi, n_monotonic = interpolate_coord_rows(x, np.ascontiguousarray(xq_rows).reshape((-1, xq_rows.shape[-1])))
+    coord_counts['monotonic'] += n_monotonic
+    coord_counts['robust'] += xqi.shape[0] - n_monotonic
+    return (np.moveaxis(xqi.reshape(xq_rows.shape), -1, axis),
+            np.moveaxis(xqpi.reshape(xq_rows.shape), -1, axis))
+
+
+def interpolate_coord_policy(x, xq, axis=-1, monotonic=None):
+    """Interpolate policy xq against grid x along its own dimension 'axis', by interpolate_coord if
+    'monotonic', by interpolate_coord_robust if not, and by interpolate_coord_auto if None"""
+    if monotonic is None:
+        return interpolate_coord_auto(x, xq, axis)
+    elif monotonic:
+        xqi, xqpi = interpolate_coord(x, np.moveaxis(xq, axis, -1))
+        return np.moveaxis(xqi, -1, axis), np.moveaxis(xqpi, -1, axis)
+    else:
+        return interpolate_coord_robust(x, xq)
+
+
+@njit
+def interpolate_coord_rows(x, xq):
+    """Does interpolate_coord_auto where xq has rows (k, nq), also returning number of increasing rows"""
+    n = len(x)
+    nrow, nq = xq.shape
+    xqi = np.empty((nrow, nq), dtype=np.uint32)
+    xqpi = np.empty((nrow, nq))
+
+    n_monotonic = 0
+    for r in range(nrow):
+        # written so that any nan makes the row non-monotonic
+        monotonic = True
+        for iq in range(nq - 1):
+            if not xq[r, iq] <= xq[r, iq + 1]:
+                monotonic = False
+                break
+
+        if monotonic:
+            n_monotonic += 1
+            xi = 0
+            x_low = x[0]
+            x_high = x[1]
+            for iq in range(nq):
+                xq_cur = xq[r, iq]
+                while xi < n - 2:
+                    if x_high >= xq_cur:
+                        break
+                    xi += 1
+                    x_low = x_high
+                    x_high = x[xi + 1]
+
+                xqi[r, iq] = xi
+                xqpi[r, iq] = (x_high - xq_cur) / (x_high - x_low)
+        else:
+            for iq in range(nq):
+                xq_cur = xq[r, iq]
+                if xq_cur < x[0]:
+                    ilow = 0
+                elif xq_cur > x[-2]:
+                    ilow = n-2
+                else:
+                    ihigh = n-1
+                    ilow = 0
+                    while ihigh - ilow > 1:
+                        imid = (ihigh + ilow) // 2
+                        if xq_cur > x[imid]:
+                            ilow = imid
+                        else:
+                            ihigh = imid
+
+                xqi[r, iq] = ilow
+                xqpi[r, iq] = (x[ilow+1] - xq_cur) / (x[ilow+1] - x[ilow])
+
+    return xqi, xqpi, n_monotonic
+
+
 '''Used in discrete choice problems'''
 
 @njit
@@ -1,4 +1,6 @@
+import itertools
 import numpy as np
+from scipy import sparse
 
 
 def multiply_ith_dimension(Pi, i, X):
@@ -38,3 +40,46 @@ def batch_multiply_ith_dimension(P, i, X):
     # original shape and order
     X = X.reshape(Pshape[0], *Pshape[2:])
     return X.swapaxes(0, i)
+
+
+def sparse_ith_dimension(Pi, i, shape):
+    """Sparse matrix M such that M @ X.ravel() == multiply_ith_dimension(Pi, i, X).ravel() for X of 'shape'"""
+    before, after = int(np.prod(shape[:i])), int(np.prod(shape[i+1:]))
+    return sparse.kron(sparse.kron(sparse.identity(before), sparse.csr_matrix(Pi)), sparse.identity(after), format='csr')
+
+
+def sparse_batch_ith_dimension(P, i):
+    """Sparse matrix M such that M @ X.ravel() == batch_multiply_ith_dimension(P, i, X).ravel()"""
+    shape = P.shape[1:]
+    cols = np.arange(int(np.prod(shape)))
+    index = np.unravel_index(cols, shape)
+    rows, data = [], []
+    for c in range(P.shape[0]):
+        rows.append(np.ravel_multi_index(index[:i] + (np.full_like(cols, c),) + index[i+1:],
+                                         shape[:i] + (P.shape[0],) + shape[i+1:]))
+        data.append(P[c].ravel())
+    new_size = len(cols) // shape[i] * P.shape[0]
+    return sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.tile(cols, P.shape[0]))),
+                             shape=(new_size, len(cols)))
+
+
+def sparse_lottery(shape, lotteries):
+    """Sparse matrix M of the forward transition on arrays X of 'shape', i.e. M @ X.ravel(), where along
+    the last len(lotteries) dimensions each gridpoint's mass moves according to lotteries [(i, pi), ...]:
+    share pi to gridpoint i and 1-pi to gridpoint i+1, independently for each of these dimensions"""
+    shape = tuple(shape)
+    N = int(np.prod(shape))
+    endog_shape = shape[len(shape) - len(lotteries):]
+    strides = [int(np.prod(endog_shape[d+1:])) for d in range(len(endog_shape))]
+
+    cols = np.arange(N)
+    base = cols - cols % int(np.prod(endog_shape))
+    rows, data = [], []
+    for corner in itertools.product((0, 1), repeat=len(lotteries)):
+        row, weight = base.copy(), np.ones(N)
+        for (i, pi), c, stride in zip(lotteries, corner, strides):
+            row += (i.ravel() + c) * stride
+            weight *= pi.ravel() if c == 0 else 1 - pi.ravel()
+        rows.append(row)
+        data.append(weight)
+    return sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.tile(cols, len(rows)))), shape=(N, N))
@@ -2,10 +2,31 @@
 
 import numpy as np
 from numba import njit
+from numba.extending import overload
 
 
-@njit
 def setmin(x, xmin):
+    """Set array x where each row (along the last axis) is ascending equal to max(x, xmin)."""
+    if x.ndim == 2:
+        setmin_2d(x, xmin)
+    elif x.flags.c_contiguous:
+        # e.g. with leading scenario axis, see HetBlock.impulse_nonlinear_batch; reshaping gives a view
+        setmin_2d(x.reshape((-1, x.shape[-1])), xmin)
+    else:
+        raise ValueError('setmin requires a 2-dimensional or C-contiguous array')
+
+
+@overload(setmin)
+def setmin_njit(x, xmin):
+    """Make setmin callable from njitted code, e.g. in backward steps compiled for HetBlock transitions"""
+    if x.ndim == 2:
+        return lambda x, xmin: setmin_2d(x, xmin)
+    else:
+        return lambda x, xmin: setmin_2d(x.reshape((-1, x.shape[-1])), xmin)
+
+
+@njit
+def setmin_2d(x, xmin):
     """Set 2-dimensional array x where each row is ascending equal to equal to max(x, xmin)."""
     ni, nj = x.shape
     for i in range(ni):
@@ -41,3 +62,18 @@ def fast_aggregate(X, Y):
     for t in range(T):
         Z[t] = Xnew[t, :] @ Ynew[t, :]
     return Z
+
+
+@njit
+def fake_news_to_jacobian(F, T0=0):
+    """Turn stack of fake news matrices F with dims (K, T', T) into Jacobians, in place.
+
+    Each J[k] satisfies J[k, t, s] = F[k, t, s] + J[k, t-1, s-1], which we apply row by row
+    so that memory is accessed contiguously. If T0 > 0, the top-left (T0, T0) block of each
+    F[k] is assumed to already hold the Jacobian, and only the remaining entries are updated."""
+    K, Tr, Tc = F.shape
+    for k in range(K):
+        for t in range(1, Tr):
+            start = max(T0, 1) if t < T0 else 1
+            for s in range(start, Tc):
+                F[k, t, s] += F[k, t-1, s-1]
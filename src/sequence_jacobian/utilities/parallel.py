@@ -0,0 +1,150 @@
+"""Process-pool evaluation with large arrays passed to workers through shared memory rather than pickling"""
+
+import copy
+import weakref
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+
+class SharedArray:
+    """Picklable handle to an array in a shared memory block, to be attached to by workers"""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def attach(self):
+        shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf), shm
+
+
+class SharedArrays:
+    """Context manager owning shared memory blocks: share(obj) replaces all arrays in obj by
+    SharedArray handles (copying them into shared memory), and every block is freed on exit,
+    except that blocks from output() are only unlinked and remain mapped for the returned array"""
+
+    def __init__(self):
+        self.blocks = []
+        self.outputs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        for shm in self.outputs:
+            shm.unlink()
+        self.blocks, self.outputs = [], []
+
+    def empty(self, shape, dtype=np.float64):
+        """Allocate new array in shared memory, return it along with a handle for workers"""
+        dtype = np.dtype(dtype)
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.blocks.append(shm)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf), SharedArray(shm.name, shape, dtype)
+
+    def output(self, shape, dtype=np.float64):
+        """As empty, but the array can be used after exit, and its block is only closed once
+        the array and all views of it are garbage collected"""
+        dtype = np.dtype(dtype)
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.outputs.append(shm)
+        x = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        weakref.finalize(x, shm.close)
+        return x, SharedArray(shm.name, shape, dtype)
+
+    def share(self, obj):
+        def share_array(x):
+            shared, handle = self.empty(x.shape, x.dtype)
+            shared[...] = x
+            return handle
+        return walk(obj, is_shareable, share_array, {})
+
+
+def is_shareable(x):
+    return isinstance(x, np.ndarray) and type(x) is np.ndarray and x.ndim > 0 and x.dtype != object
+
+
+def walk(obj, match, replace, memo):
+    """Return copy of obj with every leaf satisfying match(leaf) replaced by replace(leaf), recursing through
+    dicts, lists, tuples, and our own helper classes (e.g. Transitions or differentiable functions)"""
+    if id(obj) in memo:
+        return memo[id(obj)]
+
+    if match(obj):
+        new = replace(obj)
+    elif type(obj) is dict:
+        new = {k: walk(v, match, replace, memo) for k, v in obj.items()}
+    elif type(obj) in (list, tuple):
+        new = type(obj)(walk(v, match, replace, memo) for v in obj)
+    elif is_own_object(obj):
+        new = copy.copy(obj)
+        for k, v in vars(obj).items():
+            setattr(new, k, walk(v, match, replace, memo))
+    else:
+        new = obj
+
+    memo[id(obj)] = new
+    return new
+
+
+def is_own_object(obj):
+    # blocks themselves are pickled by value, as they only carry functions and names
+    from ..blocks.block import Block
+    return (type(obj).__module__.startswith('sequence_jacobian') and hasattr(obj, '__dict__')
+            and not isinstance(obj, (type, Block)))
+
+
+'''Worker side'''
+
+_worker_state = None
+
+
+def attach(obj, shms):
+    def attach_array(handle):
+        x, shm = handle.attach()
+        shms.append(shm)
+        return x
+    return walk(obj, lambda x: isinstance(x, SharedArray), attach_array, {})
+
+
+def _initialize_worker(fn, args, out):
+    global _worker_state
+    # keep the attached shared memory blocks referenced for as long as this worker lives
+    shms = []
+    _worker_state = fn, attach(args, shms), attach(out, shms), shms
+
+
+def _run_task(j, task):
+    fn, args, out, _ = _worker_state
+    small, big = fn(task, *args)
+    out[j, ...] = big
+    return small
+
+
+def pool_map(fn, tasks, args, out_shape, n_workers, out_dtype=np.float64):
+    """Evaluate fn(task, *args) -> (small, big) for each of 'tasks' in a pool of 'n_workers' processes.
+
+    Each 'big' array of shape 'out_shape' and type 'out_dtype' is written directly by workers into a
+    shared output array, which is returned as is: a list of 'small' results and an array of shape
+    (len(tasks), *out_shape) stacking the 'big' results, whose shared memory lives as long as it does.
+
+    Workers are forked where possible, since functions decorated by @het or @simple cannot be pickled
+    by reference, and then inherit 'args' without any copy. Elsewhere, arrays in 'args' are sent to
+    workers once through shared memory, and 'fn' and any functions in 'args' must be picklable."""
+    tasks = list(tasks)
+    forked = 'fork' in multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if forked else None)
+
+    with SharedArrays() as shared:
+        out, out_handle = shared.output((len(tasks),) + tuple(out_shape), out_dtype)
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(tasks)), mp_context=context,
+                                 initializer=_initialize_worker,
+                                 initargs=(fn, args if forked else shared.share(args), out_handle)) as pool:
+            smalls = list(pool.map(_run_task, range(len(tasks)), tasks))
+    return smalls, out
@@ -145,3 +145,99 @@ def printit(it, x, y, **kwargs):
     for kw, val in kwargs.items():
         print(f'{kw} = {val:.3f}')
     print('\n')
+
+
+class AndersonAccelerator:
+    """Anderson mixing for fixed-point iterations x = g(x), where x is a dict of arrays.
+
+    Each call with the latest x and gx = g(x) returns the next x to evaluate g at: rather than
+    simply gx, this is the combination of the last 'm' evaluations of g whose residuals g(x) - x
+    are smallest in a least-squares sense, damped by 'damping' (1 means no damping).
+
+    Safeguards: the plain iterate gx is returned instead, and the history is cleared, if
+        - the residual has grown by more than a factor 'restart' relative to the smallest seen
+        - the mixed iterate is not of the same strict sign, or the same monotonicity along the
+          last axis, as gx wherever gx has these properties. Policy kinks (e.g. at borrowing
+          constraints) can otherwise lead mixing to produce e.g. negative or non-monotonic
+          marginal values, on which endogenous gridpoint steps fail.
+    """
+
+    def __init__(self, m=5, damping=1.0, restart=2.0):
+        self.m = m
+        self.damping = damping
+        self.restart = restart
+        self.reset()
+        self.mixed = 0
+        self.restarts = 0
+
+    def reset(self):
+        self.fs, self.gs = [], []
+        self.best = np.inf
+
+    def __call__(self, x, gx):
+        keys = list(x)
+        g = np.concatenate([gx[k].ravel() for k in keys])
+        f = g - np.concatenate([x[k].ravel() for k in keys])
+
+        norm = np.linalg.norm(f)
+        if norm > self.restart * self.best:
+            self.restarts += 1
+            self.reset()
+        self.best = min(self.best, norm)
+
+        self.fs.append(f)
+        self.gs.append(g)
+        if len(self.fs) > self.m + 1:
+            self.fs.pop(0)
+            self.gs.pop(0)
+        if len(self.fs) == 1:
+            return gx
+
+        # least-squares combination of differences in residuals
+        dF = np.diff(np.array(self.fs), axis=0).T
+        dG = np.diff(np.array(self.gs), axis=0).T
+        gamma = np.linalg.lstsq(dF, f, rcond=None)[0]
+        mixed = g - dG @ gamma - (1 - self.damping) * (f - dF @ gamma)
+
+        xnew, start = {}, 0
+        for k in keys:
+            xnew[k] = mixed[start:start + gx[k].size].reshape(gx[k].shape)
+            start += gx[k].size
+            if not same_shape_properties(gx[k], xnew[k]):
+                self.restarts += 1
+                self.reset()
+                return gx
+        self.mixed += 1
+        return xnew
+
+
+def same_shape_properties(reference, x):
+    """Check that x has strict sign, and monotonicity along last axis, wherever reference has them"""
+    for sign in (1, -1):
+        if np.all(sign * reference > 0) and not np.all(sign * x > 0):
+            return False
+        if reference.shape[-1] > 1:
+            if np.all(sign * np.diff(reference, axis=-1) > 0) and not np.all(sign * np.diff(x, axis=-1) > 0):
+                return False
+    return True
+
+
+accelerators = {'anderson': AndersonAccelerator}
+
+
+def make_accelerator(accelerator, accelerator_kwargs=None):
+    """Accelerator for steady-state backward iterations named by 'accelerator', or None if not accelerated"""
+    if accelerator is None:
+        return None
+    if accelerator not in accelerators:
+        raise ValueError(f"Unknown backward accelerator '{accelerator}', options are {list(accelerators)}")
+    if accelerator_kwargs is None:
+        accelerator_kwargs = {}
+    return accelerators[accelerator](**accelerator_kwargs)
+
+
+def print_accelerator_summary(name, iterations, accelerate):
+    summary = f'{name}: backward iteration converged after {iterations} iterations'
+    if accelerate is not None:
+        summary += f' ({accelerate.mixed} mixed, {accelerate.restarts} restarts)'
+    print(summary)
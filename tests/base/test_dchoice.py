@@ -200,3 +200,15 @@ def test_runs():
     td_ghost = hh.impulse_nonlinear(ss1, shock * 0.0, outputs=['C'])
     td_nonlin = td_nonlin - td_ghost
     assert np.allclose(td_lin['C'], td_nonlin['C'] / 1E-4, atol=1E-5)
+
+
+def test_direct_distribution():
+    calibration = {'taste_shock': 0.01, 'r': 0.005, 'beta': 0.97, 'eis': 0.5,
+                   'vphi': 0.3, 'chi': 0.3, 'rho_e': 0.95, 'sd_e': 0.5, 'nE': 7, 'amin': .0, 'amax': 200.0, 'nA': 100, 'atw': 1.0, 'b': 0.5, 's': 0.1, 'f': 0.4}
+
+    ss = hh.steady_state(calibration)
+    ss_lu = hh.steady_state(calibration, forward_method='lu')
+
+    assert np.isclose(ss['A'], ss_lu['A'])
+    for stage in ('prod_shock', 'search_shock', 'dchoice', 'consav'):
+        assert np.allclose(ss.internals['household'][stage]['D'], ss_lu.internals['household'][stage]['D'], atol=1E-8)
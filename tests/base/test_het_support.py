@@ -1,8 +1,10 @@
 import numpy as np
 from sequence_jacobian.blocks.support.het_support import (Transition,
     PolicyLottery1D, PolicyLottery2D, Markov, CombinedTransition,
-    lottery_1d, lottery_2d)
+    lottery_1d, lottery_2d, lottery_nd)
+from sequence_jacobian.blocks.support.het_compiled import set_threading
 from sequence_jacobian.utilities.multidim import batch_multiply_ith_dimension
+from sequence_jacobian.utilities.interpolate import coord_counts, reset_coord_counts
 
 
 def test_combined_markov():
@@ -180,4 +182,153 @@ def test_einsum():
     # can I generalize this? reshape and then einsum
     Dnew2 = batch_multiply_ith_dimension(P, 0, D)
 
-    assert (Dnew == Dnew2).all()
\ No newline at end of file
+    assert (Dnew == Dnew2).all()
+
+def test_sparse_transitions():
+    shape = (3, 4, 5)
+    np.random.seed(12345)
+    D = np.random.rand(*shape)
+    a_grid, b_grid = np.linspace(0, 1, 4), np.linspace(0, 1, 5)
+    a, b = np.random.rand(*shape), np.random.rand(*shape)
+
+    Pi = np.random.rand(3, 3)
+    Pi /= Pi.sum(axis=1, keepdims=True)
+    transitions = [Markov(Pi, 0), lottery_1d(b, b_grid), lottery_2d(a, b, a_grid, b_grid),
+                   CombinedTransition([Markov(Pi, 0), lottery_2d(a, b, a_grid, b_grid)])]
+    for transition in transitions:
+        M = transition.sparse(shape)
+        assert np.allclose(M @ D.ravel(), transition.forward(D).ravel())
+        assert np.allclose(M.T @ D.ravel(), transition.expectation(D).ravel())
+
+
+def test_parallel_kernels():
+    # threaded kernels should give exactly the same results as serial ones
+    shape = (5, 4, 20, 30)
+    np.random.seed(2468)
+    a_grid, b_grid = np.geomspace(0.5, 10, shape[-2]), np.geomspace(0.2, 8, shape[-1])
+    a = 10 * np.random.rand(*shape)
+    b = 8 * np.random.rand(*shape)
+    D, X = np.random.rand(*shape), np.random.rand(*shape)
+    da, db = np.random.rand(3, *shape), np.random.rand(3, *shape)
+
+    def iterate():
+        l1, l2 = lottery_1d(b, b_grid).forward_shockable(D), lottery_2d(a, b, a_grid, b_grid).forward_shockable(D)
+        return [l1.forward(D), l1.expectation(X), l1.forward_shock(db[0]), l1.forward_shock_batch(db),
+                l2.forward(D), l2.expectation(X), l2.forward_shock([da[0], db[0]]), l2.forward_shock_batch([da, db])]
+
+    serial = iterate()
+    try:
+        set_threading(True)
+        threaded = iterate()
+    finally:
+        set_threading(False)
+
+    for x, y in zip(serial, threaded):
+        assert np.array_equal(x, y)
+
+
+def test_fused_markov_lottery():
+    # one Markov matrix followed by a policy lottery runs as a single kernel, which should agree with
+    # applying the two stages in turn
+    np.random.seed(13579)
+    a_grid, b_grid = np.geomspace(0.5, 10, 20), np.geomspace(0.2, 8, 30)
+    Pi = np.random.rand(5, 5)
+    Pi /= Pi.sum(axis=1, keepdims=True)
+
+    for shape, lottery in [((5, 30), lottery_1d(8 * np.random.rand(5, 30), b_grid)),
+                           ((5, 20, 30), lottery_2d(10 * np.random.rand(5, 20, 30), 8 * np.random.rand(5, 20, 30),
+                                                    a_grid, b_grid))]:
+        D, X = np.random.rand(*shape), np.random.rand(*shape)
+        exog = CombinedTransition([Markov(Pi, 0)])
+        lom = CombinedTransition([exog, lottery])
+        assert lom.fused() is not None
+
+        out, mid = np.empty(shape), np.empty(shape)
+        assert lom.forward(D, out=out, mid=mid) is out
+        assert np.allclose(mid, exog.forward(D))
+        assert np.allclose(out, lottery.forward(exog.forward(D)))
+        assert np.allclose(lom.expectation(X), exog.expectation(lottery.expectation(X)))
+
+
+def test_batch_transitions():
+    # stacks along a leading axis go through the same lottery in one pass
+    np.random.seed(11235)
+    a_grid, b_grid = np.geomspace(0.5, 10, 20), np.geomspace(0.2, 8, 30)
+    Pi = np.random.rand(5, 5)
+    Pi /= Pi.sum(axis=1, keepdims=True)
+
+    for shape, lottery in [((5, 30), lottery_1d(8 * np.random.rand(5, 30), b_grid)),
+                           ((5, 20, 30), lottery_2d(10 * np.random.rand(5, 20, 30), 8 * np.random.rand(5, 20, 30),
+                                                    a_grid, b_grid))]:
+        D, X = np.random.rand(3, *shape), np.random.rand(3, *shape)
+        assert np.array_equal(lottery.forward_batch(D), np.stack([lottery.forward(d) for d in D]))
+        assert np.array_equal(lottery.expectation_batch(X), np.stack([lottery.expectation(x) for x in X]))
+
+        lom = CombinedTransition([CombinedTransition([Markov(Pi, 0)]), lottery])
+        assert np.allclose(lom.expectation_batch(X), np.stack([lom.expectation(x) for x in X]))
+        assert np.allclose(lom.forward_batch(D), np.stack([lom.forward(d) for d in D]))
+
+
+def test_nd_policy_lottery():
+    np.random.seed(31415)
+    grids = [np.geomspace(0.5, 10, 8), np.geomspace(0.2, 8, 9), np.linspace(0, 1, 6)]
+
+    # with two dimensions, same as the 2D lottery
+    shape = (3, 8, 9)
+    a, b = 10 * np.random.rand(*shape), 8 * np.random.rand(*shape)
+    D, da, db = np.random.rand(*shape), np.random.rand(*shape), np.random.rand(*shape)
+    lottery, lottery2 = lottery_nd([a, b], grids[:2]).forward_shockable(D), lottery_2d(a, b, *grids[:2]).forward_shockable(D)
+    assert np.allclose(lottery.forward(D), lottery2.forward(D))
+    assert np.allclose(lottery.expectation(D), lottery2.expectation(D))
+    assert np.allclose(lottery.forward_shock([da, db]), lottery2.forward_shock([da, db]))
+
+    # with three, consistent with sparse matrix, and shock with finite differences
+    shape = (2, 3, 8, 9, 6)
+    policies = [g[-1] * np.random.rand(*shape) for g in grids]
+    shocks = [np.random.rand(*shape) for _ in grids]
+    D = np.random.rand(*shape)
+    lottery = lottery_nd(policies, grids).forward_shockable(D)
+    M = lottery.sparse(shape)
+    assert np.allclose(M @ D.ravel(), lottery.forward(D).ravel())
+    assert np.allclose(M.T @ D.ravel(), lottery.expectation(D).ravel())
+    assert np.isclose(lottery.forward(D).sum(), D.sum())
+
+    h = 1E-6
+    Dder = (lottery_nd([p + h * s for p, s in zip(policies, shocks)], grids).forward(D)
+            - lottery_nd([p - h * s for p, s in zip(policies, shocks)], grids).forward(D)) / (2 * h)
+    assert np.allclose(lottery.forward_shock(shocks), Dder, atol=1E-5)
+    assert np.allclose(lottery.forward_shock_batch([np.stack([s, 2 * s]) for s in shocks])[1], 2 * Dder, atol=1E-5)
+
+
+def test_auto_monotonic_lottery():
+    np.random.seed(123)
+    grid1, grid2 = np.linspace(0, 1, 30), np.linspace(-1, 2, 40)
+
+    # policies increasing along own dimension except in a few rows, with some exactly on gridpoints
+    a = np.sort(np.random.rand(4, 30, 40) * 1.2 - 0.1, axis=1)
+    b = np.sort(np.random.rand(4, 30, 40) * 3.4 - 1.2, axis=2)
+    a[0, :3, 5] = a[0, 2::-1, 5]
+    b[1, 7, :] = b[1, 7, ::-1]
+    a[2, :, 6], b[3, 5, :] = grid1, grid2
+
+    reset_coord_counts()
+    lottery = lottery_1d(b, grid2)
+    assert coord_counts == {'monotonic': 4*30 - 1, 'robust': 1}
+    robust = lottery_1d(b, grid2, monotonic=False)
+    assert np.array_equal(lottery.i, robust.i) and np.array_equal(lottery.pi, robust.pi)
+
+    reset_coord_counts()
+    lottery = lottery_2d(a, b, grid1, grid2)
+    assert coord_counts == {'monotonic': 4*40 + 4*30 - 2, 'robust': 2}
+    robust = lottery_2d(a, b, grid1, grid2, monotonic=False)
+    for attr in ('i1', 'i2', 'pi1', 'pi2'):
+        assert np.array_equal(getattr(lottery, attr), getattr(robust, attr))
+    D = np.random.rand(4, 30, 40)
+    assert np.allclose(lottery.forward(D), lottery_nd([a, b], [grid1, grid2]).forward(D), atol=1E-14)
+
+    # with all rows monotonic, merge-based lotteries agree too
+    a[0, :3, 5] = a[0, 2::-1, 5]
+    b[1, 7, :] = b[1, 7, ::-1]
+    D = np.random.rand(4, 30, 40)
+    assert np.array_equal(lottery_2d(a, b, grid1, grid2, monotonic=True).forward(D),
+                          lottery_2d(a, b, grid1, grid2, monotonic=False).forward(D))
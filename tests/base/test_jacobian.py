@@ -1,6 +1,9 @@
 """Test all models' Jacobian calculations"""
 
+import tracemalloc
+
 import numpy as np
+import pytest
 
 def test_ks_jac(krusell_smith_dag):
     _, ss, ks_model, unknowns, targets, exogenous = krusell_smith_dag
@@ -83,3 +86,264 @@ def test_fake_news_v_direct_method(one_asset_hank_dag):
                 Js_direct[o.upper()][i][:, t] = (td_out[o.upper()] - td_noshock[o.upper()]) / h
 
     assert np.linalg.norm(Js['C']['r'] - Js_direct['C']['r'], np.inf) < 3e-4
+
+
+def test_batch_fakenews(one_asset_hank_dag, two_asset_hank_dag):
+    # stacking all inputs in the backward iteration should not change the Jacobian
+    for dag, inputs in [(one_asset_hank_dag, ['r', 'w', 'Div', 'Tax']), (two_asset_hank_dag, ['N', 'ra', 'rb', 'w'])]:
+        _, ss, model, *_ = dag
+        household = model['hh']
+
+        J = household.jacobian(ss, inputs, T=20)
+        J_batch = household.jacobian(ss, inputs, T=20, batch=True)
+
+        for o in J.outputs:
+            for i in inputs:
+                assert np.allclose(J[o, i], J_batch[o, i], atol=1E-12)
+
+
+def test_parallel_fakenews(krusell_smith_dag):
+    _, ss, ks_model, *_ = krusell_smith_dag
+    household = ks_model['hh']
+
+    J = household.jacobian(ss, ['r', 'w'], T=20)
+    J_parallel = household.jacobian(ss, ['r', 'w'], T=20, n_workers=2)
+
+    for o in J.outputs:
+        for i in J.inputs:
+            assert np.array_equal(J[o, i], J_parallel[o, i])
+
+
+def scaled_rows(k, x):
+    return k, k * x
+
+
+def test_pool_map():
+    import gc
+    from sequence_jacobian.utilities import parallel
+
+    # output is returned in the shared memory workers wrote it to, which outlives pool_map
+    x = np.arange(5.)
+    smalls, out = parallel.pool_map(scaled_rows, range(4), (x,), x.shape, 2)
+    rows = list(out)
+    del out
+    gc.collect()
+    assert smalls == [0, 1, 2, 3]
+    assert np.array_equal(np.stack(rows), np.outer(np.arange(4), x))
+
+
+def test_truncated_expectation_vectors(one_asset_hank_dag):
+    hank_model, ss, *_ = one_asset_hank_dag
+    household = hank_model['hh']
+
+    log, log_trunc = {}, {}
+    J = household.jacobian(ss, ['r', 'w'], T=300, log=log)
+    J_trunc = household.jacobian(ss, ['r', 'w'], T=300, expectation_tol=5E-2, log=log_trunc)
+    assert log['horizons'] == {o: 299 for o in J.outputs}
+    assert all(200 <= H < 299 for H in log_trunc['horizons'].values())
+
+    # truncation happens after horizon 200, so earlier rows of Jacobian are unaffected
+    for o in J.outputs:
+        for i in J.inputs:
+            assert np.allclose(J[o, i][:200], J_trunc[o, i][:200], atol=1E-12)
+            assert np.allclose(J[o, i], J_trunc[o, i], atol=5E-2)
+    assert not np.allclose(J['A', 'r'], J_trunc['A', 'r'], atol=1E-6)
+
+
+def test_fused_fake_news(two_asset_hank_dag):
+    _, ss, hank_model, *_ = two_asset_hank_dag
+    household = hank_model['hh']
+    inputs = ['N', 'ra', 'rb', 'w']
+
+    J = household.jacobian(ss, inputs, T=50)
+    J_fused = household.jacobian(ss, inputs, T=50, fused=True)
+    J_batch = household.jacobian(ss, inputs, T=50, fused=True, batch=True)
+    J_trunc = household.jacobian(ss, inputs, T=50, expectation_tol=1E-4)
+    J_trunc_fused = household.jacobian(ss, inputs, T=50, fused=True, expectation_tol=1E-4)
+
+    for o in J.outputs:
+        for i in J.inputs:
+            assert np.allclose(J[o, i], J_fused[o, i], atol=1E-12)
+            assert np.allclose(J[o, i], J_batch[o, i], atol=1E-12)
+            assert np.allclose(J_trunc[o, i], J_trunc_fused[o, i], atol=1E-12)
+
+    # products are written straight into F, so fusing takes no more memory than building F pair by pair
+    peaks = {}
+    for fused in (False, True):
+        tracemalloc.start()
+        household.jacobian(ss, inputs, T=50, fused=fused)
+        peaks[fused] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    assert peaks[True] <= peaks[False]
+
+    J_single = household.jacobian(ss, inputs, T=1, fused=True)
+    for o in J.outputs:
+        for i in J.inputs:
+            assert np.allclose(J_single[o, i], J[o, i][:1, :1], atol=1E-12)
+
+
+def test_J_from_F():
+    from sequence_jacobian.blocks.het_block import HetBlock
+
+    F = np.random.rand(3, 12, 8)
+    J_loop = F.copy()
+    for k in range(3):
+        for t in range(1, 8):
+            J_loop[k, 1:, t] += J_loop[k, :-1, t - 1]
+
+    assert np.allclose(HetBlock.J_from_F(F[1]), J_loop[1])
+    assert np.allclose(HetBlock.J_from_F_batch(F), J_loop)
+
+    # in-place variant overwrites F
+    HetBlock.J_from_F_batch(F, inplace=True)
+    assert np.allclose(F, J_loop)
+
+
+def test_jacobian_cache(krusell_smith_dag, tmp_path):
+    from sequence_jacobian import JacobianCache
+
+    _, ss, ks_model, unknowns, targets, exogenous = krusell_smith_dag
+    household = ks_model['hh']
+    cache = JacobianCache(str(tmp_path))
+
+    J = household.jacobian(ss, ['r', 'w'], T=20)
+    J_stored = household.jacobian(ss, ['r', 'w'], T=20, cache=cache)
+    assert len(cache.entries()) == 1
+
+    # second call is served from disk, also when passed as option to model
+    J_loaded = household.jacobian(ss, ['r', 'w'], T=20, cache=cache)
+    G = ks_model.solve_jacobian(ss, unknowns, targets, exogenous, T=20)
+    G_cached = ks_model.solve_jacobian(ss, unknowns, targets, exogenous, T=20, options={'hh': {'cache': cache}})
+    for o in J.outputs:
+        for i in J.inputs:
+            assert np.array_equal(J[o, i], J_stored[o, i])
+            assert np.array_equal(J[o, i], J_loaded[o, i])
+    for o in G.outputs:
+        assert np.allclose(G[o, 'Z'], G_cached[o, 'Z'])
+
+    # any change in options or steady state is a new entry
+    n = len(cache.entries())
+    household.jacobian(ss, ['r', 'w'], T=20, cache=cache, h=1E-5)
+    ss_other = ss.copy()
+    ss_other['beta'] += 1E-10
+    household.jacobian(ss_other, ['r', 'w'], T=20, cache=cache)
+    assert len(cache.entries()) == n + 2
+
+    # size bound evicts least recently used entries
+    cache.evict(max(e[1] for e in cache.entries()))
+    assert len(cache.entries()) == 1
+
+
+def test_jacobian_cache_helpers(monkeypatch, tmp_path):
+    from numba import njit
+    from sequence_jacobian import JacobianCache
+    from sequence_jacobian.hetblocks import hh_labor
+    from sequence_jacobian.classes import jacobian_cache
+
+    # keys also depend on module-level helpers that the backward step calls, e.g. netexp via solve_uc
+    cache = JacobianCache(str(tmp_path))
+    key = cache.key(hh_labor.hh, {}, ['w'], ['A'], 20, {})
+    assert cache.key(hh_labor.hh, {}, ['w'], ['A'], 20, {}) == key
+    monkeypatch.setattr(hh_labor, 'netexp', njit(lambda log_uc, w, T, eis, frisch, vphi: (0., 1.)))
+    assert cache.key(hh_labor.hh, {}, ['w'], ['A'], 20, {}) != key
+    monkeypatch.undo()
+
+    # and on the library version and source, but not on options that only change how J is computed
+    options = {'batch': True, 'fused': True, 'memory_budget': 1E6, 'dtype_check': 2, 'log': {}}
+    assert cache.key(hh_labor.hh, {}, ['w'], ['A'], 20, options) == key
+    monkeypatch.setattr(jacobian_cache, 'package_version', lambda: '0.0.0')
+    assert cache.key(hh_labor.hh, {}, ['w'], ['A'], 20, {}) != key
+    monkeypatch.undo()
+    monkeypatch.setattr(jacobian_cache, 'library_source_hash', lambda block: '')
+    assert cache.key(hh_labor.hh, {}, ['w'], ['A'], 20, {}) != key
+
+
+def test_extend_fake_news(one_asset_hank_dag):
+    _, ss, hank_model, *_ = one_asset_hank_dag
+    household = hank_model['hh']
+    inputs = ['r', 'w', 'Div']
+
+    J_long = household.jacobian(ss, inputs, T=60)
+    fake_news = household.fake_news(ss, inputs, T=25)
+    for o in J_long.outputs:
+        for i in inputs:
+            assert np.allclose(fake_news.jacobian[o, i], J_long[o, i][:25, :25], atol=1E-12)
+
+    J_extended = fake_news.extend(60)
+    assert fake_news.T == 60
+    for o in J_long.outputs:
+        for i in inputs:
+            assert np.allclose(J_extended[o, i], J_long[o, i], atol=1E-12)
+
+
+def test_streaming_fake_news(krusell_smith_dag, tmp_path):
+    _, ss, ks_model, *_ = krusell_smith_dag
+    household = ks_model['hh']
+
+    J = household.jacobian(ss, ['r', 'w'], T=50)
+    # budget for roughly 7 periods of curlyDs and curlyEs at a time
+    budget = 7 * 2 * ss.internals['hh']['Dbeg'].size * 8
+    log = {}
+    J_streamed = household.jacobian(ss, ['r', 'w'], T=50, memory_budget=budget, scratch_dir=str(tmp_path), log=log)
+
+    for o in J.outputs:
+        for i in J.inputs:
+            assert np.allclose(J[o, i], J_streamed[o, i], atol=1E-12)
+    assert not list(tmp_path.iterdir())
+
+    # tile and peak memory, including the fake news matrices themselves, are reported
+    assert 1 <= log['tile'] < 50
+    assert log['peak_memory'] > len(J.outputs) * len(J.inputs) * 50 * 50 * 8
+    assert log['horizons'] == {o: 49 for o in J.outputs}
+
+    # with a single period, there are no expectation vectors at all
+    J_single = household.jacobian(ss, ['r', 'w'], T=1, memory_budget=budget)
+    for o in J.outputs:
+        for i in J.inputs:
+            assert np.allclose(J[o, i][:1, :1], J_single[o, i], atol=1E-12)
+
+    # options of the in-memory algorithm are ignored when streaming, which is warned about
+    with pytest.warns(UserWarning, match='batch, expectation_tol have no effect'):
+        household.jacobian(ss, ['r', 'w'], T=50, memory_budget=budget, batch=True, expectation_tol=1E-3)
+
+
+def test_single_precision_fake_news(one_asset_hank_dag):
+    import warnings
+
+    _, ss, hank_model, *_ = one_asset_hank_dag
+    household = hank_model['hh']
+    inputs = ['r', 'w', 'Div', 'Tax']
+
+    # single precision storage meets the 1E-5 threshold of dtype_check here, so it should not warn
+    J = household.jacobian(ss, inputs, T=50)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        J_single = household.jacobian(ss, inputs, T=50, dtype=np.float32, dtype_check=4)
+    for o in J.outputs:
+        for i in J.inputs:
+            assert J_single[o, i].dtype == np.float64
+            assert np.max(np.abs(J[o, i] - J_single[o, i])) < 1E-5 * np.max(np.abs(J[o, i]))
+
+    # in double precision, the check against double precision should pass exactly
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        J_checked = household.jacobian(ss, inputs, T=50, dtype_check=4)
+    assert np.array_equal(J['A', 'w'], J_checked['A', 'w'])
+
+
+def test_batch_expectation_vectors(one_asset_hank_dag):
+    _, ss, hank_model, *_ = one_asset_hank_dag
+    household = hank_model['hh']
+    ss = household.extract_ss_dict(ss)
+    outputs = ['a', 'c', 'n']
+    law_of_motion = household.jac_prelim(ss, household.make_ordered_set(outputs), 1E-4, False)[3]
+
+    for tol in (None, 5E-2):
+        curlyEs = household.expectation_vectors_batch(np.stack([ss[o] for o in outputs]), 250, law_of_motion, tol=tol)
+        for o, E in zip(outputs, curlyEs):
+            E_single = household.expectation_vectors(ss[o], 250, law_of_motion, tol=tol)
+            assert E.shape == E_single.shape
+            assert np.allclose(E, E_single, atol=1E-14)
+            if tol is not None:
+                # truncated curlyEs are copied out of their buffers rather than keeping them alive
+                assert E.shape[0] < 250 and E.base is None and E_single.base is None
@@ -102,3 +102,24 @@ def test_pishock():
     C_dn = hh.impulse_nonlinear(ss, {'f': -1E-4*shock})['C']
     dC = (C_up - C_dn)/2E-4
     assert np.allclose(dC, J['C', 'f'] @ shock, atol=2E-6)
+
+
+def test_static_inputs():
+    calibration = dict(beta=0.95, r=0.01, sigma=2., f=0.4, s=0.1, w=1., b=0.5,
+                       rho_z=0.9, sd_z=0.5, nZ=3, amin=0., amax=1000, nA=50)
+
+    household = household_multidim.add_hetinputs([search_frictions, labor_income])
+    hh = combine([household, income_state_vars, asset_state_vars])
+    ss = hh.steady_state(calibration)
+
+    # only hetinputs downstream of shocked inputs are recomputed along nonlinear paths
+    assert household.varying_hetinput_outputs({'r': None}) == set()
+    assert household.varying_hetinput_outputs({'w': None}) == {'y'}
+    assert household.varying_hetinput_outputs({'f': None, 'w': None}) == {'Pi_e', 'y'}
+
+    # same results as when recomputing everything (shocks too small to change f and b)
+    shock = 1E-4 * 0.8**np.arange(10)
+    for i in ('r', 'w'):
+        C = hh.impulse_nonlinear(ss, {i: shock, 'f': np.zeros(10)})['C']
+        C_recomputed = hh.impulse_nonlinear(ss, {i: shock, 'f': 1E-300*shock, 'b': 1E-300*shock})['C']
+        assert np.array_equal(C, C_recomputed)
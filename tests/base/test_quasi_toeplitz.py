@@ -0,0 +1,57 @@
+"""Test QuasiToeplitz Jacobians against their dense equivalents"""
+
+import numpy as np
+
+from sequence_jacobian.classes import QuasiToeplitz, SimpleSparse, IdentityMatrix
+
+
+def random_quasi_toeplitz(T, a, b, k, l, rng):
+    d = np.arange(-(T-1), T)
+    generator = np.where(d >= 0, a ** np.abs(d), 0.3 * b ** np.abs(d))
+    return QuasiToeplitz(generator, rng.standard_normal((k, k)), rng.standard_normal((l, l)), tol=1E-12)
+
+
+def test_quasi_toeplitz_algebra():
+    T = 300
+    rng = np.random.default_rng(0)
+    QA, QB = random_quasi_toeplitz(T, 0.5, 0.4, 10, 5, rng), random_quasi_toeplitz(T, 0.6, 0.3, 7, 0, rng)
+    A, B = QA.matrix(), QB.matrix()
+    S = SimpleSparse({(1, 0): 0.5, (-1, 1): 0.3, (0, 2): 2.})
+    x, X = rng.standard_normal(T), rng.standard_normal((T, 3))
+
+    assert np.allclose(QA @ x, A @ x)
+    assert np.allclose(QA @ X, A @ X)
+    assert np.allclose(X.T @ QA, X.T @ A)
+    assert np.allclose(QA.T.matrix(), A.T)
+
+    # products with other QuasiToeplitz or SimpleSparse stay compressed
+    for P, P_dense in [(QA @ QB, A @ B), (S @ QA, S.matrix(T) @ A), (QA @ S, A @ S.matrix(T))]:
+        assert isinstance(P, QuasiToeplitz)
+        assert np.allclose(P.matrix(), P_dense, atol=1E-10)
+
+    assert np.allclose((QA + QB - S).matrix(), A + B - S.matrix(T))
+    assert np.allclose((2 * QA + IdentityMatrix()).matrix(), 2 * A + np.eye(T))
+    assert np.allclose(A @ B + QA @ QB, 2 * A @ B)
+
+    # compression of dense Toeplitz-plus-corner matrix is exact
+    R = QuasiToeplitz.from_dense(B, 1E-12)
+    assert isinstance(R, QuasiToeplitz) and len(R.top_left) == 7
+    assert np.allclose(R.matrix(), B)
+
+
+def test_toeplitz_jacobian(one_asset_hank_dag):
+    _, ss, hank_model, unknowns, targets, exogenous = one_asset_hank_dag
+    T, tol = 600, 1E-3
+
+    J = hank_model['hh'].jacobian(ss, ['r', 'w'], T=T)
+    J_toeplitz = hank_model['hh'].jacobian(ss, ['r', 'w'], T=T, toeplitz_tol=tol)
+    for o in J.outputs:
+        for i in J.inputs:
+            assert isinstance(J_toeplitz[o, i], QuasiToeplitz)
+            assert np.max(np.abs(J_toeplitz[o, i].matrix() - J[o, i])) <= tol * np.max(np.abs(J[o, i]))
+
+    # linear impulse responses use FFT-based application transparently
+    shock = {'r': 0.9 ** np.arange(T), 'w': 0.5 ** np.arange(T)}
+    irf, irf_toeplitz = J.apply(shock), J_toeplitz.apply(shock)
+    for o in J.outputs:
+        assert np.max(np.abs(irf[o] - irf_toeplitz[o])) < 1E-2 * np.max(np.abs(irf[o]))
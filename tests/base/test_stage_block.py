@@ -1,3 +1,5 @@
+import copy
+import warnings
 import numpy as np
 
 from sequence_jacobian.blocks.stage_block import StageBlock
@@ -134,3 +136,61 @@ def test_remap():
     td_nonlin1 = hh1_all.impulse_nonlinear(ss1, shock * 1E-4, outputs=['C_men'])
     td_nonlin2 = hh2_all.impulse_nonlinear(ss2, shock * 1E-4, outputs=['C_men'])
     assert np.allclose(td_nonlin1['C_men'], td_nonlin2['C_men'])
+
+
+def test_parallel_jacobian():
+    calibration = {'r': 0.004, 'eis': 0.5, 'rho_e': 0.91, 'sd_e': 0.92, 'nE': 3,
+                   'amin': 0.0, 'amax': 200, 'nA': 50, 'transfer': 0.143, 'N': 1,
+                   'atw': 1, 'beta': 0.97, 'shift': 0}
+    ss = hh2.steady_state(calibration)
+
+    inputs, outputs = ['r', 'atw', 'shift'], ['A', 'C', 'UC']
+    J = hh2.jacobian(ss, inputs, outputs, 20)
+    J_parallel = hh2.jacobian(ss, inputs, outputs, 20, n_workers=2)
+
+    for i in inputs:
+        for o in outputs:
+            assert np.array_equal(J[o, i], J_parallel[o, i])
+
+
+def test_single_precision_jacobian():
+    calibration = {'r': 0.004, 'eis': 0.5, 'rho_e': 0.91, 'sd_e': 0.92, 'nE': 3,
+                   'amin': 0.0, 'amax': 200, 'nA': 50, 'transfer': 0.143, 'N': 1,
+                   'atw': 1, 'beta': 0.97, 'shift': 0}
+    ss = hh2.steady_state(calibration)
+
+    inputs, outputs = ['r', 'atw'], ['A', 'C']
+    J = hh2.jacobian(ss, inputs, outputs, 30)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        J_single = hh2.jacobian(ss, inputs, outputs, 30, dtype=np.float32, dtype_check=3)
+
+    for i in inputs:
+        for o in outputs:
+            assert np.max(np.abs(J[o, i] - J_single[o, i])) < 1E-5 * np.max(np.abs(J[o, i]))
+
+
+def test_accelerated_steady_state():
+    calibration = {'r': 0.004, 'eis': 0.5, 'rho_e': 0.91, 'sd_e': 0.92, 'nE': 3,
+                   'amin': 0.0, 'amax': 200, 'nA': 100, 'transfer': 0.143, 'N': 1,
+                   'atw': 1, 'beta': 0.97, 'shift': 0}
+    ss = hh2.steady_state(calibration)
+    ss_anderson = hh2.steady_state(calibration, backward_accelerator='anderson',
+                                   backward_accelerator_kwargs={'m': 3})
+
+    assert np.isclose(ss['A'], ss_anderson['A'], atol=1E-6)
+    assert np.isclose(ss['C'], ss_anderson['C'], atol=1E-6)
+    assert np.allclose(ss.internals['hh']['stage1']['a'], ss_anderson.internals['hh']['stage1']['a'], atol=1E-5)
+
+
+def test_warm_start():
+    calibration = {'r': 0.004, 'eis': 0.5, 'rho_e': 0.91, 'sd_e': 0.92, 'nE': 3,
+                   'amin': 0.0, 'amax': 200, 'nA': 100, 'transfer': 0.143, 'N': 1,
+                   'atw': 1, 'beta': 0.97, 'shift': 0}
+    hh = copy.copy(hh2)
+    ss = hh2.steady_state({**calibration, 'beta': 0.9701})
+    hh.steady_state(calibration, warm_start=True)
+    ss_warm = hh.steady_state({**calibration, 'beta': 0.9701}, warm_start=True)
+
+    assert np.isclose(ss['A'], ss_warm['A'], atol=1E-6)
+    assert np.allclose(ss.internals['hh']['stage0']['D'], ss_warm.internals['hh']['stage0']['D'], atol=1E-8)
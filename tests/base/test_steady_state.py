@@ -1,7 +1,9 @@
 """Test all models' steady state computations"""
 
+import copy
 import numpy as np
 
+from sequence_jacobian import create_model
 from sequence_jacobian.examples import rbc, krusell_smith, hank, two_asset
 
 
@@ -41,3 +43,69 @@ from sequence_jacobian.examples import rbc, krusell_smith, hank, two_asset
 #     _, _, _, _, ss = ks_remapped_dag
 #     assert ss['beta_impatient'] < ss['beta_patient']
 #     assert ss['A_impatient'] < ss['A_patient']
+
+
+def test_accelerated_backward_steady_state(one_asset_hank_dag, capsys):
+    _, ss, hank_model, *_ = one_asset_hank_dag
+    hh = hank_model['hh']
+
+    ss_plain = hh.steady_state(ss, verbose=True)
+    ss_anderson = hh.steady_state(ss, backward_accelerator='anderson', verbose=True)
+    plain, anderson = [int(line.split('after ')[1].split()[0]) for line in capsys.readouterr().out.splitlines()]
+    assert anderson < plain
+
+    for k in ('A', 'C', 'N'):
+        assert np.isclose(ss_anderson[k], ss_plain[k], atol=1E-6)
+    assert np.allclose(ss_anderson.internals['hh']['a'], ss_plain.internals['hh']['a'], atol=1E-5)
+
+
+def test_direct_distribution(two_asset_hank_dag):
+    _, ss, two_asset_model, *_ = two_asset_hank_dag
+    hh = two_asset_model['hh']
+
+    ss_iteration = hh.steady_state(ss)
+    for method in ('lu', 'arnoldi'):
+        ss_direct = hh.steady_state(ss, forward_method=method)
+        assert np.allclose(ss_direct.internals['hh']['Dbeg'], ss_iteration.internals['hh']['Dbeg'], atol=1E-7)
+        assert np.isclose(ss_direct['A'], ss_iteration['A'], atol=1E-5)
+
+
+def test_warm_start(one_asset_hank_dag, capsys):
+    _, ss, hank_model, *_ = one_asset_hank_dag
+    hh = copy.copy(hank_model['hh'])
+    ss_cold = hh.steady_state({**ss, 'beta': ss['beta'] + 1E-6}, backward_tol=1E-12, forward_tol=1E-14)
+
+    # warm starts tighten the default tolerances 1E-8 and 1E-10 to those of ss_cold
+    hh.steady_state(ss, warm_start=True, verbose=True)
+    ss_warm = hh.steady_state({**ss, 'beta': ss['beta'] + 1E-6}, warm_start=True, verbose=True)
+    assert np.isclose(ss_warm['A'], ss_cold['A'], atol=1E-9)
+    assert np.allclose(ss_warm.internals['hh']['a'], ss_cold.internals['hh']['a'], atol=1E-9)
+
+    # warm start is discarded when grids change
+    hh.steady_state({**ss, 'amax': 100}, warm_start=True, verbose=True)
+    iterations = [int(line.split('after ')[1].split()[0]) for line in capsys.readouterr().out.splitlines()]
+    assert iterations[1] < 0.75 * iterations[0] and iterations[2] > iterations[1]
+
+
+def test_warm_start_calibration(capsys):
+    calibration = {'eis': 1.0, 'delta': 0.025, 'alpha': 0.11, 'rho': 0.966, 'sigma': 0.5,
+                   'Y': 1.0, 'L': 1.0, 'nS': 2, 'nA': 10, 'amax': 200, 'r': 0.01}
+    unknowns_ss = {'beta': (0.98 / 1.01, 0.999 / 1.01)}
+    targets_ss = {'asset_mkt': 0.}
+
+    def calibrate(options):
+        household = krusell_smith.hh.add_hetinputs([krusell_smith.income, krusell_smith.make_grids])
+        model = create_model([household, krusell_smith.firm_ss, krusell_smith.mkt_clearing])
+        ss = model.solve_steady_state(calibration, unknowns_ss, targets_ss, solver='brentq',
+                                      options={household.name: {**options, 'verbose': True}})
+        lines = capsys.readouterr().out.splitlines()
+        return ss, [int(line.split('after ')[1].split()[0]) for line in lines if 'backward iteration' in line]
+
+    ss_cold, iterations_cold = calibrate({'backward_tol': 1E-12, 'forward_tol': 1E-14})
+    ss_warm, iterations_warm = calibrate({'warm_start': True})
+
+    # residual stays smooth enough that brentq needs no more evaluations than with cold starts,
+    # and the calibration agrees with cold starts at the same tolerances
+    assert len(iterations_warm) <= len(iterations_cold)
+    assert sum(iterations_warm) < sum(iterations_cold)
+    assert np.isclose(ss_warm['beta'], ss_cold['beta'], rtol=0, atol=1E-12)
@@ -1,6 +1,7 @@
 """Test all models' non-linear transitional dynamics computations"""
 
 import numpy as np
+import pytest
 
 from sequence_jacobian import combine
 from sequence_jacobian.examples import two_asset
@@ -122,3 +123,135 @@ def test_two_asset_solved_v_simple_td(two_asset_hank_dag):
 
     assert np.linalg.norm(dY_nonlin - dY_nonlin_simple, np.inf) < 2e-7
     assert np.linalg.norm(dY - dY_simple, np.inf) < 0.02
+
+
+def test_batch_td(krusell_smith_dag, one_asset_hank_dag):
+    _, ss, ks_model, *_ = krusell_smith_dag
+    household = ks_model['hh']
+
+    T, S = 30, 5
+    paths = np.outer(np.linspace(-0.01, 0.01, S), 0.8 ** np.arange(T))
+    for i in ('r', 'w'):
+        td_batch = household.impulse_nonlinear_batch(ss, {i: paths}, max_batch=3)
+        assert len(td_batch) == S
+        for s in range(S):
+            td = household.impulse_nonlinear(ss, {i: paths[s]})
+            for o in td:
+                assert np.allclose(td_batch[s][o], td[o], atol=1E-13)
+
+    # household whose backward_fun does not broadcast over scenarios falls back to one at a time
+    _, ss, hank_model, *_ = one_asset_hank_dag
+    household = hank_model['hh']
+    with pytest.warns(UserWarning, match='cannot batch'):
+        td_batch = household.impulse_nonlinear_batch(ss, {'w': paths[:2]}, outputs=['C'])
+    assert np.allclose(td_batch[1]['C'], household.impulse_nonlinear(ss, {'w': paths[1]}, outputs=['C'])['C'])
+
+
+def test_low_memory_td(two_asset_hank_dag):
+    _, ss, two_asset_model, *_ = two_asset_hank_dag
+    household = two_asset_model['hh']
+
+    T = 40
+    inputs = {'r': 0.001 * 0.8 ** np.arange(T), 'tax': 0.002 * 0.9 ** np.arange(T)}
+    td = household.impulse_nonlinear(ss, inputs, internals={'hh': ['Va', 'D']})
+    td_low = household.impulse_nonlinear(ss, inputs, internals={'hh': ['Va', 'D']}, low_memory=True)
+    for o in td:
+        assert np.allclose(td_low[o], td[o], atol=1E-14)
+    for k in ('Va', 'D'):
+        assert np.array_equal(td_low.internals['hh'][k], td.internals['hh'][k])
+
+
+def test_broyden_td(one_asset_hank_dag):
+    _, ss, hank_model, unknowns, targets, _ = one_asset_hank_dag
+
+    T = 100
+    J_ha = hank_model['hh'].jacobian(ss=ss, T=T, inputs=['Div', 'Tax', 'r', 'w'])
+    drstar = -0.01 * 0.7 ** np.arange(T)
+
+    logs = {}
+    for broyden in (False, True):
+        logs[broyden] = []
+        td = hank_model.solve_impulse_nonlinear(ss, unknowns, targets, {"rstar": drstar}, Js={'hh': J_ha},
+                                                broyden=broyden, line_search=True, log=logs[broyden], maxit=60,
+                                                verbose=False)
+        if not broyden:
+            td_newton = td
+
+    # quasi-Newton updates reach the same solution in far fewer evaluations
+    assert np.allclose(td['C'], td_newton['C'], atol=1E-8)
+    assert logs[True][-1]['evaluations'] < logs[False][-1]['evaluations'] / 2
+    assert [entry['iteration'] for entry in logs[True]] == list(range(len(logs[True])))
+    assert max(logs[True][-1]['errors'].values()) < 1E-8 and logs[True][0]['step'] is None
+
+
+def test_many_td(one_asset_hank_dag):
+    _, ss, hank_model, unknowns, targets, _ = one_asset_hank_dag
+
+    T = 30
+    J_ha = hank_model['hh'].jacobian(ss=ss, T=T, inputs=['Div', 'Tax', 'r', 'w'])
+    scenarios = [{'rstar': -0.0025 * 0.6 ** np.arange(T)}, {'rstar': -0.3 * 0.6 ** np.arange(T)},
+                 {'rstar': 0.002 * 0.8 ** np.arange(T)}]
+
+    # the second scenario is too large to solve, which should not affect the others
+    with pytest.warns(UserWarning, match='scenario 1'):
+        tds = hank_model.solve_impulse_nonlinear_many(ss, unknowns, targets, scenarios, outputs=['C', 'Y'],
+                                                      Js={'hh': J_ha}, n_workers=2)
+    assert tds[1] is None
+    for s in (0, 2):
+        td = hank_model.solve_impulse_nonlinear(ss, unknowns, targets, scenarios[s], outputs=['C', 'Y'],
+                                                Js={'hh': J_ha}, verbose=False)
+        for o in ('C', 'Y'):
+            assert np.array_equal(tds[s][o], td[o])
+
+    with pytest.warns(UserWarning):
+        stacked = hank_model.solve_impulse_nonlinear_many(ss, unknowns, targets, scenarios, outputs=['C'],
+                                                          Js={'hh': J_ha}, stack=True)
+    assert stacked['C'].shape == (3, T) and np.isnan(stacked['C'][1]).all()
+    assert np.array_equal(stacked['C'][2], tds[2]['C'])
+
+
+def test_compiled_td(krusell_smith_dag, two_asset_hank_dag):
+    _, ss, ks_model, *_ = krusell_smith_dag
+    household = ks_model['hh']
+
+    T = 50
+    inputs = {'r': 0.001 * 0.9 ** np.arange(T), 'w': 0.01 * 0.8 ** np.arange(T)}
+    td = household.impulse_nonlinear(ss, inputs)
+    for _ in range(2):
+        # second time uses the transition compiled the first time
+        td_compiled = household.impulse_nonlinear(ss, inputs, compiled=True)
+        for o in td:
+            assert np.allclose(td_compiled[o], td[o], atol=1E-13)
+    assert len(household._compiled_transitions) == 1
+
+    # households with two policies cannot be compiled and fall back to usual iteration
+    _, ss, two_asset_model, *_ = two_asset_hank_dag
+    household = two_asset_model['hh']
+    with pytest.warns(UserWarning, match='Cannot compile'):
+        td_compiled = household.impulse_nonlinear(ss, {'r': inputs['r']}, outputs=['C'], compiled=True)
+    assert np.array_equal(td_compiled['C'], household.impulse_nonlinear(ss, {'r': inputs['r']}, outputs=['C'])['C'])
+
+
+def test_continuation_td(one_asset_hank_dag):
+    _, ss, hank_model, unknowns, targets, _ = one_asset_hank_dag
+
+    T = 60
+    J_ha = hank_model['hh'].jacobian(ss=ss, T=T, inputs=['Div', 'Tax', 'r', 'w'])
+    drstar = -0.02 * 0.7 ** np.arange(T)
+
+    path = []
+    td = hank_model.solve_impulse_nonlinear_continuation(ss, unknowns, targets, {"rstar": drstar}, outputs=['C'],
+                                                         Js={'hh': J_ha}, first_step=0.25, path=path, broyden=True,
+                                                         verbose=False)
+    scales = [scale for scale, _ in path]
+    assert scales[-1] == 1 and all(np.diff(scales) > 0) and len(scales) > 1
+
+    td_direct = hank_model.solve_impulse_nonlinear(ss, unknowns, targets, {"rstar": drstar}, outputs=['C'],
+                                                   Js={'hh': J_ha}, broyden=True, verbose=False)
+    assert np.allclose(td['C'], td_direct['C'], atol=1E-7)
+
+    # solution for unknowns can be reused as initial guess
+    log = []
+    hank_model.solve_impulse_nonlinear(ss, unknowns, targets, {"rstar": drstar}, outputs=['C'], Js={'hh': J_ha},
+                                       U_init=path[-1][1], log=log, verbose=False)
+    assert len(log) == 1